@@ -1,6 +1,5 @@
 """Admin broadcast handlers"""
 
-import asyncio
 from datetime import datetime
 from aiogram import Router, F
 from aiogram.types import CallbackQuery, Message
@@ -11,10 +10,10 @@ from app.admin.keyboards import (
     admin_panel_kb,
     broadcast_settings_kb,
     broadcast_confirm_kb,
-    broadcast_cancel_kb
+    broadcast_cancel_kb,
+    broadcast_job_kb
 )
-from app.repo.db import get_session
-from app.repo.user import UserRepository
+from app.utils.broadcast import broadcast_engine
 from app.utils.logging import get_logger
 from config import ADMIN_TG_IDS
 
@@ -62,9 +61,12 @@ async def receive_broadcast_message(message: Message, t, state: FSMContext):
     if tg_id not in ADMIN_TG_IDS:
         return
 
-    # Save message to state
-    await state.update_data(broadcast_text=message.text or message.caption)
-    await state.update_data(message_obj=message)
+    # Save a reference to the message: it is copied to recipients, so media and formatting are kept
+    await state.update_data(
+        broadcast_text=message.text or message.caption,
+        source_chat_id=message.chat.id,
+        source_message_id=message.message_id
+    )
     await state.set_state(BroadcastState.confirming)
 
     # Show settings keyboard
@@ -131,11 +133,11 @@ async def confirm_broadcast(callback: CallbackQuery, t, state: FSMContext):
         return
 
     data = await state.get_data()
-    broadcast_text = data.get('broadcast_text')
+    broadcast_text = data.get('broadcast_text') or t('broadcast_media')
     target = data.get('target', 'all')
     schedule_time = data.get('schedule_time', 'now')
 
-    if not broadcast_text:
+    if not data.get('source_message_id'):
         await callback.message.edit_text(
             t('broadcast_error_no_message'),
             reply_markup=admin_panel_kb(t)
@@ -156,8 +158,8 @@ async def confirm_broadcast(callback: CallbackQuery, t, state: FSMContext):
 
 
 @router.callback_query(F.data == 'broadcast_execute')
-async def execute_broadcast(callback: CallbackQuery, t, state: FSMContext):
-    """Execute the broadcast"""
+async def execute_broadcast(callback: CallbackQuery, t, lang: str, state: FSMContext):
+    """Start the broadcast as a background job"""
     await safe_answer_callback(callback)
     tg_id = callback.from_user.id
 
@@ -169,49 +171,84 @@ async def execute_broadcast(callback: CallbackQuery, t, state: FSMContext):
     broadcast_text = data.get('broadcast_text')
     target = data.get('target', 'all')
 
-    await callback.message.edit_text(t('broadcast_in_progress'))
-
-    # Get users to send to
-    async with get_session() as session:
-        user_repo = UserRepository(session)
-
-        if target == 'subscribed':
-            # Only users with notifications enabled
-            users = await user_repo.get_users_with_notifications()
-        else:
-            # All users
-            users = await user_repo.get_all_users()
-
-    # Execute broadcast
-    success_count = 0
-    failed_count = 0
-
-    for user in users:
-        try:
-            await callback.bot.send_message(
-                chat_id=user.tg_id,
-                text=broadcast_text
-            )
-            success_count += 1
-            # Small delay to avoid rate limits
-            await asyncio.sleep(0.05)
-        except Exception as e:
-            LOG.error(f"Failed to send broadcast to user {user.tg_id}: {e}")
-            failed_count += 1
-
-    # Show results
-    result_text = t('broadcast_completed',
-                    total=len(users),
-                    success=success_count,
-                    failed=failed_count)
+    if not data.get('source_message_id'):
+        await callback.message.edit_text(
+            t('broadcast_error_no_message'),
+            reply_markup=admin_panel_kb(t)
+        )
+        await state.clear()
+        return
 
-    await callback.message.edit_text(
-        result_text,
-        reply_markup=admin_panel_kb(t)
+    job = await broadcast_engine.create(
+        created_by=tg_id,
+        target=target,
+        source_chat_id=data['source_chat_id'],
+        source_message_id=data['source_message_id'],
+        preview=broadcast_text,
+        lang=lang,
+        progress_chat_id=callback.message.chat.id,
+        progress_message_id=callback.message.message_id,
     )
 
     await state.clear()
-    LOG.info(f"Broadcast completed: {success_count} sent, {failed_count} failed out of {len(users)} total")
+    await callback.message.edit_text(
+        t('broadcast_in_progress'),
+        reply_markup=broadcast_job_kb(t, job.id)
+    )
+
+    broadcast_engine.run_job(job.id)
+    LOG.info(f"Broadcast {job.id} started by {tg_id}: {job.total} recipients ({target})")
+
+
+@router.callback_query(F.data.startswith('broadcast_pause_'))
+async def pause_broadcast(callback: CallbackQuery, t):
+    """Pause a running broadcast after the page in flight"""
+    tg_id = callback.from_user.id
+
+    if tg_id not in ADMIN_TG_IDS:
+        await callback.answer(t('access_denied'), show_alert=True)
+        return
+
+    if not await broadcast_engine.pause(int(callback.data.split('_')[-1])):
+        await callback.answer(t('broadcast_not_active'), show_alert=True)
+        return
+    await safe_answer_callback(callback)
+
+
+@router.callback_query(F.data.startswith('broadcast_resume_'))
+async def resume_broadcast(callback: CallbackQuery, t):
+    """Resume a paused broadcast from its cursor"""
+    tg_id = callback.from_user.id
+
+    if tg_id not in ADMIN_TG_IDS:
+        await callback.answer(t('access_denied'), show_alert=True)
+        return
+
+    job_id = int(callback.data.split('_')[-1])
+    if not await broadcast_engine.resume(job_id):
+        await callback.answer(t('broadcast_not_active'), show_alert=True)
+        return
+    await safe_answer_callback(callback)
+
+    await callback.message.edit_text(
+        t('broadcast_in_progress'),
+        reply_markup=broadcast_job_kb(t, job_id)
+    )
+
+
+@router.callback_query(F.data.startswith('broadcast_stop_'))
+async def stop_broadcast(callback: CallbackQuery, t):
+    """Cancel a running or paused broadcast"""
+    tg_id = callback.from_user.id
+
+    if tg_id not in ADMIN_TG_IDS:
+        await callback.answer(t('access_denied'), show_alert=True)
+        return
+
+    if not await broadcast_engine.cancel(int(callback.data.split('_')[-1])):
+        await callback.answer(t('broadcast_not_active'), show_alert=True)
+        return
+    await safe_answer_callback(callback)
 
 
 @router.callback_query(F.data == 'broadcast_cancel')
@@ -1,11 +1,13 @@
 """Admin server management handlers"""
 
+import asyncio
+
 from aiogram import Router, F
-from aiogram.types import CallbackQuery
+from aiogram.types import CallbackQuery, Message
 
 from app.admin.keyboards import admin_servers_kb, admin_clear_configs_confirm_kb
 from app.core.handlers.utils import safe_answer_callback
-from app.utils.config_cleanup import cleanup_expired_configs
+from app.utils.config_cleanup import cleanup_expired_configs, CleanupAlreadyRunning
 from app.api import ClientApiManager
 from app.models.server import Server, ServerTypes
 from config import ADMIN_TG_IDS, MARZBAN_BASE_URL, MARZBAN_USERNAME, MARZBAN_PASSWORD
@@ -16,6 +18,9 @@ LOG = get_logger(__name__)
 
 router = Router()
 
+# Keeps references to running cleanups so they are not garbage-collected
+_cleanup_tasks: set = set()
+
 
 @router.callback_query(F.data == 'admin_servers')
 async def admin_servers(callback: CallbackQuery, t):
@@ -123,8 +128,30 @@ async def admin_clear_configs_execute(callback: CallbackQuery, t):
     # Show "processing" message
     await callback.message.edit_text(t('admin_cleanup_started'))
 
-    # Run cleanup
-    stats = await cleanup_expired_configs(days_threshold=3)
+    # Run cleanup in the background; the message is updated with progress
+    task = asyncio.create_task(_run_config_cleanup(callback.message, t))
+    _cleanup_tasks.add(task)
+    task.add_done_callback(_cleanup_tasks.discard)
+
+
+async def _run_config_cleanup(message: Message, t):
+    async def report_progress(stats: dict, total: int):
+        await message.edit_text(t('admin_cleanup_progress',
+                                  processed=stats['total_checked'],
+                                  total=total,
+                                  deleted=stats['deleted'],
+                                  failed=stats['failed']))
+
+    try:
+        stats = await cleanup_expired_configs(days_threshold=3, progress=report_progress)
+    except CleanupAlreadyRunning:
+        await message.edit_text(t('admin_cleanup_running'), reply_markup=admin_servers_kb(t))
+        return
+    except Exception as e:
+        LOG.error(f"Config cleanup from admin panel failed: {type(e).__name__}: {e}")
+        await message.edit_text(t('admin_cleanup_failed', error=f"{type(e).__name__}: {e}"),
+                                reply_markup=admin_servers_kb(t))
+        return
 
     # Show results
     result_text = t('admin_cleanup_result',
@@ -133,7 +160,10 @@ async def admin_clear_configs_execute(callback: CallbackQuery, t):
                     failed=stats['failed'],
                     skipped=stats['skipped'])
 
-    await callback.message.edit_text(
-        result_text,
-        reply_markup=admin_servers_kb(t)
-    )
+    try:
+        await message.edit_text(
+            result_text,
+            reply_markup=admin_servers_kb(t)
+        )
+    except Exception as e:
+        LOG.warning(f"Could not show config cleanup result: {e}")
@@ -14,6 +14,8 @@ from app.admin.keyboards import admin_users_kb, admin_user_detail_kb, admin_user
 from app.repo.db import get_session
 from app.repo.models import User
 from app.repo.user import UserRepository
+from app.repo.usage import UsageRepository
+from app.api.helpers import format_bytes
 from config import ADMIN_TG_IDS
 
 
@@ -127,6 +129,10 @@ async def admin_search_user_process(message: Message, t, state: FSMContext):
         )
         user = result.scalar_one_or_none()
 
+        usage_repo = UsageRepository(session)
+        usage = await usage_repo.get_usage(search_id)
+        daily = await usage_repo.get_daily_usage(search_id, days=30)
+
     if not user:
         await message.answer(t('admin_user_not_found'))
         return
@@ -161,6 +167,14 @@ async def admin_search_user_process(message: Message, t, state: FSMContext):
 
     user_text += t('admin_user_subscription', subscription=sub_info)
 
+    # Traffic synced from the panel (app.utils.usage_sync)
+    if usage:
+        user_text += t('admin_user_traffic',
+                       used=format_bytes(usage.used_traffic),
+                       limit=format_bytes(usage.data_limit) if usage.data_limit else '∞',
+                       month=format_bytes(sum(day.traffic for day in daily)),
+                       updated_at=usage.updated_at.strftime("%Y-%m-%d %H:%M"))
+
     await message.answer(
         user_text,
         reply_markup=admin_user_detail_kb(t, user.tg_id)
@@ -281,7 +295,7 @@ async def admin_add_balance_process(message: Message, t, state: FSMContext):
     async with get_session() as session:
         user_repo = UserRepository(session)
         try:
-            new_balance = await user_repo.change_balance(user_id, amount)
+            new_balance = await user_repo.change_balance(user_id, amount, kind="admin")
             await message.answer(t('admin_balance_added', amount=amount, new_balance=new_balance))
         except ValueError as e:
             await message.answer(f"Error: {e}")
@@ -5,6 +5,8 @@ from typing import Callable
 from aiogram.types import InlineKeyboardMarkup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+from app.core.keyboards import per_lang
+
 
 def _build_keyboard(buttons_data: list[dict], adjust: list[int] | None = None):
     """Helper to build inline keyboard from button data"""
@@ -24,6 +26,7 @@ def _build_keyboard(buttons_data: list[dict], adjust: list[int] | None = None):
     return kb.as_markup()
 
 
+@per_lang
 def admin_panel_kb(t: Callable[[str], str]) -> InlineKeyboardMarkup:
     """Admin panel keyboard with various management options"""
     return _build_keyboard([
@@ -36,6 +39,7 @@ def admin_panel_kb(t: Callable[[str], str]) -> InlineKeyboardMarkup:
     ], adjust=[2, 2, 1, 1])
 
 
+@per_lang
 def admin_servers_kb(t: Callable[[str], str]) -> InlineKeyboardMarkup:
     """Server management keyboard"""
     return _build_keyboard([
@@ -44,6 +48,7 @@ def admin_servers_kb(t: Callable[[str], str]) -> InlineKeyboardMarkup:
     ])
 
 
+@per_lang
 def admin_clear_configs_confirm_kb(t: Callable[[str], str]) -> InlineKeyboardMarkup:
     """Confirmation keyboard for config cleanup"""
     return _build_keyboard([
@@ -52,6 +57,7 @@ def admin_clear_configs_confirm_kb(t: Callable[[str], str]) -> InlineKeyboardMar
     ])
 
 
+@per_lang
 def broadcast_cancel_kb(t: Callable[[str], str]) -> InlineKeyboardMarkup:
     """Cancel broadcast keyboard"""
     return _build_keyboard([
@@ -89,6 +95,7 @@ def broadcast_settings_kb(
     return _build_keyboard(buttons, adjust=[2, 1, 1, 1])
 
 
+@per_lang
 def broadcast_confirm_kb(t: Callable[[str], str]) -> InlineKeyboardMarkup:
     """Final confirmation keyboard for broadcast"""
     return _build_keyboard([
@@ -97,6 +104,19 @@ def broadcast_confirm_kb(t: Callable[[str], str]) -> InlineKeyboardMarkup:
     ], adjust=[1, 1])
 
 
+def broadcast_job_kb(t: Callable[[str], str], job_id: int, paused: bool = False) -> InlineKeyboardMarkup:
+    """Controls of a running or paused broadcast job"""
+    if paused:
+        toggle = {'text': t('broadcast_resume'), 'callback_data': f'broadcast_resume_{job_id}'}
+    else:
+        toggle = {'text': t('broadcast_pause'), 'callback_data': f'broadcast_pause_{job_id}'}
+    return _build_keyboard([
+        toggle,
+        {'text': t('broadcast_stop'), 'callback_data': f'broadcast_stop_{job_id}'},
+    ], adjust=[2])
+
+
+@per_lang
 def admin_users_kb(t: Callable[[str], str]) -> InlineKeyboardMarkup:
     """User management keyboard"""
     return _build_keyboard([
@@ -138,6 +158,7 @@ def admin_user_list_kb(t: Callable[[str], str], page: int, total_pages: int) ->
         return _build_keyboard(buttons, adjust=[1, 1])
 
 
+@per_lang
 def admin_payments_kb(t: Callable[[str], str]) -> InlineKeyboardMarkup:
     """Payments statistics keyboard"""
     return _build_keyboard([
@@ -61,6 +61,19 @@ class MarzbanApiManager(ApiRequest):
             return None
         return [MarzbanUserResponse(**user) for user in users_response["users"]]
 
+    async def get_users_page(
+        self, access: str, offset: int, limit: int
+    ) -> Optional[list[dict]]:
+        """Raw user dicts in creation order (stable paging, no model parsing for bulk reads)"""
+        users_response = await self.get(
+            endpoint="/api/users",
+            params={"offset": offset, "limit": limit, "sort": "created_at"},
+            access=access,
+        )
+        if not isinstance(users_response, dict) or "users" not in users_response:
+            return None
+        return users_response["users"]
+
     async def get_user(
         self, username: str, access: str
     ) -> Optional[MarzbanUserResponse]:
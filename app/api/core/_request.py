@@ -4,6 +4,7 @@ from typing import Optional, Union, Dict, Any, Type, TypeVar
 import httpx
 from pydantic import BaseModel
 from app.utils.logging import get_logger
+from app.utils.instrumentation import count_http_request
 
 logger = get_logger(__name__)
 
@@ -23,7 +24,11 @@ class ApiRequest(ABC):
         Initialize API client
         """
         self.host = host.rstrip("/")
-        self._client = httpx.AsyncClient(timeout=5.0, verify=False)
+        self._client = httpx.AsyncClient(
+            timeout=5.0,
+            verify=False,
+            event_hooks={"request": [count_http_request]},
+        )
 
     def _get_headers(self, access: Optional[str] = None) -> Dict[str, str]:
         """
@@ -73,10 +73,17 @@ async def add_funds_callback(callback: CallbackQuery, t):
 @router.callback_query(F.data.startswith('select_method_'))
 async def select_payment_method(callback: CallbackQuery, t):
     await safe_answer_callback(callback)
-    method = callback.data.replace('select_method_', '')
+    method_str = callback.data.replace('select_method_', '')
+    # Callback data is client-controlled; only known methods reach the (cached) keyboard
+    try:
+        method = PaymentMethod(method_str)
+    except ValueError:
+        LOG.error(f"Invalid method for user {callback.from_user.id}: {method_str}")
+        await callback.message.edit_text(t('error_creating_payment'), reply_markup=balance_kb(t))
+        return
     await callback.message.edit_text(
         t('select_amount'),
-        reply_markup=get_payment_amounts_keyboard(t, method)
+        reply_markup=get_payment_amounts_keyboard(t, method.value)
     )
 
 
@@ -316,40 +323,31 @@ async def successful_payment(message: Message, t):
 
     async with get_session() as session:
         try:
-            from app.db.models import Payment as PaymentModel, User
+            from app.db.models import Payment as PaymentModel
             from sqlalchemy import select
 
-            # CRITICAL FIX: Acquire database lock FIRST to prevent race conditions
-            result = await session.execute(
-                select(User).where(User.tg_id == tg_id).with_for_update()
-            )
-            user = result.scalar_one_or_none()
-            if not user:
-                LOG.error(f"User {tg_id} not found for Stars payment")
-                await message.answer(t('user_not_found'))
-                return
+            _, payment_repo = await get_repositories(session)
 
-            # Find pending Stars payment with lock
+            # Find the pending Stars invoice this payment belongs to
             result = await session.execute(
-                select(PaymentModel).where(
+                select(PaymentModel.id, PaymentModel.expires_at).where(
                     PaymentModel.tg_id == tg_id,
                     PaymentModel.method == 'stars',
                     PaymentModel.status == 'pending',
                     PaymentModel.amount == rub_amount
-                ).with_for_update()
+                ).order_by(PaymentModel.created_at).limit(1)
             )
-            payment = result.scalar_one_or_none()
+            payment = result.first()
 
             if not payment:
                 # Check if already confirmed
                 result = await session.execute(
-                    select(PaymentModel).where(
+                    select(PaymentModel.id).where(
                         PaymentModel.tx_hash == payment_id,
                         PaymentModel.status == 'confirmed'
                     )
                 )
-                existing = result.scalar_one_or_none()
-                if existing:
+                if result.scalar() is not None:
                     LOG.warning(f"Stars payment {payment_id} already confirmed")
                     await message.answer(t('payment_already_processed'))
                     return
@@ -361,46 +359,24 @@ async def successful_payment(message: Message, t):
             # Check if payment expired
             if payment.expires_at and datetime.utcnow() > payment.expires_at:
                 LOG.warning(f"Stars payment {payment.id} expired")
-                payment.status = 'expired'
-                await session.commit()
+                await payment_repo.update_payment_status(payment.id, 'expired')
                 await message.answer(t('payment_expired'))
                 return
 
-            # Check if tx_hash already used
-            if payment.tx_hash is not None:
-                LOG.warning(f"Payment {payment.id} already has tx_hash: {payment.tx_hash}")
+            # Status transition, duplicate check and credit in one statement
+            confirmed = await payment_repo.confirm_payment(payment.id, payment_id)
+            if not confirmed:
+                LOG.warning(f"Stars payment {payment.id} was not confirmed (already processed)")
                 await message.answer(t('payment_already_processed'))
                 return
 
-            # Store old balance for logging
-            old_balance = user.balance
-
-            # ATOMIC UPDATE
-            payment.status = 'confirmed'
-            payment.tx_hash = payment_id
-            payment.confirmed_at = datetime.utcnow()
-            user.balance += rub_amount
-            new_balance = user.balance
-
-            await session.commit()
+            LOG.info(f"Stars payment confirmed: payment_id={payment.id}, user={tg_id}, amount={rub_amount}")
 
-            LOG.info(f"Stars payment confirmed: payment_id={payment.id}, user={tg_id}, "
-                    f"amount={rub_amount}, balance: {old_balance} → {new_balance}")
-
-            # Invalidate cache
-            try:
-                user_repo, _ = await get_repositories(session)
-                redis = await user_repo.get_redis()
-                await redis.delete(f"user:{tg_id}:balance")
-            except Exception as redis_err:
-                LOG.warning(f"Redis error invalidating cache for user {tg_id}: {redis_err}")
-
-            has_active_sub = await user_repo.has_active_subscription(tg_id)
             success_text = t('payment_success', amount=float(rub_amount))
 
             await message.answer(
                 success_text,
-                reply_markup=payment_success_actions(t, has_active_sub)
+                reply_markup=payment_success_actions(t, confirmed['has_active_subscription'])
             )
 
         except Exception as e:
@@ -1,13 +1,11 @@
-from io import BytesIO
-
 from aiogram import Router, F
-from aiogram.types import CallbackQuery, LinkPreviewOptions, BufferedInputFile
+from aiogram.types import CallbackQuery, LinkPreviewOptions
 from sqlalchemy.exc import OperationalError, TimeoutError as SQLTimeoutError
-import qrcode
 
 from app.core.keyboards import actions_kb, sub_kb, qr_delete_kb
 from app.db.db import get_session
 from app.utils.logging import get_logger
+from app.utils.qr_cache import qr_cache
 from config import INSTALL_GUIDE_URLS
 from ..utils import safe_answer_callback, get_repositories, update_configs_view
 
@@ -118,24 +116,9 @@ async def qr_config(callback: CallbackQuery, t):
             return
 
         try:
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=10,
-                border=4,
-            )
-            qr.add_data(cfg['vless_link'])
-            qr.make(fit=True)
-
-            img = qr.make_image(fill_color="black", back_color="white")
-
-            bio = BytesIO()
-            img.save(bio, format='PNG')
-            bio.seek(0)
-
-            photo = BufferedInputFile(bio.read(), filename="qr_code.png")
-            await callback.message.answer_photo(
-                photo=photo,
+            await qr_cache.send(
+                callback.message,
+                cfg['vless_link'],
                 caption=t('your_config'),
                 reply_markup=qr_delete_kb(t)
             )
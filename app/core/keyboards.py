@@ -1,4 +1,5 @@
 from collections.abc import Callable
+from functools import wraps
 from typing import Any
 
 from aiogram.types import InlineKeyboardMarkup
@@ -27,6 +28,31 @@ def _build_keyboard(
         return builder.adjust(*adjust).as_markup()
 
 
+def per_lang(func: Callable[..., InlineKeyboardMarkup]) -> Callable[..., InlineKeyboardMarkup]:
+    """
+    Memoise a keyboard per (language, arguments).
+
+    For keyboards that depend only on the translator and a few bounded
+    options; anything carrying ids must stay uncached. Called with a
+    translator that has no `lang` (not from get_translator), it just builds.
+    """
+    cache: dict[tuple, InlineKeyboardMarkup] = {}
+
+    @wraps(func)
+    def wrapper(t: Callable[[str], str], *args: Any, **kwargs: Any) -> InlineKeyboardMarkup:
+        lang = getattr(t, 'lang', None)
+        if lang is None:
+            return func(t, *args, **kwargs)
+        key = (lang, args, tuple(sorted(kwargs.items())))
+        markup = cache.get(key)
+        if markup is None:
+            markup = cache[key] = func(t, *args, **kwargs)
+        return markup
+
+    return wrapper
+
+
+@per_lang
 def qr_delete_kb(t: Callable[[str], str]) -> InlineKeyboardMarkup:
     return _build_keyboard([
         {'text': t('delete_config'), 'callback_data': 'delete_qr_msg'},
@@ -34,6 +60,11 @@ def qr_delete_kb(t: Callable[[str], str]) -> InlineKeyboardMarkup:
 
 
 def main_kb(t: Callable[[str], str], user_id: int | None = None) -> InlineKeyboardMarkup:
+    return _main_kb(t, is_admin=bool(user_id and user_id in ADMIN_TG_IDS))
+
+
+@per_lang
+def _main_kb(t: Callable[[str], str], is_admin: bool) -> InlineKeyboardMarkup:
     buttons = [
         {'text': t('my_vpn'), 'callback_data': 'myvpn'},
         {'text': t('balance'), 'callback_data': 'balance'},
@@ -41,7 +72,7 @@ def main_kb(t: Callable[[str], str], user_id: int | None = None) -> InlineKeyboa
     ]
 
     # Show Admin button for admin, Help for others
-    if user_id and user_id in ADMIN_TG_IDS:
+    if is_admin:
         buttons.append({'text': t('admin'), 'callback_data': 'admin_panel'})
     else:
         buttons.append({'text': t('help'), 'url': 'https://t.me/chnddy'})
@@ -49,6 +80,7 @@ def main_kb(t: Callable[[str], str], user_id: int | None = None) -> InlineKeyboa
     return _build_keyboard(buttons, adjust=[1, 1, 2])
 
 
+@per_lang
 def balance_kb(t: Callable[[str], str], show_renew: bool = False) -> InlineKeyboardMarkup:
     """Balance screen keyboard, optionally with renew button for expired subs"""
     buttons = [{'text': t('add_funds'), 'callback_data': 'add_funds'}]
@@ -61,6 +93,7 @@ def balance_kb(t: Callable[[str], str], show_renew: bool = False) -> InlineKeybo
     return _build_keyboard(buttons)
 
 
+@per_lang
 def balance_button_kb(t: Callable[[str], str]) -> InlineKeyboardMarkup:
     """Single balance button for notifications"""
     return _build_keyboard([
@@ -68,6 +101,7 @@ def balance_button_kb(t: Callable[[str], str]) -> InlineKeyboardMarkup:
     ])
 
 
+@per_lang
 def get_renewal_notification_keyboard(t: Callable[[str], str]) -> InlineKeyboardMarkup:
     """Keyboard for subscription expiry notifications with renewal action"""
     return _build_keyboard([
@@ -76,6 +110,7 @@ def get_renewal_notification_keyboard(t: Callable[[str], str]) -> InlineKeyboard
     ], adjust=2)
 
 
+@per_lang
 def set_kb(t: Callable[[str], str]) -> InlineKeyboardMarkup:
     return _build_keyboard([
         {'text': t('referral'), 'callback_data': 'referral'},
@@ -126,6 +161,7 @@ def actions_kb(t: Callable[[str], str], cfg_id: int | None = None) -> InlineKeyb
     ], adjust=2)
 
 
+@per_lang
 def get_language_keyboard(t: Callable[[str], str]) -> InlineKeyboardMarkup:
     return _build_keyboard([
         {'text': '🇺🇸 English', 'callback_data': 'set_lang:en'},
@@ -134,6 +170,7 @@ def get_language_keyboard(t: Callable[[str], str]) -> InlineKeyboardMarkup:
     ])
 
 
+@per_lang
 def get_notifications_keyboard(t: Callable[[str], str]) -> InlineKeyboardMarkup:
     return _build_keyboard([
         {'text': t('toggle_notifications'), 'callback_data': 'toggle_notifications'},
@@ -141,6 +178,7 @@ def get_notifications_keyboard(t: Callable[[str], str]) -> InlineKeyboardMarkup:
     ])
 
 
+@per_lang
 def sub_kb(t: Callable[[str], str], is_extension: bool = False) -> InlineKeyboardMarkup:
     # Calculate savings for multi-month plans (base: 1-month price)
     monthly_price = PLANS['sub_1m']['price']
@@ -173,6 +211,7 @@ def sub_kb(t: Callable[[str], str], is_extension: bool = False) -> InlineKeyboar
     return _build_keyboard(buttons)
 
 
+@per_lang
 def get_payment_methods_keyboard(t: Callable[[str], str]) -> InlineKeyboardMarkup:
     return _build_keyboard([
         {'text': 'TON', 'callback_data': 'select_method_ton'},
@@ -190,13 +229,16 @@ def get_referral_keyboard(t: Callable[[str], str], ref_link: str) -> InlineKeybo
     ])
 
 
+@per_lang
 def back_balance(t: Callable[[str], str]) -> InlineKeyboardMarkup:
     return _build_keyboard([
         {'text': t('back'), 'callback_data': 'balance'},
     ])
 
 
+@per_lang
 def get_payment_amounts_keyboard(t: Callable[[str], str], method: str) -> InlineKeyboardMarkup:
+    # `method` must be a PaymentMethod value (validated by the caller) to keep the cache bounded
     # All methods support custom amounts
     return _build_keyboard([
         {'text': '200 RUB', 'callback_data': f'amount_{method}_200'},
@@ -207,6 +249,7 @@ def get_payment_amounts_keyboard(t: Callable[[str], str], method: str) -> Inline
     ], adjust=[3, 1, 1])
 
 
+@per_lang
 def payment_success_actions(t: Callable[[str], str], has_active_sub: bool) -> InlineKeyboardMarkup:
     """Next action buttons after successful payment"""
     if has_active_sub:
@@ -0,0 +1,104 @@
+from datetime import datetime
+from typing import Optional, List
+
+from sqlalchemy import select, update
+
+from .models import BroadcastJob
+from .base import BaseRepository
+from app.utils.logging import get_logger
+
+LOG = get_logger(__name__)
+
+ACTIVE_STATUSES = ("running", "paused")
+
+
+class BroadcastRepository(BaseRepository):
+    """Persisted broadcast jobs (see app.utils.broadcast)"""
+
+    async def create(
+        self,
+        created_by: int,
+        target: str,
+        source_chat_id: int,
+        source_message_id: int,
+        total: int,
+        preview: Optional[str] = None,
+        lang: str = "ru",
+        progress_chat_id: Optional[int] = None,
+        progress_message_id: Optional[int] = None
+    ) -> BroadcastJob:
+        job = BroadcastJob(
+            created_by=created_by,
+            status="running",
+            target=target,
+            source_chat_id=source_chat_id,
+            source_message_id=source_message_id,
+            preview=preview,
+            total=total,
+            lang=lang,
+            progress_chat_id=progress_chat_id,
+            progress_message_id=progress_message_id,
+            created_at=datetime.utcnow(),
+            started_at=datetime.utcnow(),
+        )
+        self.session.add(job)
+        await self.session.commit()
+        await self.session.refresh(job)
+        return job
+
+    async def get(self, job_id: int) -> Optional[BroadcastJob]:
+        return await self.session.get(BroadcastJob, job_id)
+
+    async def get_running(self) -> List[BroadcastJob]:
+        result = await self.session.execute(
+            select(BroadcastJob).where(BroadcastJob.status == "running").order_by(BroadcastJob.id)
+        )
+        return list(result.scalars().all())
+
+    async def save_progress(self, job_id: int, cursor: int, sent: int, failed: int, blocked: int) -> Optional[str]:
+        """
+        Advance the cursor and add this page's counters.
+
+        Returns:
+            The job status after the update, so the runner sees pause/cancel requests
+        """
+        result = await self.session.execute(
+            update(BroadcastJob)
+            .where(BroadcastJob.id == job_id)
+            .values(
+                cursor=cursor,
+                sent=BroadcastJob.sent + sent,
+                failed=BroadcastJob.failed + failed,
+                blocked=BroadcastJob.blocked + blocked,
+            )
+            .returning(BroadcastJob.status)
+        )
+        status = result.scalar_one_or_none()
+        await self.session.commit()
+        return status
+
+    async def set_status(
+        self,
+        job_id: int,
+        status: str,
+        expected: Optional[tuple] = None,
+        error: Optional[str] = None
+    ) -> bool:
+        """
+        Change the job status, optionally only from one of the `expected` statuses.
+
+        The job's error is replaced by `error` (cleared when None).
+
+        Returns:
+            Whether the job was updated
+        """
+        values = {"status": status, "error": error[:500] if error else None}
+        if status in ("cancelled", "completed"):
+            values["finished_at"] = datetime.utcnow()
+
+        stmt = update(BroadcastJob).where(BroadcastJob.id == job_id)
+        if expected:
+            stmt = stmt.where(BroadcastJob.status.in_(expected))
+        result = await self.session.execute(stmt.values(**values))
+        await self.session.commit()
+        return result.rowcount > 0
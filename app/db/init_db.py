@@ -1,14 +1,34 @@
-from app.repo.db import engine, Base
+from sqlalchemy import text
+
+from app.repo.db import engine, Base, get_session
+from app.repo.ledger import LedgerRepository
 from app.utils.logging import get_logger
 
 LOG = get_logger(__name__)
 
+# create_all only creates missing tables; schema additions to existing tables go here
+_SCHEMA_UPGRADES = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_payments_tx_hash ON payments (tx_hash)",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS blocked_at TIMESTAMP",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS delivery_failures INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS delivery_error TEXT",
+    "ALTER TABLE broadcast_jobs ADD COLUMN IF NOT EXISTS error TEXT",
+]
+
 
 async def init_database():
     try:
         async with engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
+            for statement in _SCHEMA_UPGRADES:
+                await conn.execute(text(statement))
         LOG.info("Database tables initialized successfully")
+
+        # First run with the ledger: record existing balances as opening entries
+        async with get_session() as session:
+            seeded = await LedgerRepository(session).seed_opening_balances()
+        if seeded:
+            LOG.info(f"Seeded balance ledger with {seeded} opening balances")
     except Exception as e:
         LOG.error(f"Error initializing database: {e}")
         raise
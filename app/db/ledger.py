@@ -0,0 +1,227 @@
+import uuid
+from decimal import Decimal
+from datetime import datetime
+from typing import Optional, List, Dict
+
+from sqlalchemy import select, update, func, text
+from sqlalchemy.dialects.postgresql import insert
+
+from .models import User, BalanceLedger
+from .base import BaseRepository
+from app.utils.logging import get_logger
+
+LOG = get_logger(__name__)
+
+_FOLD_PENDING_SQL = text("""
+    WITH applied AS (
+        UPDATE balance_ledger SET applied_at = :now
+        WHERE tg_id = :tg_id AND applied_at IS NULL
+        RETURNING amount
+    )
+    UPDATE users SET balance = balance + (SELECT COALESCE(SUM(amount), 0) FROM applied)
+    WHERE tg_id = :tg_id AND EXISTS (SELECT 1 FROM applied)
+""")
+
+_ROLLUP_BATCH_SQL = text("""
+    WITH batch AS (
+        SELECT id FROM balance_ledger
+        WHERE applied_at IS NULL
+        ORDER BY id
+        LIMIT :limit
+        FOR UPDATE SKIP LOCKED
+    ), applied AS (
+        UPDATE balance_ledger l SET applied_at = :now
+        FROM batch WHERE l.id = batch.id
+        RETURNING l.tg_id, l.amount
+    ), totals AS (
+        SELECT tg_id, SUM(amount) AS amount, COUNT(*) AS entries
+        FROM applied GROUP BY tg_id
+    )
+    UPDATE users u SET balance = u.balance + totals.amount
+    FROM totals WHERE u.tg_id = totals.tg_id
+    RETURNING totals.entries
+""")
+
+_AUDIT_SQL = text("""
+    SELECT u.tg_id, u.balance, COALESCE(l.applied_total, 0) AS ledger_balance
+    FROM users u
+    LEFT JOIN (
+        SELECT tg_id, SUM(amount) AS applied_total
+        FROM balance_ledger
+        WHERE applied_at IS NOT NULL
+        GROUP BY tg_id
+    ) l ON l.tg_id = u.tg_id
+    WHERE u.balance <> COALESCE(l.applied_total, 0)
+    ORDER BY u.tg_id
+    LIMIT :limit
+""")
+
+# Seeds opening entries the first time the ledger is used, so existing balances audit cleanly
+_OPENING_BALANCES_SQL = text("""
+    INSERT INTO balance_ledger (tg_id, amount, kind, idempotency_key, created_at, applied_at)
+    SELECT tg_id, balance, 'opening', 'opening:' || tg_id, :now, :now
+    FROM users
+    WHERE balance <> 0 AND NOT EXISTS (SELECT 1 FROM balance_ledger)
+    ON CONFLICT (idempotency_key) DO NOTHING
+""")
+
+
+def new_idempotency_key(kind: str, tg_id: int) -> str:
+    """Key for operations without a natural id (each call is a distinct entry)."""
+    return f"{kind}:{tg_id}:{uuid.uuid4().hex}"
+
+
+class LedgerRepository(BaseRepository):
+    """
+    Balance changes as append-only ledger entries.
+
+    users.balance is a materialised running balance. Credits are plain inserts
+    (no lock on the user row) and stay pending until folded in by the rollup or
+    by the next debit of that user. Debits fold the user's pending credits and
+    then apply a single conditional UPDATE ... RETURNING, so they can never
+    overdraw. The effective balance is users.balance plus pending credits.
+    """
+
+    async def credit(
+        self,
+        tg_id: int,
+        amount: Decimal,
+        kind: str,
+        idempotency_key: str,
+        payment_id: Optional[int] = None,
+        commit: bool = True
+    ) -> bool:
+        """
+        Append a credit entry.
+
+        Returns:
+            False if an entry with this idempotency key already exists
+        """
+        result = await self.session.execute(
+            insert(BalanceLedger)
+            .values(
+                tg_id=tg_id,
+                amount=Decimal(amount),
+                kind=kind,
+                idempotency_key=idempotency_key,
+                payment_id=payment_id,
+                created_at=datetime.utcnow(),
+            )
+            .on_conflict_do_nothing(index_elements=[BalanceLedger.idempotency_key])
+            .returning(BalanceLedger.id)
+        )
+        inserted = result.scalar() is not None
+
+        if not inserted:
+            LOG.info(f"Ledger credit {idempotency_key} already recorded, skipping")
+            return False
+
+        if commit:
+            await self.session.commit()
+            await self.invalidate_balance(tg_id)
+
+        return True
+
+    async def debit(
+        self,
+        tg_id: int,
+        amount: Decimal,
+        kind: str,
+        idempotency_key: str,
+        commit: bool = True
+    ) -> Optional[Decimal]:
+        """
+        Append a debit entry and apply it to the running balance if funds allow.
+
+        With commit=False the caller owns the transaction and must commit it;
+        on failure the transaction is always rolled back.
+
+        Returns:
+            New balance, or None if funds are insufficient or the key was already used
+        """
+        amount = Decimal(amount)
+        now = datetime.utcnow()
+
+        await self.session.execute(_FOLD_PENDING_SQL, {"tg_id": tg_id, "now": now})
+
+        result = await self.session.execute(
+            insert(BalanceLedger)
+            .values(
+                tg_id=tg_id,
+                amount=-amount,
+                kind=kind,
+                idempotency_key=idempotency_key,
+                created_at=now,
+                applied_at=now,
+            )
+            .on_conflict_do_nothing(index_elements=[BalanceLedger.idempotency_key])
+            .returning(BalanceLedger.id)
+        )
+        if result.scalar() is None:
+            await self.session.rollback()
+            LOG.info(f"Ledger debit {idempotency_key} already recorded, skipping")
+            return None
+
+        result = await self.session.execute(
+            update(User)
+            .where(User.tg_id == tg_id, User.balance >= amount)
+            .values(balance=User.balance - amount)
+            .returning(User.balance)
+        )
+        new_balance = result.scalar()
+
+        if new_balance is None:
+            await self.session.rollback()
+            LOG.info(f"Insufficient balance for user {tg_id} to debit {amount} ({kind})")
+            return None
+
+        if commit:
+            await self.session.commit()
+            await self.invalidate_balance(tg_id)
+
+        return new_balance
+
+    async def get_balance(self, tg_id: int) -> Decimal:
+        """Effective balance: running balance plus credits not yet rolled up."""
+        pending = (
+            select(func.coalesce(func.sum(BalanceLedger.amount), 0))
+            .where(BalanceLedger.tg_id == tg_id, BalanceLedger.applied_at.is_(None))
+            .scalar_subquery()
+        )
+        result = await self.session.execute(
+            select(User.balance + pending).where(User.tg_id == tg_id)
+        )
+        return result.scalar() or Decimal("0.0")
+
+    async def invalidate_balance(self, *tg_ids: int):
+        if not self.redis or not tg_ids:
+            return
+        try:
+            await self.redis.delete(*{f"user:{tg_id}:balance" for tg_id in tg_ids})
+        except Exception as e:
+            LOG.warning(f"Redis error invalidating balance cache for {tg_ids}: {e}")
+
+    # ----------------------------
+    # Rollup / audit
+    # ----------------------------
+    async def rollup(self, batch_size: int = 1000) -> int:
+        """Fold one batch of pending credits into users.balance. Returns entries applied."""
+        result = await self.session.execute(
+            _ROLLUP_BATCH_SQL, {"limit": batch_size, "now": datetime.utcnow()}
+        )
+        applied = sum(row[0] for row in result.all())
+        await self.session.commit()
+        return applied
+
+    async def seed_opening_balances(self) -> int:
+        result = await self.session.execute(_OPENING_BALANCES_SQL, {"now": datetime.utcnow()})
+        await self.session.commit()
+        return result.rowcount
+
+    async def audit(self, limit: int = 100) -> List[Dict]:
+        """Users whose running balance differs from the sum of their applied entries."""
+        result = await self.session.execute(_AUDIT_SQL, {"limit": limit})
+        return [
+            {"tg_id": row.tg_id, "balance": row.balance, "ledger_balance": row.ledger_balance}
+            for row in result.all()
+        ]
@@ -1,5 +1,5 @@
 from sqlalchemy import (
-    Column, Integer, BigInteger, String, Boolean, DateTime, Numeric, Float, Text, CHAR, ARRAY, JSON
+    Column, Integer, BigInteger, String, Boolean, DateTime, Numeric, Float, Text, CHAR, ARRAY, JSON, Index
 )
 from .db import Base
 from datetime import datetime
@@ -30,6 +30,11 @@ class Payment(Base):
     expected_crypto_amount = Column(Numeric, nullable=True)
     extra_data = Column(JSON, nullable=True)  # For storing extra data like CryptoBot invoice_id
 
+    __table_args__ = (
+        # A gateway transaction can confirm at most one payment
+        Index("uq_payments_tx_hash", "tx_hash", unique=True),
+    )
+
 class Referral(Base):
     __tablename__ = "referrals"
     id = Column(BigInteger, primary_key=True)
@@ -61,4 +66,76 @@ class User(Base):
     configs = Column(Integer, default=0)
     referrer_id = Column(BigInteger)
     first_buy = Column(Boolean, default=True)
-    notifications = Column(Boolean, default=True)
\ No newline at end of file
+    notifications = Column(Boolean, default=True)
+    # Delivery state, written in batches by app.utils.delivery; bulk sends skip unreachable users
+    blocked_at = Column(DateTime, nullable=True)  # Set when the user blocked the bot
+    delivery_failures = Column(Integer, default=0, nullable=False, server_default="0")  # Consecutive failed sends
+    delivery_error = Column(Text, nullable=True)  # Last send error
+
+class BalanceLedger(Base):
+    """
+    Append-only record of every balance change.
+
+    Rows are never updated except for applied_at, which the rollup sets when a
+    credit has been folded into users.balance. Debits are applied immediately.
+    """
+    __tablename__ = "balance_ledger"
+    id = Column(BigInteger, primary_key=True)
+    tg_id = Column(BigInteger, nullable=False, index=True)
+    amount = Column(Numeric, nullable=False)  # Positive for credits, negative for debits
+    kind = Column(String, nullable=False)  # payment, referral, subscription, renewal, admin, opening
+    idempotency_key = Column(String, nullable=False, unique=True)
+    payment_id = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    applied_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # Pending credits are looked up per user and by the rollup job
+        Index("ix_balance_ledger_pending", "tg_id", postgresql_where=applied_at.is_(None)),
+    )
+
+class Usage(Base):
+    """Latest traffic counters of each panel user, synced from the panel"""
+    __tablename__ = "usage"
+    username = Column(String, primary_key=True)
+    tg_id = Column(BigInteger, nullable=True, index=True)
+    used_traffic = Column(BigInteger, default=0)  # Bytes in the current reset period
+    lifetime_used_traffic = Column(BigInteger, default=0)
+    data_limit = Column(BigInteger, nullable=True)
+    status = Column(String)
+    online_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class UsageDaily(Base):
+    """Traffic per panel user per day (UTC), accumulated from lifetime counter deltas"""
+    __tablename__ = "usage_daily"
+    username = Column(String, primary_key=True)
+    day = Column(DateTime, primary_key=True)
+    tg_id = Column(BigInteger, nullable=True, index=True)
+    traffic = Column(BigInteger, default=0)
+
+class BroadcastJob(Base):
+    """
+    An admin broadcast. Recipients are walked in tg_id order; `cursor` is the
+    last tg_id handled, so a paused or interrupted job continues where it stopped.
+    """
+    __tablename__ = "broadcast_jobs"
+    id = Column(Integer, primary_key=True)
+    created_by = Column(BigInteger, nullable=False)
+    status = Column(String, nullable=False, default="running", index=True)  # running/paused/cancelled/completed
+    target = Column(String, nullable=False, default="all")  # all/subscribed
+    source_chat_id = Column(BigInteger, nullable=False)  # The admin message is copied to every recipient
+    source_message_id = Column(BigInteger, nullable=False)
+    preview = Column(Text)
+    cursor = Column(BigInteger, nullable=False, default=0)
+    total = Column(Integer, default=0)
+    sent = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    blocked = Column(Integer, default=0)
+    progress_chat_id = Column(BigInteger, nullable=True)  # Admin message showing live progress
+    progress_message_id = Column(BigInteger, nullable=True)
+    lang = Column(String, default="ru")
+    error = Column(Text, nullable=True)  # Why the runner paused the job
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
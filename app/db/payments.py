@@ -1,22 +1,47 @@
 from decimal import Decimal
-from typing import Optional, List, Dict, Union
+from typing import Optional, List, Dict, Tuple, Union
 from datetime import datetime, timedelta
 import asyncio
 
 
-from sqlalchemy import select, update, func
+from sqlalchemy import select, update, func, text
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.payments.models import PaymentMethod
 from app.repo.models import Payment as PaymentModel, TonTransaction
 from .db import get_session
 from app.utils.logging import get_logger
+from app.utils.instrumentation import incr_counter
 from .base import BaseRepository
 from config import PAYMENT_TIMEOUT_MINUTES
 
 LOG = get_logger(__name__)
 
 
+_CONFIRM_PAYMENTS_SQL = text("""
+    WITH input AS (
+        SELECT * FROM unnest(CAST(:payment_ids AS integer[]), CAST(:tx_hashes AS text[])) AS i(id, tx_hash)
+    ), confirmed AS (
+        UPDATE payments p
+        SET status = 'confirmed', tx_hash = i.tx_hash, confirmed_at = :now
+        FROM input i
+        WHERE p.id = i.id AND p.status = ANY(CAST(:statuses AS text[])) AND p.tx_hash IS NULL
+        RETURNING p.id, p.tg_id, p.amount, p.tx_hash, p.method
+    ), credited AS (
+        INSERT INTO balance_ledger (tg_id, amount, kind, idempotency_key, payment_id, created_at)
+        SELECT tg_id, amount, 'payment', 'payment:' || id, id, :now FROM confirmed
+        ON CONFLICT (idempotency_key) DO NOTHING
+        RETURNING payment_id
+    )
+    SELECT c.id, c.tg_id, c.amount, c.tx_hash, c.method, u.lang, u.subscription_end,
+           cr.payment_id IS NOT NULL AS credited
+    FROM confirmed c
+    LEFT JOIN credited cr ON cr.payment_id = c.id
+    LEFT JOIN users u ON u.tg_id = c.tg_id
+""")
+
+
 class PaymentRepository(BaseRepository):
     async def create_payment(
         self,
@@ -46,6 +71,7 @@ class PaymentRepository(BaseRepository):
         self.session.add(payment)
         await self.session.commit()
         await self.session.refresh(payment)
+        await incr_counter("payments_created", method=method)
         return payment.id
 
     async def get_payment(self, payment_id: int) -> Optional[Dict]:
@@ -94,45 +120,13 @@ class PaymentRepository(BaseRepository):
         await self.session.execute(stmt)
         await self.session.commit()
 
-    async def mark_payment_processed(self, payment_id: str, tg_id: int, amount: Decimal) -> bool:
-        """Mark Telegram Stars payment as processed"""
-        result = await self.session.execute(
-            select(PaymentModel).where(
-                PaymentModel.tx_hash == payment_id,
-                PaymentModel.tg_id == tg_id,
-                PaymentModel.status == 'pending'
-            )
-        )
-        payment = result.scalar_one_or_none()
-        if not payment:
-            LOG.warning(f"Payment {payment_id} not found or already processed for user {tg_id}")
-            return False
-
-        payment.status = 'confirmed'
-        payment.confirmed_at = datetime.utcnow()
-        await self.session.commit()
-        LOG.info(f"Payment {payment_id} marked as processed for user {tg_id}, amount {amount}")
-        return True
-
-    async def mark_payment_processed_with_lock(self, payment_id: str, tg_id: int, amount: Decimal) -> bool:
-        """Mark Telegram Stars payment as processed with database lock to prevent race conditions"""
-        result = await self.session.execute(
-            select(PaymentModel).where(
-                PaymentModel.tx_hash == payment_id,
-                PaymentModel.tg_id == tg_id,
-                PaymentModel.status == 'pending'
-            ).with_for_update()
-        )
-        payment = result.scalar_one_or_none()
-        if not payment:
-            LOG.warning(f"Payment {payment_id} not found or already processed for user {tg_id}")
-            return False
-
-        payment.status = 'confirmed'
-        payment.confirmed_at = datetime.utcnow()
-        await self.session.commit()
-        LOG.info(f"Payment {payment_id} marked as processed for user {tg_id}, amount {amount}")
-        return True
+    @staticmethod
+    async def _count_confirmed(confirmed: List[Dict]):
+        methods: Dict[str, int] = {}
+        for item in confirmed:
+            methods[item['method']] = methods.get(item['method'], 0) + 1
+        for method, count in methods.items():
+            await incr_counter("payments_confirmed", count, method=method)
 
     async def get_pending_ton_transaction(self, comment: str, amount: Decimal) -> Optional[TonTransaction]:
         """Get pending TON transaction by comment and amount"""
@@ -141,9 +135,239 @@ class PaymentRepository(BaseRepository):
                 TonTransaction.comment == comment,
                 TonTransaction.amount >= amount * Decimal("0.95"),
                 TonTransaction.processed_at == None
-            ).order_by(TonTransaction.created_at.desc())
+            ).order_by(TonTransaction.created_at.desc()).limit(1)
         )
-        return result.scalar_one_or_none()
+        return result.scalars().first()
+
+    async def confirm_payments(
+        self,
+        confirmations: List[Tuple[int, str]],
+        allow_expired: bool = False,
+        commit: bool = True
+    ) -> List[Dict]:
+        """
+        Confirm payments and credit their amounts in a single statement.
+
+        The status transition, the duplicate check (unique index on tx_hash) and the
+        ledger credit happen in one CTE round-trip; no user-row lock is taken.
+        Payments that are no longer open or already carry a tx_hash are skipped.
+
+        Args:
+            confirmations: (payment_id, tx_hash) pairs
+            allow_expired: Whether to allow confirming expired payments (late payments)
+            commit: Commit on success; with False the caller owns the transaction
+
+        Returns:
+            One dict per confirmed payment: payment_id, tg_id, amount, tx_hash, method, lang,
+            has_active_subscription. Empty if nothing was confirmed or a tx_hash
+            is already used (only the statement's savepoint is rolled back then).
+        """
+        if not confirmations:
+            return []
+
+        now = datetime.utcnow()
+        statuses = ['pending', 'expired'] if allow_expired else ['pending']
+
+        # A savepoint, so a rejected batch never discards the caller's own changes
+        savepoint = await self.session.begin_nested()
+        try:
+            result = await self.session.execute(_CONFIRM_PAYMENTS_SQL, {
+                "payment_ids": [payment_id for payment_id, _ in confirmations],
+                "tx_hashes": [tx_hash for _, tx_hash in confirmations],
+                "statuses": statuses,
+                "now": now,
+            })
+            rows = result.all()
+        except IntegrityError as e:
+            await savepoint.rollback()
+            LOG.warning(f"Transaction hash already used, confirmation rejected: {confirmations}: {e.orig}")
+            return []
+
+        if any(not row.credited for row in rows):
+            await savepoint.rollback()
+            LOG.error(f"Ledger already holds a credit for one of the payments {confirmations}, rolled back")
+            return []
+
+        await savepoint.commit()
+        if commit:
+            await self.session.commit()
+
+        confirmed = [{
+            'payment_id': row.id,
+            'tg_id': row.tg_id,
+            'amount': row.amount,
+            'tx_hash': row.tx_hash,
+            'method': row.method,
+            'lang': row.lang,
+            'has_active_subscription': bool(row.subscription_end and row.subscription_end > now),
+        } for row in rows]
+
+        if commit and confirmed and self.redis:
+            try:
+                await self.redis.delete(*{f"user:{item['tg_id']}:balance" for item in confirmed})
+            except Exception as e:
+                LOG.warning(f"Redis error invalidating balance cache after confirmation: {e}")
+        if commit:
+            await self._count_confirmed(confirmed)
+
+        for item in confirmed:
+            LOG.info(f"Payment confirmed: id={item['payment_id']}, user={item['tg_id']}, "
+                     f"amount={item['amount']}, tx_hash={item['tx_hash']}")
+
+        return confirmed
+
+    async def confirm_payment(
+        self,
+        payment_id: int,
+        tx_hash: str,
+        allow_expired: bool = False
+    ) -> Optional[Dict]:
+        """Confirm a single payment (see confirm_payments). Returns None if not confirmed."""
+        confirmed = await self.confirm_payments([(payment_id, tx_hash)], allow_expired=allow_expired)
+        return confirmed[0] if confirmed else None
+
+    async def match_ton_transactions(self, expired_hours: int = 1) -> Dict[str, List[Dict]]:
+        """
+        Match all unprocessed TON transactions against open TON payments in one pass.
+
+        Transactions and candidate payments are each loaded once and joined by comment
+        in memory. All matches are confirmed with one confirm_payments statement in
+        the same transaction that marks the transactions processed.
+
+        Transactions that cannot be matched (no comment, unknown comment, payment no
+        longer open, underpayment, hash already used) are marked processed so they are
+        reported only once.
+        Candidate payments are locked without skipping, so a payment briefly held by
+        another transaction is waited for instead of being reported as unknown.
+
+        Args:
+            expired_hours: How many hours back to accept late payments for expired invoices
+
+        Returns:
+            Dict with 'confirmed' (tg_id, amount, payment_id, tx_hash, lang,
+            has_active_subscription) and 'unmatched' (tx_hash, amount, comment,
+            sender, reason) lists
+        """
+        now = datetime.utcnow()
+        stats: Dict[str, List[Dict]] = {'confirmed': [], 'unmatched': []}
+
+        try:
+            result = await self.session.execute(
+                select(TonTransaction)
+                .where(TonTransaction.processed_at == None)
+                .order_by(TonTransaction.created_at)
+                .with_for_update(skip_locked=True)
+            )
+            txs = result.scalars().all()
+            if not txs:
+                await self.session.rollback()
+                return stats
+
+            comments = {tx.comment for tx in txs if tx.comment}
+            payments_by_comment: Dict[str, PaymentModel] = {}
+            if comments:
+                result = await self.session.execute(
+                    select(PaymentModel)
+                    .where(
+                        PaymentModel.method == PaymentMethod.TON.value,
+                        PaymentModel.comment.in_(comments),
+                        PaymentModel.tx_hash == None,
+                        (PaymentModel.status == 'pending') | (
+                            (PaymentModel.status == 'expired')
+                            & (PaymentModel.created_at > now - timedelta(hours=expired_hours))
+                        )
+                    )
+                    .order_by(PaymentModel.id)
+                    # Wait for rows held by expiry cleanup or a concurrent check rather
+                    # than skipping them: a skipped payment would leave its tx reported
+                    # as unknown and never retried
+                    .with_for_update()
+                )
+                payments_by_comment = {p.comment: p for p in result.scalars().all()}
+
+            # Comments of TON payments that exist but are no longer open
+            closed_comments = set()
+            missing = comments - payments_by_comment.keys()
+            if missing:
+                result = await self.session.execute(
+                    select(PaymentModel.comment).where(
+                        PaymentModel.method == PaymentMethod.TON.value,
+                        PaymentModel.comment.in_(missing)
+                    )
+                )
+                closed_comments = set(result.scalars().all())
+
+            def unmatched(tx: TonTransaction, reason: str, payment_id: Optional[int]) -> Dict:
+                return {
+                    'tx_hash': tx.tx_hash,
+                    'amount': tx.amount,
+                    'comment': tx.comment,
+                    'sender': tx.sender,
+                    'reason': reason,
+                    'payment_id': payment_id,
+                }
+
+            matches = []
+            for tx in txs:
+                tx.processed_at = now
+                payment = payments_by_comment.pop(tx.comment, None) if tx.comment else None
+
+                if payment is None:
+                    if not tx.comment:
+                        reason = 'no_comment'
+                    elif tx.comment in closed_comments:
+                        reason = 'closed_payment'
+                    else:
+                        reason = 'unknown_comment'
+                elif tx.amount < payment.expected_crypto_amount * Decimal("0.95"):
+                    reason = 'underpaid'
+                else:
+                    matches.append((tx, payment))
+                    closed_comments.add(tx.comment)  # Another tx with this comment finds it paid
+                    continue
+
+                stats['unmatched'].append(unmatched(tx, reason, payment.id if payment else None))
+
+            for _, payment in matches:
+                if payment.status == 'expired':
+                    LOG.warning(f"Recovering expired payment {payment.id} - late confirmation")
+
+            matches = [(tx, payment.id) for tx, payment in matches]
+            confirmed = await self.confirm_payments(
+                [(payment_id, tx.tx_hash) for tx, payment_id in matches],
+                allow_expired=True,
+                commit=False
+            )
+            done = {item['payment_id'] for item in confirmed}
+            if len(done) < len(matches):
+                # One tx whose hash is already used rejects the whole statement:
+                # confirm the rest one by one and report the offenders as processed
+                for tx, payment_id in matches:
+                    if payment_id in done:
+                        continue
+                    single = await self.confirm_payments(
+                        [(payment_id, tx.tx_hash)], allow_expired=True, commit=False
+                    )
+                    if single:
+                        confirmed += single
+                    else:
+                        stats['unmatched'].append(unmatched(tx, 'duplicate_tx', payment_id))
+            stats['confirmed'] = confirmed
+            await self.session.commit()
+        except Exception:
+            await self.session.rollback()
+            raise
+
+        if stats['confirmed'] and self.redis:
+            try:
+                await self.redis.delete(
+                    *{f"user:{item['tg_id']}:balance" for item in stats['confirmed']}
+                )
+            except Exception as e:
+                LOG.warning(f"Redis error invalidating balance cache after TON matching: {e}")
+        await self._count_confirmed(stats['confirmed'])
+
+        return stats
 
     async def is_tx_hash_already_used(self, tx_hash: str) -> bool:
         """Check if a transaction hash has already been used for a confirmed payment"""
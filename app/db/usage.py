@@ -0,0 +1,112 @@
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict
+
+from sqlalchemy import select, delete, text
+
+from .models import Usage, UsageDaily
+from .base import BaseRepository
+from app.utils.logging import get_logger
+
+LOG = get_logger(__name__)
+
+# Upserts one page of panel users. Rows whose counters did not change are not
+# written (the WHERE on DO UPDATE), and the lifetime-counter delta of changed
+# rows is added to today's history row. `prev` reads the snapshot from before
+# the upsert, so the delta is computed in the same statement.
+_UPSERT_PAGE_SQL = text("""
+    WITH incoming AS (
+        SELECT * FROM unnest(
+            CAST(:usernames AS text[]),
+            CAST(:tg_ids AS bigint[]),
+            CAST(:used AS bigint[]),
+            CAST(:lifetime AS bigint[]),
+            CAST(:limits AS bigint[]),
+            CAST(:statuses AS text[]),
+            CAST(:online AS timestamp[])
+        ) AS t(username, tg_id, used_traffic, lifetime_used_traffic, data_limit, status, online_at)
+    ), prev AS (
+        SELECT u.username, u.used_traffic, u.lifetime_used_traffic
+        FROM usage u JOIN incoming i ON i.username = u.username
+    ), upserted AS (
+        INSERT INTO usage (username, tg_id, used_traffic, lifetime_used_traffic, data_limit, status, online_at, updated_at)
+        SELECT username, tg_id, used_traffic, lifetime_used_traffic, data_limit, status, online_at, :now
+        FROM incoming
+        ON CONFLICT (username) DO UPDATE SET
+            tg_id = EXCLUDED.tg_id,
+            used_traffic = EXCLUDED.used_traffic,
+            lifetime_used_traffic = EXCLUDED.lifetime_used_traffic,
+            data_limit = EXCLUDED.data_limit,
+            status = EXCLUDED.status,
+            online_at = EXCLUDED.online_at,
+            updated_at = EXCLUDED.updated_at
+        WHERE (usage.used_traffic, usage.lifetime_used_traffic, usage.data_limit, usage.status, usage.online_at)
+              IS DISTINCT FROM
+              (EXCLUDED.used_traffic, EXCLUDED.lifetime_used_traffic, EXCLUDED.data_limit, EXCLUDED.status, EXCLUDED.online_at)
+        RETURNING username, tg_id, used_traffic, lifetime_used_traffic, data_limit
+    ), history AS (
+        INSERT INTO usage_daily (username, day, tg_id, traffic)
+        SELECT up.username, :day, up.tg_id,
+               GREATEST(up.lifetime_used_traffic - COALESCE(p.lifetime_used_traffic, up.lifetime_used_traffic), 0)
+        FROM upserted up LEFT JOIN prev p ON p.username = up.username
+        WHERE up.lifetime_used_traffic > COALESCE(p.lifetime_used_traffic, up.lifetime_used_traffic)
+        ON CONFLICT (username, day) DO UPDATE SET traffic = usage_daily.traffic + EXCLUDED.traffic
+    )
+    SELECT up.username, up.tg_id, up.used_traffic, up.data_limit, COALESCE(p.used_traffic, 0) AS prev_used_traffic
+    FROM upserted up LEFT JOIN prev p ON p.username = up.username
+""")
+
+
+class UsageRepository(BaseRepository):
+    """Traffic usage synced from the panel (see app.utils.usage_sync)"""
+
+    async def upsert_page(self, rows: List[Dict], now: Optional[datetime] = None) -> List[Dict]:
+        """
+        Store one page of panel users with a single multi-row upsert.
+
+        Args:
+            rows: Dicts with username, tg_id, used_traffic, lifetime_used_traffic,
+                  data_limit, status, online_at
+            now: Sync time (defaults to utcnow)
+
+        Returns:
+            Changed rows: username, tg_id, used_traffic, data_limit, prev_used_traffic
+        """
+        if not rows:
+            return []
+
+        now = now or datetime.utcnow()
+        result = await self.session.execute(_UPSERT_PAGE_SQL, {
+            "usernames": [r["username"] for r in rows],
+            "tg_ids": [r["tg_id"] for r in rows],
+            "used": [r["used_traffic"] for r in rows],
+            "lifetime": [r["lifetime_used_traffic"] for r in rows],
+            "limits": [r["data_limit"] for r in rows],
+            "statuses": [r["status"] for r in rows],
+            "online": [r["online_at"] for r in rows],
+            "now": now,
+            "day": now.replace(hour=0, minute=0, second=0, microsecond=0),
+        })
+        changed = [dict(row._mapping) for row in result.all()]
+        await self.session.commit()
+        return changed
+
+    async def get_usage(self, tg_id: int) -> Optional[Usage]:
+        result = await self.session.execute(
+            select(Usage).where(Usage.tg_id == tg_id).order_by(Usage.updated_at.desc()).limit(1)
+        )
+        return result.scalars().first()
+
+    async def get_daily_usage(self, tg_id: int, days: int = 30) -> List[UsageDaily]:
+        since = datetime.utcnow() - timedelta(days=days)
+        result = await self.session.execute(
+            select(UsageDaily)
+            .where(UsageDaily.tg_id == tg_id, UsageDaily.day >= since)
+            .order_by(UsageDaily.day)
+        )
+        return list(result.scalars().all())
+
+    async def prune_history(self, keep_days: int = 90) -> int:
+        cutoff = datetime.utcnow() - timedelta(days=keep_days)
+        result = await self.session.execute(delete(UsageDaily).where(UsageDaily.day < cutoff))
+        await self.session.commit()
+        return result.rowcount
@@ -2,14 +2,15 @@ import json
 import re
 import time
 from decimal import Decimal
-from datetime import datetime
-from typing import Optional, List, Dict
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Tuple
 from urllib.parse import urlparse, urlunparse
 
-from sqlalchemy import select, update, func
+from sqlalchemy import select, update, func, text, and_, or_
 
 from .models import User, Config
 from .db import get_session
+from .ledger import LedgerRepository, new_idempotency_key
 from app.api import ClientApiManager
 from app.models.server import Server, ServerTypes
 from config import (
@@ -19,8 +20,12 @@ from config import (
     MAX_IPS_PER_CONFIG,
     REFERRAL_BONUS,
     REDIS_TTL,
+    DELIVERY_MAX_FAILURES,
 )
 from app.utils.logging import get_logger
+from app.utils.lifecycle import schedule_subscription_events
+from app.utils.qr_cache import qr_cache
+from app.utils.instrumentation import incr_counter
 from .base import BaseRepository
 from config import REFERRAL_BONUS, REDIS_TTL
 
@@ -32,6 +37,98 @@ CACHE_TTL_SUB_END = 3600
 CACHE_TTL_LANG = 86400
 CACHE_TTL_NOTIFICATIONS = 3600
 
+# Folds pending credits of renewal candidates so the balance check sees them
+_FOLD_RENEWAL_CANDIDATES_SQL = text("""
+    WITH applied AS (
+        UPDATE balance_ledger l SET applied_at = :now
+        FROM users u
+        WHERE l.tg_id = u.tg_id AND l.applied_at IS NULL
+          AND u.subscription_end BETWEEN :now AND :threshold
+        RETURNING l.tg_id, l.amount
+    ), totals AS (
+        SELECT tg_id, SUM(amount) AS amount FROM applied GROUP BY tg_id
+    )
+    UPDATE users u SET balance = u.balance + totals.amount
+    FROM totals WHERE u.tg_id = totals.tg_id
+""")
+
+# One batch of renewals: lock eligible users, debit through the ledger (the
+# idempotency key makes it once per user per day), extend the subscription and
+# pay first-purchase referral bonuses, returning what the panel and notifications need
+_BULK_RENEW_SQL = text("""
+    WITH eligible AS (
+        SELECT tg_id, first_buy, referrer_id FROM users
+        WHERE tg_id = ANY(:tg_ids)
+          AND subscription_end BETWEEN :now AND :threshold
+          AND balance >= CAST(:price AS numeric)
+        FOR UPDATE SKIP LOCKED
+    ), debits AS (
+        INSERT INTO balance_ledger (tg_id, amount, kind, idempotency_key, created_at, applied_at)
+        SELECT tg_id, -CAST(:price AS numeric), 'renewal',
+               'renewal:' || tg_id || ':' || CAST(:day AS text), :now, :now
+        FROM eligible
+        ON CONFLICT (idempotency_key) DO NOTHING
+        RETURNING tg_id
+    ), renewed AS (
+        UPDATE users u SET
+            balance = u.balance - CAST(:price AS numeric),
+            subscription_end = GREATEST(u.subscription_end, :now) + make_interval(days => CAST(:days AS int)),
+            first_buy = false
+        FROM debits d WHERE u.tg_id = d.tg_id
+        RETURNING u.tg_id, u.lang, u.balance, u.subscription_end,
+                  (u.blocked_at IS NULL AND u.delivery_failures < :max_failures) AS reachable
+    ), referrals AS (
+        INSERT INTO balance_ledger (tg_id, amount, kind, idempotency_key, created_at)
+        SELECT e.referrer_id, CAST(:bonus AS numeric), 'referral', 'referral_first_buy:' || e.tg_id, :now
+        FROM eligible e JOIN debits d ON d.tg_id = e.tg_id
+        WHERE e.first_buy AND e.referrer_id IS NOT NULL
+        ON CONFLICT (idempotency_key) DO NOTHING
+        RETURNING tg_id
+    )
+    SELECT r.tg_id, r.lang, r.balance, r.subscription_end, r.reachable,
+           COALESCE(array_agg(c.username) FILTER (WHERE c.username IS NOT NULL), '{}') AS usernames,
+           (SELECT array_agg(tg_id) FROM referrals) AS referrers
+    FROM renewed r
+    LEFT JOIN configs c ON c.tg_id = r.tg_id AND c.deleted = false
+    GROUP BY r.tg_id, r.lang, r.balance, r.subscription_end, r.reachable
+""")
+
+# Folds a batch of send outcomes into users. 'sent' and 'active' (the user
+# interacted) reset the state; 'blocked' and 'failed' add to the failure streak.
+# Rows already in the target state are not written. Returns whether each
+# touched user is now unreachable.
+_APPLY_DELIVERY_SQL = text("""
+    UPDATE users u SET
+        blocked_at = CASE
+            WHEN r.status = 'blocked' THEN COALESCE(u.blocked_at, :now)
+            WHEN r.status IN ('sent', 'active') THEN NULL
+            ELSE u.blocked_at
+        END,
+        delivery_failures = CASE
+            WHEN r.status IN ('sent', 'active') THEN 0
+            ELSE u.delivery_failures + r.failures
+        END,
+        delivery_error = CASE
+            WHEN r.status IN ('sent', 'active') THEN NULL
+            ELSE r.error
+        END
+    FROM unnest(
+        CAST(:tg_ids AS bigint[]),
+        CAST(:statuses AS text[]),
+        CAST(:failures AS int[]),
+        CAST(:errors AS text[])
+    ) AS r(tg_id, status, failures, error)
+    WHERE u.tg_id = r.tg_id
+      AND (r.status NOT IN ('sent', 'active') OR u.blocked_at IS NOT NULL OR u.delivery_failures > 0)
+    RETURNING u.tg_id, (u.blocked_at IS NOT NULL OR u.delivery_failures >= :max_failures) AS unreachable
+""")
+
+
+def reachable_users():
+    """Condition for users bulk sends should still try (see app.utils.delivery)"""
+    return and_(User.blocked_at.is_(None), User.delivery_failures < DELIVERY_MAX_FAILURES)
+
+
 class UserRepository(BaseRepository):
 
     @staticmethod
@@ -59,9 +156,8 @@ class UserRepository(BaseRepository):
             LOG.warning(f"Redis error reading balance for user {tg_id}: {e}")
             # Continue to database fallback
 
-        # Fallback to database
-        result = await self.session.execute(select(User.balance).filter_by(tg_id=tg_id))
-        balance = result.scalar() or Decimal("0.0")
+        # Fallback to database (running balance plus credits not yet rolled up)
+        balance = await LedgerRepository(self.session, redis).get_balance(tg_id)
 
         # Try to cache the result, but don't fail if Redis is down
         try:
@@ -72,12 +168,18 @@ class UserRepository(BaseRepository):
 
         return balance
 
-    async def change_balance(self, tg_id: int, amount: Decimal) -> Decimal:
+    async def change_balance(
+        self,
+        tg_id: int,
+        amount: Decimal,
+        kind: str = "adjustment",
+        idempotency_key: Optional[str] = None
+    ) -> Decimal:
         """
-        Change user balance atomically with SELECT FOR UPDATE lock.
+        Change user balance through the balance ledger.
 
-        CRITICAL: This method now uses row-level locking to prevent lost updates
-        from concurrent balance modifications (race conditions).
+        Credits are appended without locking the user row; debits are applied with
+        a conditional UPDATE so the balance can never go negative.
 
         Returns:
             New balance after change
@@ -86,40 +188,21 @@ class UserRepository(BaseRepository):
             ValueError: If user not found or insufficient balance
         """
         redis = await self.get_redis()
-
-        # CRITICAL FIX: Lock user row BEFORE reading balance
-        # This prevents race conditions where two concurrent updates both read
-        # the same balance value and one update gets lost
-        result = await self.session.execute(
-            select(User)
-            .where(User.tg_id == tg_id)
-            .with_for_update()  # Acquire exclusive lock on row
-        )
-        user = result.scalar_one_or_none()
-
-        if not user:
-            raise ValueError(f"User {tg_id} not found")
-
-        old_balance = user.balance
-        new_balance = old_balance + amount
-
-        # Prevent negative balance
-        if new_balance < 0:
-            raise ValueError(f"Insufficient balance: {old_balance} + {amount} = {new_balance}")
-
-        # Update locked row
-        user.balance = new_balance
-        await self.session.commit()
-
-        LOG.info(f"Balance changed for user {tg_id}: {old_balance} → {new_balance} ({amount:+.2f})")
-
-        # Invalidate cache after successful commit (tolerate Redis failures)
-        try:
-            await redis.delete(f"user:{tg_id}:balance")
-        except Exception as e:
-            LOG.warning(f"Redis error invalidating balance cache for user {tg_id}: {e}")
-            # Don't fail the transaction - balance was successfully updated in database
-
+        amount = Decimal(amount)
+        ledger = LedgerRepository(self.session, redis)
+        idempotency_key = idempotency_key or new_idempotency_key(kind, tg_id)
+
+        if amount >= 0:
+            if await self.session.get(User, tg_id) is None:
+                raise ValueError(f"User {tg_id} not found")
+            await ledger.credit(tg_id, amount, kind, idempotency_key)
+            new_balance = await ledger.get_balance(tg_id)
+        else:
+            new_balance = await ledger.debit(tg_id, -amount, kind, idempotency_key)
+            if new_balance is None:
+                raise ValueError(f"Insufficient balance or user {tg_id} not found for change {amount}")
+
+        LOG.info(f"Balance changed for user {tg_id}: {amount:+.2f} ({kind}) → {new_balance}")
         return new_balance
 
     # ----------------------------
@@ -136,6 +219,10 @@ class UserRepository(BaseRepository):
 
         user = await self.session.get(User, tg_id)
         if user:
+            # Came back after blocking the bot: reachable again
+            if user.blocked_at is not None:
+                user.blocked_at = None
+                await self.session.commit()
             return False
 
         new_user = User(
@@ -152,14 +239,18 @@ class UserRepository(BaseRepository):
         self.session.add(new_user)
 
         if referrer_id:
-            await self.session.execute(
-                update(User)
-                .where(User.tg_id == referrer_id)
-                .values(balance=User.balance + REFERRAL_BONUS)
+            await LedgerRepository(self.session, redis).credit(
+                referrer_id,
+                Decimal(str(REFERRAL_BONUS)),
+                "referral",
+                f"referral_signup:{tg_id}",
+                commit=False
             )
-            await redis.delete(f"user:{referrer_id}:balance")
 
         await self.session.commit()
+
+        if referrer_id:
+            await redis.delete(f"user:{referrer_id}:balance")
         return True
 
     # ----------------------------
@@ -293,6 +384,7 @@ class UserRepository(BaseRepository):
             return
 
         username = cfg.username
+        vless_link = cfg.vless_link
 
         cfg.deleted = True
         await self.session.execute(
@@ -306,6 +398,7 @@ class UserRepository(BaseRepository):
             await self._safe_remove_marzban_user(username)
 
         await redis.delete(f"user:{tg_id}:configs")
+        await qr_cache.invalidate([vless_link])
 
     # ----------------------------
     # Language
@@ -406,6 +499,7 @@ class UserRepository(BaseRepository):
         await self.session.commit()
 
         await redis.setex(f"user:{tg_id}:sub_end", CACHE_TTL_SUB_END, str(timestamp))
+        await schedule_subscription_events(redis, [(tg_id, expire_dt)])
 
         if usernames:
             import asyncio
@@ -420,41 +514,48 @@ class UserRepository(BaseRepository):
             return False
         return time.time() < sub_end
 
-    async def buy_subscription(self, tg_id: int, days: int, price: float) -> bool:
+    async def buy_subscription(
+        self,
+        tg_id: int,
+        days: int,
+        price: float,
+        idempotency_key: Optional[str] = None
+    ) -> bool:
         redis = await self.get_redis()
         price_decimal = Decimal(str(price))
         now_ts = time.time()
 
-        result = await self.session.execute(
-            select(User).where(User.tg_id == tg_id).with_for_update()
+        ledger = LedgerRepository(self.session, redis)
+        new_balance = await ledger.debit(
+            tg_id,
+            price_decimal,
+            "subscription",
+            idempotency_key or new_idempotency_key("subscription", tg_id),
+            commit=False
         )
-        user = result.scalar_one_or_none()
-        if not user:
-            LOG.warning(f"User {tg_id} not found during subscription purchase")
+        if new_balance is None:
+            LOG.info(f"User {tg_id} not found or has insufficient balance for {price_decimal}")
             return False
 
-        if user.balance < price_decimal:
-            LOG.info(f"User {tg_id} has insufficient balance: {user.balance} < {price_decimal}")
-            return False
-
-        new_balance = user.balance - price_decimal
-        user.balance = new_balance
+        # The debit already holds the row lock on this user
+        result = await self.session.execute(select(User).where(User.tg_id == tg_id))
+        user = result.scalar_one()
 
         current_sub_ts = user.subscription_end.timestamp() if user.subscription_end else now_ts
         new_end_ts = max(current_sub_ts, now_ts) + days * 86400
         user.subscription_end = datetime.fromtimestamp(new_end_ts)
 
+        referrer_credited = None
         if user.first_buy:
             user.first_buy = False
-            if user.referrer_id:
-                ref_result = await self.session.execute(
-                    select(User).where(User.tg_id == user.referrer_id)
-                )
-                ref_user = ref_result.scalar_one_or_none()
-                if ref_user:
-                    ref_user.balance += Decimal(str(REFERRAL_BONUS))
-                    await redis.delete(f"user:{user.referrer_id}:balance")
-                    LOG.info(f"Referral bonus {REFERRAL_BONUS} credited to {user.referrer_id} from {tg_id}")
+            if user.referrer_id and await ledger.credit(
+                user.referrer_id,
+                Decimal(str(REFERRAL_BONUS)),
+                "referral",
+                f"referral_first_buy:{tg_id}",
+                commit=False
+            ):
+                referrer_credited = user.referrer_id
 
         result = await self.session.execute(select(Config.username).where(Config.tg_id == tg_id, Config.deleted == False))
         usernames = [r[0] for r in result.all()]
@@ -463,6 +564,11 @@ class UserRepository(BaseRepository):
 
         await redis.setex(f"user:{tg_id}:sub_end", CACHE_TTL_SUB_END, str(new_end_ts))
         await redis.setex(f"user:{tg_id}:balance", CACHE_TTL_BALANCE, str(new_balance))
+        await schedule_subscription_events(redis, [(tg_id, user.subscription_end)])
+
+        if referrer_credited:
+            await redis.delete(f"user:{referrer_credited}:balance")
+            LOG.info(f"Referral bonus {REFERRAL_BONUS} credited to {referrer_credited} from {tg_id}")
 
         if usernames:
             import asyncio
@@ -474,6 +580,140 @@ class UserRepository(BaseRepository):
         LOG.info(f"User {tg_id} purchased {days} days for {price} RUB. New balance: {new_balance}")
         return True
 
+    async def bulk_renew_subscriptions(
+        self,
+        days: int,
+        price: float,
+        window_hours: int = 24,
+        batch_size: int = 500,
+        tg_ids: Optional[List[int]] = None
+    ) -> List[Dict]:
+        """
+        Renew every subscription ending within `window_hours` whose balance covers `price`.
+
+        Runs set-based batches (one renewal statement per batch of ids) instead
+        of a transaction per user. The ledger key renewal:{tg_id}:{YYYYMMDD} makes each user renew at
+        most once a day, also against the per-user path. Panel updates are left
+        to the caller (see push_subscription_ends). With tg_ids, only those users
+        are considered (used by the lifecycle dispatcher).
+
+        Returns:
+            One dict per renewed user: tg_id, lang, balance, subscription_end, usernames,
+            reachable (whether notifications can be delivered)
+        """
+        redis = await self.get_redis()
+        now = datetime.utcnow()
+        params = {
+            "now": now,
+            "threshold": now + timedelta(hours=window_hours),
+            "price": Decimal(str(price)),
+            "days": days,
+            "day": now.strftime('%Y%m%d'),
+            "bonus": Decimal(str(REFERRAL_BONUS)),
+            "max_failures": DELIVERY_MAX_FAILURES,
+        }
+
+        await self.session.execute(_FOLD_RENEWAL_CANDIDATES_SQL, params)
+        await self.session.commit()
+
+        candidates = (
+            select(User.tg_id)
+            .where(
+                User.subscription_end.between(params["now"], params["threshold"]),
+                User.balance >= params["price"],
+            )
+            .order_by(User.tg_id)
+            .limit(batch_size)
+        )
+        if tg_ids is not None:
+            if not tg_ids:
+                return []
+            candidates = candidates.where(User.tg_id.in_(tg_ids))
+
+        renewed: List[Dict] = []
+        referrers = set()
+        after = 0
+        while True:
+            result = await self.session.execute(candidates.where(User.tg_id > after))
+            tg_ids = list(result.scalars().all())
+            if not tg_ids:
+                break
+            after = tg_ids[-1]
+
+            result = await self.session.execute(_BULK_RENEW_SQL, {**params, "tg_ids": tg_ids})
+            rows = result.all()
+            await self.session.commit()
+
+            for row in rows:
+                renewed.append({
+                    "tg_id": row.tg_id,
+                    "lang": row.lang or "ru",
+                    "balance": row.balance,
+                    "subscription_end": row.subscription_end,
+                    "usernames": list(row.usernames),
+                    "reachable": row.reachable,
+                })
+                referrers.update(row.referrers or [])
+
+        if renewed or referrers:
+            try:
+                async with redis.pipeline(transaction=False) as pipe:
+                    for item in renewed:
+                        pipe.setex(f"user:{item['tg_id']}:sub_end", CACHE_TTL_SUB_END,
+                                   str(item['subscription_end'].timestamp()))
+                        pipe.setex(f"user:{item['tg_id']}:balance", CACHE_TTL_BALANCE, str(item['balance']))
+                    for referrer in referrers:
+                        pipe.delete(f"user:{referrer}:balance")
+                    await pipe.execute()
+            except Exception as e:
+                LOG.warning(f"Redis error updating caches after bulk renewal: {e}")
+
+            await schedule_subscription_events(
+                redis, [(item['tg_id'], item['subscription_end']) for item in renewed]
+            )
+
+        LOG.info(f"Bulk renewal: {len(renewed)} subscriptions renewed for {days} days at {price} RUB")
+        return renewed
+
+    async def push_subscription_ends(
+        self,
+        updates: List[Tuple[str, int]],
+        concurrency: int = 10
+    ) -> int:
+        """
+        Set panel expiry for many users with one token and bounded concurrency.
+
+        Args:
+            updates: (panel username, expire timestamp) pairs
+            concurrency: Maximum simultaneous panel requests
+
+        Returns:
+            Number of successful updates
+        """
+        if not updates:
+            return 0
+
+        server = await self._get_marzban_server()
+        if not server.access:
+            LOG.error("Failed to get access token for Marzban server.")
+            return 0
+
+        import asyncio
+        api_manager = ClientApiManager()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def push(username: str, expire_ts: int) -> bool:
+            async with semaphore:
+                try:
+                    await api_manager.modify_user(server, username, {"expire": expire_ts})
+                    return True
+                except Exception as e:
+                    LOG.error("Failed to modify marzban user %s expire=%s: %s", username, expire_ts, e)
+                    return False
+
+        results = await asyncio.gather(*[push(username, ts) for username, ts in updates])
+        return sum(results)
+
     async def create_and_add_config(
         self,
         tg_id: int,
@@ -575,6 +815,7 @@ class UserRepository(BaseRepository):
             await session.commit()
 
         await redis.delete(f"user:{tg_id}:configs")
+        await incr_counter("configs_created")
 
         LOG.info("Config created for user %s on Marzban server %s", tg_id, server.name)
         return {
@@ -584,16 +825,80 @@ class UserRepository(BaseRepository):
             "username": cfg.username
         }
 
-    async def get_all_users(self) -> List[User]:
-        """Get all users for broadcast"""
-        session = self.session
-        result = await session.execute(select(User))
+    # ----------------------------
+    # Broadcast recipients
+    # ----------------------------
+
+    @staticmethod
+    def _broadcast_filter(target: str) -> list:
+        conditions = [reachable_users()]
+        if target == 'subscribed':
+            # Only users with notifications enabled
+            conditions.append(User.notifications == True)
+        return conditions
+
+    async def get_broadcast_recipients(self, target: str, after: int = 0, limit: int = 1000) -> List[int]:
+        """
+        Next page of broadcast recipients in tg_id order (keyset pagination).
+
+        Args:
+            target: 'all' or 'subscribed'
+            after: Last tg_id of the previous page
+            limit: Page size
+
+        Returns:
+            tg_ids greater than `after`
+        """
+        result = await self.session.execute(
+            select(User.tg_id)
+            .where(User.tg_id > after, *self._broadcast_filter(target))
+            .order_by(User.tg_id)
+            .limit(limit)
+        )
         return list(result.scalars().all())
 
-    async def get_users_with_notifications(self) -> List[User]:
-        """Get users with notifications enabled for targeted broadcast"""
-        session = self.session
-        result = await session.execute(
-            select(User).where(User.notifications == True)
+    async def count_broadcast_recipients(self, target: str, after: int = 0) -> int:
+        result = await self.session.execute(
+            select(func.count()).select_from(User)
+            .where(User.tg_id > after, *self._broadcast_filter(target))
+        )
+        return result.scalar_one()
+
+    # ----------------------------
+    # Delivery state
+    # ----------------------------
+
+    async def apply_delivery_results(self, results: List[Tuple[int, str, int, Optional[str]]]) -> Dict[int, bool]:
+        """
+        Store a batch of send outcomes.
+
+        Args:
+            results: (tg_id, status, failures, error) per user; status is 'sent',
+                     'active', 'blocked' or 'failed', failures the number of
+                     failed sends in the batch
+
+        Returns:
+            {tg_id: unreachable} for users whose state changed
+        """
+        if not results:
+            return {}
+        result = await self.session.execute(_APPLY_DELIVERY_SQL, {
+            "tg_ids": [r[0] for r in results],
+            "statuses": [r[1] for r in results],
+            "failures": [r[2] for r in results],
+            "errors": [r[3] for r in results],
+            "now": datetime.utcnow(),
+            "max_failures": DELIVERY_MAX_FAILURES,
+        })
+        changed = {row.tg_id: row.unreachable for row in result.all()}
+        await self.session.commit()
+        return changed
+
+    async def get_unreachable_ids(self, after: int = 0, limit: int = 5000) -> List[int]:
+        result = await self.session.execute(
+            select(User.tg_id)
+            .where(User.tg_id > after, or_(User.blocked_at.isnot(None), User.delivery_failures >= DELIVERY_MAX_FAILURES))
+            .order_by(User.tg_id)
+            .limit(limit)
         )
         return list(result.scalars().all())
\ No newline at end of file
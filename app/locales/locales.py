@@ -1,3 +1,6 @@
+from string import Formatter
+from typing import Dict
+
 LOCALES = {
     "ru": {
         "cmd_start": "Добро пожаловать в OrbitVPN! Выберите опцию:",
@@ -165,12 +168,16 @@ LOCALES = {
         'sub_expired_1': 'Ваша подписка OrbitVPN истекла.\n\nПополните баланс и продлите подписку, чтобы восстановить доступ к защищённому интернету.',
         'sub_expired_2': 'Подписка закончилась. Все ваши конфигурации приостановлены.\n\nОбновите подписку прямо сейчас для продолжения использования VPN.',
         'sub_expired_3': 'Срок действия вашей подписки истёк.\n\nПродлите подписку, чтобы снова пользоваться безопасным и быстрым VPN без ограничений!',
+        'traffic_limit_warning': '📶 Использовано {used} из {limit} трафика.\n\nКогда лимит закончится, VPN перестанет работать до сброса.',
         'auto_renewal_success': '✓ Подписка автоматически продлена!\n\n📅 +{days} дней за {price:.0f}₽\n💰 Баланс: {balance:.2f}₽\n⏰ Активна до: {expire_date}',
         # Admin config cleanup
         'admin_clear_configs': 'Очистить конфиги',
         'admin_clear_configs_confirm': '🗑 Очистка истекших конфигов\n\nУдалит все конфиги пользователей, чья подписка истекла более 14 дней назад.\n\nВы уверены?',
         'admin_cleanup_started': '⏳ Запущена очистка истекших конфигов...',
         'admin_cleanup_result': '✅ Очистка завершена\n\nПроверено: {total}\nУдалено: {deleted}\nОшибок: {failed}\nПропущено: {skipped}',
+        'admin_cleanup_progress': '⏳ Очистка истекших конфигов...\n\nОбработано: {processed}/{total}\nУдалено: {deleted}\nОшибок: {failed}',
+        'admin_cleanup_running': '⏳ Очистка конфигов уже выполняется',
+        'admin_cleanup_failed': '❌ Очистка прервана: {error}\nСледующий запуск продолжит с места остановки',
         'confirm_yes': 'Да, удалить',
         'confirm_no': 'Отмена',
         # Broadcast
@@ -183,8 +190,17 @@ LOCALES = {
         'broadcast_execute': '✅ Отправить',
         'broadcast_preview': '📝 Предпросмотр рассылки\n\nСообщение:\n{message}\n\nКому: {target}\nКогда: {time}\n\nОтправить?',
         'broadcast_in_progress': '⏳ Отправка сообщений...',
-        'broadcast_completed': '✅ Рассылка завершена!\n\nВсего пользователей: {total}\nОтправлено: {success}\nОшибок: {failed}',
+        'broadcast_progress': '⏳ Рассылка: {processed}/{total} ({percent}%)\n\nОтправлено: {sent}\nОшибок: {failed}\nЗаблокировали бота: {blocked}\nОсталось: ~{eta}',
+        'broadcast_paused': '⏸ Рассылка приостановлена: {processed}/{total}\n\nОтправлено: {sent}\nОшибок: {failed}\nЗаблокировали бота: {blocked}',
+        'broadcast_paused_error': '\n\n⚠️ Остановлена из-за ошибки: {error}',
+        'broadcast_completed': '✅ Рассылка завершена!\n\nВсего пользователей: {total}\nОтправлено: {success}\nОшибок: {failed}\nЗаблокировали бота: {blocked}',
+        'broadcast_stopped': '⏹ Рассылка остановлена\n\nВсего пользователей: {total}\nОтправлено: {success}\nОшибок: {failed}\nЗаблокировали бота: {blocked}',
         'broadcast_cancelled': '❌ Рассылка отменена',
+        'broadcast_pause': '⏸ Пауза',
+        'broadcast_resume': '▶️ Продолжить',
+        'broadcast_stop': '⏹ Остановить',
+        'broadcast_not_active': 'Рассылка уже завершена',
+        'broadcast_media': '[медиа]',
         'broadcast_error_no_message': '❌ Сообщение не найдено. Попробуйте ещё раз.',
         'cancel': 'Отмена',
         # Admin Users Management
@@ -195,6 +211,7 @@ LOCALES = {
         'admin_user_not_found': 'Пользователь не найден',
         'admin_user_info': '👤 Пользователь {username}\n\nID: {tg_id}\nБаланс: {balance} RUB\nКонфигов: {configs}\nЯзык: {lang}\nУведомления: {notifications}\nРеферер: {referrer}\nДата регистрации: {created_at}',
         'admin_user_subscription': '\n\nПодписка:\n{subscription}',
+        'admin_user_traffic': '\n\nТрафик: {used} из {limit}\nЗа 30 дней: {month}\nОбновлено: {updated_at}',
         'admin_sub_active': 'Активна до: {expire_date}',
         'admin_sub_expired': 'Истекла: {expire_date}',
         'admin_sub_none': 'Нет подписки',
@@ -220,6 +237,8 @@ LOCALES = {
         'admin_recent_payments': 'Последние платежи',
         'admin_payment_item': '• {amount} RUB через {method}\n  Пользователь: {tg_id}\n  Статус: {status}\n  Дата: {date}',
         'admin_no_recent_payments': 'Нет недавних платежей',
+        'admin_ton_unmatched': '⚠️ Несопоставленные TON транзакции: {count}\n\n{items}',
+        'admin_ton_unmatched_item': '• {amount} TON от {sender}\n  Комментарий: {comment}\n  Причина: {reason}\n  Хэш: {tx_hash}',
         # Admin Servers Status
         'admin_servers_stats': '🖥 Статус серверов Marzban\n\nИнстансов: {total}\nАктивных: {active}\nНеактивных: {inactive}',
         'admin_instance_item': '\n\n📡 {name} ({id})\nURL: {url}\nПриоритет: {priority}\nСтатус: {status}\nУзлов: {nodes}\nИсключено узлов: {excluded}',
@@ -413,12 +432,16 @@ LOCALES = {
         'sub_expired_1': 'Your OrbitVPN subscription has expired.\n\nTop up your balance and renew your subscription to restore access to secure internet.',
         'sub_expired_2': 'Subscription ended. All your configurations have been suspended.\n\nRenew your subscription now to continue using VPN.',
         'sub_expired_3': 'Your subscription has expired.\n\nRenew now to enjoy safe and fast VPN without limitations again!',
+        'traffic_limit_warning': '📶 You have used {used} of your {limit} traffic.\n\nOnce the limit is reached, the VPN stops working until it resets.',
         'auto_renewal_success': '✓ Subscription auto-renewed!\n\n📅 +{days} days for {price:.0f}₽\n💰 Balance: {balance:.2f}₽\n⏰ Active until: {expire_date}',
         # Admin config cleanup
         'admin_clear_configs': 'Clear Configs',
         'admin_clear_configs_confirm': '🗑 Clean up expired configs\n\nWill delete all configs for users whose subscription expired more than 14 days ago.\n\nAre you sure?',
         'admin_cleanup_started': '⏳ Expired config cleanup started...',
         'admin_cleanup_result': '✅ Cleanup completed\n\nChecked: {total}\nDeleted: {deleted}\nFailed: {failed}\nSkipped: {skipped}',
+        'admin_cleanup_progress': '⏳ Cleaning up expired configs...\n\nProcessed: {processed}/{total}\nDeleted: {deleted}\nFailed: {failed}',
+        'admin_cleanup_running': '⏳ Config cleanup is already running',
+        'admin_cleanup_failed': '❌ Cleanup stopped: {error}\nThe next run continues where it stopped',
         'confirm_yes': 'Yes, delete',
         'confirm_no': 'Cancel',
         # Broadcast
@@ -431,8 +454,17 @@ LOCALES = {
         'broadcast_execute': '✅ Send',
         'broadcast_preview': '📝 Broadcast Preview\n\nMessage:\n{message}\n\nTo: {target}\nWhen: {time}\n\nSend?',
         'broadcast_in_progress': '⏳ Sending messages...',
-        'broadcast_completed': '✅ Broadcast completed!\n\nTotal users: {total}\nSent: {success}\nFailed: {failed}',
+        'broadcast_progress': '⏳ Broadcast: {processed}/{total} ({percent}%)\n\nSent: {sent}\nFailed: {failed}\nBlocked the bot: {blocked}\nRemaining: ~{eta}',
+        'broadcast_paused': '⏸ Broadcast paused: {processed}/{total}\n\nSent: {sent}\nFailed: {failed}\nBlocked the bot: {blocked}',
+        'broadcast_paused_error': '\n\n⚠️ Stopped by an error: {error}',
+        'broadcast_completed': '✅ Broadcast completed!\n\nTotal users: {total}\nSent: {success}\nFailed: {failed}\nBlocked the bot: {blocked}',
+        'broadcast_stopped': '⏹ Broadcast stopped\n\nTotal users: {total}\nSent: {success}\nFailed: {failed}\nBlocked the bot: {blocked}',
         'broadcast_cancelled': '❌ Broadcast cancelled',
+        'broadcast_pause': '⏸ Pause',
+        'broadcast_resume': '▶️ Resume',
+        'broadcast_stop': '⏹ Stop',
+        'broadcast_not_active': 'Broadcast has already finished',
+        'broadcast_media': '[media]',
         'broadcast_error_no_message': '❌ Message not found. Please try again.',
         'cancel': 'Cancel',
         # Admin Users Management
@@ -443,6 +475,7 @@ LOCALES = {
         'admin_user_not_found': 'User not found',
         'admin_user_info': '👤 User {username}\n\nID: {tg_id}\nBalance: {balance} RUB\nConfigs: {configs}\nLanguage: {lang}\nNotifications: {notifications}\nReferrer: {referrer}\nRegistration date: {created_at}',
         'admin_user_subscription': '\n\nSubscription:\n{subscription}',
+        'admin_user_traffic': '\n\nTraffic: {used} of {limit}\n30 days: {month}\nUpdated: {updated_at}',
         'admin_sub_active': 'Active until: {expire_date}',
         'admin_sub_expired': 'Expired: {expire_date}',
         'admin_sub_none': 'No subscription',
@@ -468,6 +501,8 @@ LOCALES = {
         'admin_recent_payments': 'Recent payments',
         'admin_payment_item': '• {amount} RUB via {method}\n  User: {tg_id}\n  Status: {status}\n  Date: {date}',
         'admin_no_recent_payments': 'No recent payments',
+        'admin_ton_unmatched': '⚠️ Unmatched TON transactions: {count}\n\n{items}',
+        'admin_ton_unmatched_item': '• {amount} TON from {sender}\n  Comment: {comment}\n  Reason: {reason}\n  Hash: {tx_hash}',
         # Admin Servers Status
         'admin_servers_stats': '🖥 Marzban Server Status\n\nInstances: {total}\nActive: {active}\nInactive: {inactive}',
         'admin_instance_item': '\n\n📡 {name} ({id})\nURL: {url}\nPriority: {priority}\nStatus: {status}\nNodes: {nodes}\nExcluded nodes: {excluded}',
@@ -498,23 +533,56 @@ LOCALES = {
 }
 
 
-def t(lang: str, key: str, **kwargs):
-    lang_dict = LOCALES.get(lang, LOCALES["en"])
-    text = lang_dict.get(key, key)
-    try:
-        return text.format(**kwargs)
-    except Exception:
-        return text
+class Translator:
+    """
+    Translations of one language, prepared once.
+
+    Strings without placeholders are stored ready to return; templates are
+    formatted only when called with arguments. Called without arguments a
+    template is returned as is, so callers can format it themselves.
+    """
 
+    __slots__ = ("lang", "_plain", "_templates")
 
-def get_translator(lang: str):
-    lang_dict = LOCALES.get(lang, LOCALES["en"])
+    def __init__(self, lang: str, strings: Dict[str, str]):
+        self.lang = lang
+        self._plain: Dict[str, str] = {}
+        self._templates: Dict[str, str] = {}
+        for key, text in strings.items():
+            if any(field is not None for _, field, _, _ in _FORMATTER.parse(text)):
+                self._templates[key] = text
+            else:
+                # Unescapes '{{' and '}}' like format() would
+                self._plain[key] = text.format()
 
-    def translate(key: str, **kwargs):
-        text = lang_dict.get(key, key)
+    def __call__(self, key: str, **kwargs) -> str:
+        text = self._plain.get(key)
+        if text is not None:
+            return text
+        text = self._templates.get(key)
+        if text is None:
+            return key
+        if not kwargs:
+            return text
         try:
             return text.format(**kwargs)
         except Exception:
             return text
 
-    return translate
\ No newline at end of file
+
+_FORMATTER = Formatter()
+_TRANSLATORS: Dict[str, Translator] = {}
+
+
+def get_translator(lang: str) -> Translator:
+    """Translator of a language (English for unknown ones), built once per process"""
+    translator = _TRANSLATORS.get(lang)
+    if translator is None:
+        if lang not in LOCALES:
+            return get_translator("en")
+        translator = _TRANSLATORS[lang] = Translator(lang, LOCALES[lang])
+    return translator
+
+
+def t(lang: str, key: str, **kwargs):
+    return get_translator(lang)(key, **kwargs)
@@ -1,5 +1,5 @@
-from cryptobot import CryptoBotGateway
-from ton import TonGateway
-from yookassa import YooKassaGateway
-from stars import TelegramStarsGateway
-from base import BasePaymentGateway
\ No newline at end of file
+from .cryptobot import CryptoBotGateway
+from .ton import TonGateway
+from .yookassa import YooKassaGateway
+from .stars import TelegramStarsGateway
+from .base import BasePaymentGateway
@@ -1,20 +1,38 @@
 from abc import ABC, abstractmethod
 from decimal import Decimal
 from typing import Optional
-from datetime import datetime
 from app.payments.models import PaymentResult
+from app.repo.payments import PaymentRepository
 from app.utils.logging import get_logger
 
 LOG = get_logger(__name__)
 
 class BasePaymentGateway(ABC):
+    """
+    Long-lived payment gateway.
+
+    One instance per process (see app.payments.registry): it owns its API clients
+    and caches static data, while the database session is passed in per call.
+    """
+
+    bot = None
+    _bot_username: Optional[str] = None
 
     @abstractmethod
-    async def create_payment(self, tg_id: int, amount: Decimal, chat_id: Optional[int] = None) -> PaymentResult:
+    async def create_payment(
+        self,
+        session,
+        t,
+        tg_id: int,
+        amount: Decimal,
+        chat_id: Optional[int] = None,
+        payment_id: Optional[int] = None,
+        comment: Optional[str] = None
+    ) -> PaymentResult:
         pass
 
     @abstractmethod
-    async def check_payment(self, payment_id: int) -> bool:
+    async def check_payment(self, session, payment_id: int) -> bool:
         pass
 
     @property
@@ -25,99 +43,53 @@ class BasePaymentGateway(ABC):
     async def on_payment_confirmed(self, payment_id: int, tx_hash: Optional[str] = None):
         pass
 
+    async def close(self):
+        """Release pooled clients (called once on shutdown)"""
+        pass
+
+    async def get_bot_username(self) -> str:
+        """Bot username, fetched from Telegram once per process"""
+        if self._bot_username is None:
+            bot_info = await self.bot.get_me()
+            self._bot_username = bot_info.username
+        return self._bot_username
+
+    async def _get_payment_repo(self, session) -> PaymentRepository:
+        return PaymentRepository(session, await self.get_redis())
+
     async def _confirm_payment_atomic(
         self,
+        session,
         payment_id: int,
         tx_hash: str,
-        amount: Decimal,
         allow_expired: bool = False
-    ) -> bool:
+    ) -> Optional[dict]:
         """
-        Atomically confirm payment with database locks to prevent race conditions.
+        Confirm payment and credit the user in a single round-trip.
+
+        Delegates to PaymentRepository.confirm_payment: the status transition, the
+        duplicate tx_hash check (unique index) and the ledger credit are one statement.
 
         Args:
+            session: Database session for this call
             payment_id: Payment ID to confirm
             tx_hash: Transaction hash (for deduplication)
-            amount: Amount to credit
             allow_expired: Whether to allow confirming expired payments (for blockchain recovery)
 
         Returns:
-            True if confirmed successfully, False otherwise
+            Confirmation info (tg_id, amount, tx_hash, lang, has_active_subscription),
+            or None if the payment was not confirmed
         """
-        from app.repo.models import Payment as PaymentModel, User
-        from sqlalchemy import select
-
         try:
-            result = await self.session.execute(
-                select(PaymentModel)
-                .where(PaymentModel.id == payment_id)
-                .with_for_update()
+            payment_repo = await self._get_payment_repo(session)
+            return await payment_repo.confirm_payment(
+                payment_id, tx_hash, allow_expired=allow_expired
             )
-            payment = result.scalar_one_or_none()
-
-            if not payment:
-                LOG.warning(f"Payment {payment_id} not found during confirmation")
-                return False
-
-            valid_statuses = ['pending', 'expired'] if allow_expired else ['pending']
-            if payment.status not in valid_statuses:
-                LOG.debug(f"Payment {payment_id} has status {payment.status}, cannot confirm")
-                return False
-
-            if payment.status == 'expired' and allow_expired:
-                LOG.warning(f"Recovering expired payment {payment_id} - late confirmation")
-
-            result = await self.session.execute(
-                select(User)
-                .where(User.tg_id == payment.tg_id)
-                .with_for_update()
-            )
-            user = result.scalar_one_or_none()
-
-            if not user:
-                LOG.error(f"User {payment.tg_id} not found for payment {payment_id}")
-                return False
-
-            if payment.tx_hash is not None:
-                LOG.warning(f"Payment {payment_id} already has tx_hash: {payment.tx_hash}")
-                return False
-
-            result = await self.session.execute(
-                select(PaymentModel).where(PaymentModel.tx_hash == tx_hash)
-            )
-            existing_payment = result.scalar_one_or_none()
-            if existing_payment:
-                LOG.warning(f"Transaction {tx_hash} already used for payment {existing_payment.id}")
-                return False
-
-            old_balance = user.balance
-
-            payment.status = 'confirmed'
-            payment.tx_hash = tx_hash
-            payment.confirmed_at = datetime.utcnow()
-            user.balance += amount
-
-            await self.session.commit()
-
-            LOG.info(f"Payment confirmed: id={payment_id}, user={user.tg_id}, "
-                    f"amount={amount}, balance: {old_balance} → {user.balance}, tx_hash={tx_hash}")
-
-            try:
-                redis = await self.get_redis()
-                await redis.delete(f"user:{user.tg_id}:balance")
-            except Exception as e:
-                LOG.warning(f"Redis error invalidating cache for user {user.tg_id}: {e}")
-
-            return True
-
         except Exception as e:
-            await self.session.rollback()
+            await session.rollback()
             LOG.error(f"Error confirming payment {payment_id}: {type(e).__name__}: {e}")
-            return False
+            return None
 
     async def get_redis(self):
-        """Get Redis client (must be implemented by subclass if needed)"""
-        if hasattr(self, 'redis_client') and self.redis_client:
-            return self.redis_client
         from app.utils.redis import get_redis
-        return await get_redis()
\ No newline at end of file
+        return await get_redis()
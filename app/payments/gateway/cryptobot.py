@@ -5,7 +5,7 @@ from aiogram import Bot
 from aiocryptopay import AioCryptoPay, Networks
 from app.payments.gateway.base import BasePaymentGateway
 from app.payments.models import PaymentResult, PaymentMethod
-from app.repo.payments import PaymentRepository
+from app.utils.instrumentation import count
 from app.utils.rates import get_usdt_rub_rate
 from config import CRYPTOBOT_TOKEN, CRYPTOBOT_TESTNET
 
@@ -15,10 +15,9 @@ LOG = logging.getLogger(__name__)
 class CryptoBotGateway(BasePaymentGateway):
     requires_polling = True
 
-    def __init__(self, session, redis_client=None, bot: Optional[Bot] = None):
-        self.session = session
-        self.payment_repo = PaymentRepository(session, redis_client)
+    def __init__(self, bot: Optional[Bot] = None):
         self._cryptopay: Optional[AioCryptoPay] = None
+        self._processing_bot_username: Optional[str] = None
         self.bot = bot
 
     async def _get_cryptopay(self) -> AioCryptoPay:
@@ -31,8 +30,18 @@ class CryptoBotGateway(BasePaymentGateway):
 
         return self._cryptopay
 
+    async def _get_processing_bot_username(self) -> str:
+        """CryptoBot payment-processing bot username, fetched once per process"""
+        if self._processing_bot_username is None:
+            cryptopay = await self._get_cryptopay()
+            count("http")
+            profile = await cryptopay.get_me()
+            self._processing_bot_username = profile.payment_processing_bot_username
+        return self._processing_bot_username
+
     async def create_payment(
         self,
+        session,
         t,
         tg_id: int,
         amount: Decimal,
@@ -55,10 +64,10 @@ class CryptoBotGateway(BasePaymentGateway):
 
             LOG.info(f"Converting {amount} RUB to {usdt_amount:.2f} USDT (rate: {usdt_rate})")
 
-            # Get bot username for callback URL
-            profile = await cryptopay.get_me()
-            bot_username = profile.payment_processing_bot_username
+            # Get bot username for callback URL (cached)
+            bot_username = await self._get_processing_bot_username()
 
+            count("http")
             invoice = await cryptopay.create_invoice(
                 asset='USDT',
                 amount=float(usdt_amount),  # Amount in USDT after conversion from RUB
@@ -71,7 +80,8 @@ class CryptoBotGateway(BasePaymentGateway):
             )
 
             # Store invoice_id in payment metadata
-            await self.payment_repo.update_payment_metadata(
+            payment_repo = await self._get_payment_repo(session)
+            await payment_repo.update_payment_metadata(
                 payment_id=payment_id,
                 metadata={'invoice_id': invoice.invoice_id}
             )
@@ -98,18 +108,16 @@ class CryptoBotGateway(BasePaymentGateway):
             LOG.error(f"Error creating CryptoBot invoice: {e}")
             raise ValueError(f"Failed to create CryptoBot invoice: {e}")
 
-    async def check_payment(self, payment_id: int) -> bool:
+    async def check_payment(self, session, payment_id: int) -> bool:
         """
         Check if CryptoBot invoice has been paid.
 
-        CRITICAL FIX: Uses database locks to prevent concurrent confirmations
-        of the same payment from polling loop.
+        Confirmation is a single conditional statement, so concurrent checks
+        of the same payment from the polling loop cannot credit it twice.
         """
         try:
-            from app.repo.models import Payment as PaymentModel, User
-            from sqlalchemy import select
-
-            payment = await self.payment_repo.get_payment(payment_id)
+            payment_repo = await self._get_payment_repo(session)
+            payment = await payment_repo.get_payment(payment_id)
             if not payment:
                 LOG.warning(f"Payment {payment_id} not found")
                 return False
@@ -136,6 +144,7 @@ class CryptoBotGateway(BasePaymentGateway):
             cryptopay = await self._get_cryptopay()
 
             # Get invoice status from CryptoBot
+            count("http")
             invoices = await cryptopay.get_invoices(invoice_ids=[invoice_id])
 
             if not invoices:
@@ -146,81 +155,28 @@ class CryptoBotGateway(BasePaymentGateway):
 
             # Check if invoice is paid
             if invoice.status == 'paid':
-                # CRITICAL FIX: Lock payment AND user rows for atomic update
-                result = await self.session.execute(
-                    select(PaymentModel)
-                    .where(PaymentModel.id == payment_id)
-                    .with_for_update()
-                )
-                payment_locked = result.scalar_one_or_none()
-
-                if not payment_locked:
-                    LOG.debug(f"Payment {payment_id} not found during lock")
-                    return False
-
                 # Allow confirming if status is pending OR expired (but paid on gateway side)
-                if payment_locked.status not in ['pending', 'expired']:
-                    LOG.debug(f"Payment {payment_id} has status {payment_locked.status}, cannot confirm")
-                    return False
-
-                # Log if recovering expired payment
-                if payment_locked.status == 'expired':
+                if current_status == 'expired':
                     LOG.warning(f"Recovering expired payment {payment_id} - user paid after local timeout but succeeded on CryptoBot")
 
-                # Lock user row for atomic balance update
-                result = await self.session.execute(
-                    select(User)
-                    .where(User.tg_id == payment_locked.tg_id)
-                    .with_for_update()
+                # Status transition, duplicate check and credit in one statement
+                confirmed = await self._confirm_payment_atomic(
+                    session,
+                    payment_id=payment_id,
+                    tx_hash=f"cryptobot_{invoice_id}",
+                    allow_expired=True
                 )
-                user = result.scalar_one_or_none()
-                if not user:
-                    LOG.error(f"User {payment_locked.tg_id} not found for payment {payment_id}")
-                    return False
-
-                # Check if tx_hash already set
-                if payment_locked.tx_hash is not None:
-                    LOG.warning(f"Payment {payment_id} already has tx_hash: {payment_locked.tx_hash}")
+                if not confirmed:
                     return False
 
-                # ATOMIC UPDATE: Update payment status and balance
-                from datetime import datetime
-
-                old_balance = user.balance
-                tx_hash = f"cryptobot_{invoice_id}"
-
-                payment_locked.status = 'confirmed'
-                payment_locked.tx_hash = tx_hash
-                payment_locked.confirmed_at = datetime.utcnow()
-
-                # Credit payment amount
-                user.balance += payment_locked.amount
-
-                await self.session.commit()
-
-                LOG.info(f"CryptoBot payment confirmed: payment_id={payment_id}, user={user.tg_id}, "
-                        f"amount={payment_locked.amount}, balance: {old_balance} → {user.balance}, "
-                        f"invoice={invoice_id}")
-
-                # Check subscription status BEFORE cache invalidation
-                from datetime import datetime
-                has_active_sub = user.subscription_end and user.subscription_end > datetime.utcnow()
-
-                # Invalidate cache (tolerate Redis failures)
-                try:
-                    redis = await self.payment_repo.get_redis()
-                    await redis.delete(f"user:{user.tg_id}:balance")
-                except Exception as e:
-                    LOG.warning(f"Redis error invalidating cache for user {user.tg_id}: {e}")
-
                 # Send notification to user about successful payment
                 await self.on_payment_confirmed(
                     payment_id=payment_id,
-                    tx_hash=tx_hash,
-                    tg_id=user.tg_id,
-                    total_amount=payment_locked.amount,
-                    lang=user.lang,
-                    has_active_subscription=has_active_sub
+                    tx_hash=confirmed['tx_hash'],
+                    tg_id=confirmed['tg_id'],
+                    total_amount=confirmed['amount'],
+                    lang=confirmed['lang'],
+                    has_active_subscription=confirmed['has_active_subscription']
                 )
                 return True
 
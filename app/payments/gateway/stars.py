@@ -4,7 +4,6 @@ from typing import Optional
 from aiogram.types import LabeledPrice
 from app.payments.gateway.base import BasePaymentGateway
 from app.payments.models import PaymentResult, PaymentMethod
-from app.repo.payments import PaymentRepository
 from config import TELEGRAM_STARS_RATE
 
 LOG = logging.getLogger(__name__)
@@ -12,13 +11,12 @@ LOG = logging.getLogger(__name__)
 class TelegramStarsGateway(BasePaymentGateway):
     requires_polling = False
 
-    def __init__(self, bot, session, redis_client=None):
+    def __init__(self, bot):
         self.bot = bot
-        self.session = session
-        self.payment_repo = PaymentRepository(session, redis_client)
 
     async def create_payment(
         self,
+        session,
         t,
         tg_id: int,
         amount: Decimal,
@@ -52,5 +50,5 @@ class TelegramStarsGateway(BasePaymentGateway):
             text=t("stars_invoice_sent")
         )
 
-    async def check_payment(self, payment_id: int) -> bool:
+    async def check_payment(self, session, payment_id: int) -> bool:
         return False
\ No newline at end of file
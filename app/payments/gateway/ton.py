@@ -4,7 +4,6 @@ from typing import Optional
 from aiogram import Bot
 from app.payments.gateway.base import BasePaymentGateway
 from app.payments.models import PaymentResult, PaymentMethod
-from app.repo.payments import PaymentRepository
 from config import TON_ADDRESS
 
 LOG = logging.getLogger(__name__)
@@ -12,13 +11,12 @@ LOG = logging.getLogger(__name__)
 class TonGateway(BasePaymentGateway):
     requires_polling = True
 
-    def __init__(self, session, redis_client=None, bot: Optional[Bot] = None):
-        self.session = session
-        self.payment_repo = PaymentRepository(session, redis_client)
+    def __init__(self, bot: Optional[Bot] = None):
         self.bot = bot
 
     async def create_payment(
         self,
+        session,
         t,
         tg_id: int,
         amount: Decimal,
@@ -56,12 +54,13 @@ class TonGateway(BasePaymentGateway):
             expected_crypto_amount=expected_ton
         )
 
-    async def check_payment(self, payment_id: int) -> bool:
+    async def check_payment(self, session, payment_id: int) -> bool:
         """
         Check if TON payment has been confirmed on blockchain.
-        Uses database locks to prevent replay attacks and race conditions.
+        Replays are rejected by the conditional confirmation and the unique tx_hash index.
         """
-        payment = await self.payment_repo.get_payment(payment_id)
+        payment_repo = await self._get_payment_repo(session)
+        payment = await payment_repo.get_payment(payment_id)
         if not payment:
             LOG.warning(f"Payment {payment_id} not found")
             return False
@@ -79,7 +78,7 @@ class TonGateway(BasePaymentGateway):
             LOG.debug(f"TON payment {payment_id} has status {current_status}, cannot process")
             return False
 
-        tx = await self.payment_repo.get_pending_ton_transaction(
+        tx = await payment_repo.get_pending_ton_transaction(
             comment=payment.get('comment'),
             amount=payment.get('expected_crypto_amount')
         )
@@ -91,35 +90,23 @@ class TonGateway(BasePaymentGateway):
         tx.processed_at = datetime.utcnow()
 
         confirmed = await self._confirm_payment_atomic(
+            session,
             payment_id=payment_id,
             tx_hash=tx.tx_hash,
-            amount=payment['amount'],
             allow_expired=True
         )
 
         if confirmed:
-            from app.repo.models import User
-            from sqlalchemy import select
-
-            async with self.session.begin():
-                result = await self.session.execute(
-                    select(User).where(User.tg_id == payment['tg_id'])
-                )
-                user = result.scalar_one_or_none()
-
-                if user:
-                    has_active_sub = user.subscription_end and user.subscription_end > datetime.utcnow()
-
-                    await self.on_payment_confirmed(
-                        payment_id=payment_id,
-                        tx_hash=tx.tx_hash,
-                        tg_id=user.tg_id,
-                        total_amount=payment['amount'],
-                        lang=user.lang,
-                        has_active_subscription=has_active_sub
-                    )
-
-        return confirmed
+            await self.on_payment_confirmed(
+                payment_id=payment_id,
+                tx_hash=tx.tx_hash,
+                tg_id=confirmed['tg_id'],
+                total_amount=confirmed['amount'],
+                lang=confirmed['lang'],
+                has_active_subscription=confirmed['has_active_subscription']
+            )
+
+        return bool(confirmed)
 
     async def on_payment_confirmed(
         self,
@@ -9,7 +9,7 @@ from urllib3.exceptions import ConnectTimeoutError, ReadTimeoutError, TimeoutErr
 from requests.exceptions import ConnectTimeout, ReadTimeout, Timeout as RequestsTimeout
 from app.payments.gateway.base import BasePaymentGateway
 from app.payments.models import PaymentResult, PaymentMethod
-from app.repo.payments import PaymentRepository
+from app.utils.instrumentation import count
 from config import (
     YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY,
     YOOKASSA_TEST_SHOP_ID, YOOKASSA_TEST_SECRET_KEY,
@@ -22,9 +22,7 @@ LOG = logging.getLogger(__name__)
 class YooKassaGateway(BasePaymentGateway):
     requires_polling = True
 
-    def __init__(self, session, redis_client=None, bot: Optional[Bot] = None):
-        self.session = session
-        self.payment_repo = PaymentRepository(session, redis_client)
+    def __init__(self, bot: Optional[Bot] = None):
         self._configured = False
         self.bot = bot
 
@@ -61,6 +59,7 @@ class YooKassaGateway(BasePaymentGateway):
 
     async def create_payment(
         self,
+        session,
         t,
         tg_id: int,
         amount: Decimal,
@@ -75,10 +74,8 @@ class YooKassaGateway(BasePaymentGateway):
         try:
             await self._ensure_configured()
 
-            # Get bot username for return URL
-            from config import bot
-            bot_info = await bot.get_me()
-            bot_username = bot_info.username
+            # Get bot username for return URL (cached)
+            bot_username = await self.get_bot_username()
             return_url = f"https://t.me/{bot_username}"
 
             # Create payment via YooKassa API
@@ -131,6 +128,7 @@ class YooKassaGateway(BasePaymentGateway):
                                   f"waiting {wait_time}s before retry...")
                         await asyncio.sleep(wait_time)
                     
+                    count("http")
                     yookassa_payment = await asyncio.to_thread(YooKassaPayment.create, payment_data)
                     break  # Success, exit retry loop
                     
@@ -173,7 +171,8 @@ class YooKassaGateway(BasePaymentGateway):
                 raise ValueError("YooKassa payment missing confirmation URL")
 
             # Store YooKassa payment ID in metadata
-            await self.payment_repo.update_payment_metadata(
+            payment_repo = await self._get_payment_repo(session)
+            await payment_repo.update_payment_metadata(
                 payment_id=payment_id,
                 metadata={'yookassa_payment_id': yookassa_payment.id}
             )
@@ -207,13 +206,11 @@ class YooKassaGateway(BasePaymentGateway):
                      f"amount={amount}: {error_type}: {error_msg}", exc_info=True)
             raise ValueError(f"Failed to create YooKassa payment: {error_type}: {error_msg}")
 
-    async def check_payment(self, payment_id: int) -> bool:
+    async def check_payment(self, session, payment_id: int) -> bool:
         """Check if YooKassa payment has been paid"""
         try:
-            from app.repo.models import Payment as PaymentModel, User
-            from sqlalchemy import select
-
-            payment = await self.payment_repo.get_payment(payment_id)
+            payment_repo = await self._get_payment_repo(session)
+            payment = await payment_repo.get_payment(payment_id)
             if not payment:
                 LOG.warning(f"Payment {payment_id} not found")
                 return False
@@ -237,6 +234,7 @@ class YooKassaGateway(BasePaymentGateway):
             await self._ensure_configured()
 
             # Get payment status from YooKassa
+            count("http")
             yookassa_payment = await asyncio.to_thread(YooKassaPayment.find_one, yookassa_payment_id)
 
             if not yookassa_payment:
@@ -245,70 +243,28 @@ class YooKassaGateway(BasePaymentGateway):
 
             # Check if payment is succeeded
             if yookassa_payment.status == 'succeeded':
-                result = await self.session.execute(
-                    select(PaymentModel)
-                    .where(PaymentModel.id == payment_id)
-                    .with_for_update()
-                )
-                payment_locked = result.scalar_one_or_none()
+                # Allow confirming if status is pending OR expired (but paid on gateway side)
+                if current_status == 'expired':
+                    LOG.warning(f"Recovering expired payment {payment_id} - late confirmation from YooKassa")
 
-                if not payment_locked:
-                    LOG.debug(f"Payment {payment_id} not found during lock")
-                    return False
-
-                if payment_locked.status not in ['pending', 'expired']:
-                    LOG.debug(f"Payment {payment_id} has status {payment_locked.status}, cannot confirm")
-                    return False
-
-                if payment_locked.status == 'expired':
-                    LOG.warning(f"Recovering expired payment {payment_id}")
-
-                result = await self.session.execute(
-                    select(User)
-                    .where(User.tg_id == payment_locked.tg_id)
-                    .with_for_update()
+                # Status transition, duplicate check and credit in one statement
+                confirmed = await self._confirm_payment_atomic(
+                    session,
+                    payment_id=payment_id,
+                    tx_hash=f"yookassa_{yookassa_payment_id}",
+                    allow_expired=True
                 )
-                user = result.scalar_one_or_none()
-                if not user:
-                    LOG.error(f"User {payment_locked.tg_id} not found for payment {payment_id}")
-                    return False
-
-                if payment_locked.tx_hash is not None:
-                    LOG.warning(f"Payment {payment_id} already has tx_hash: {payment_locked.tx_hash}")
+                if not confirmed:
                     return False
 
-                from datetime import datetime
-
-                old_balance = user.balance
-                tx_hash = f"yookassa_{yookassa_payment_id}"
-
-                payment_locked.status = 'confirmed'
-                payment_locked.tx_hash = tx_hash
-                payment_locked.confirmed_at = datetime.utcnow()
-                user.balance += payment_locked.amount
-
-                await self.session.commit()
-
-                LOG.info(f"YooKassa payment confirmed: payment_id={payment_id}, user={user.tg_id}, "
-                        f"amount={payment_locked.amount}, balance: {old_balance} → {user.balance}")
-
-                has_active_sub = user.subscription_end and user.subscription_end > datetime.utcnow()
-
-                # Invalidate cache
-                try:
-                    redis = await self.payment_repo.get_redis()
-                    await redis.delete(f"user:{user.tg_id}:balance")
-                except Exception as e:
-                    LOG.warning(f"Redis error invalidating cache for user {user.tg_id}: {e}")
-
-                # Send notification
+                # Send notification to user about successful payment
                 await self.on_payment_confirmed(
                     payment_id=payment_id,
-                    tx_hash=tx_hash,
-                    tg_id=user.tg_id,
-                    total_amount=payment_locked.amount,
-                    lang=user.lang,
-                    has_active_subscription=has_active_sub
+                    tx_hash=confirmed['tx_hash'],
+                    tg_id=confirmed['tg_id'],
+                    total_amount=confirmed['amount'],
+                    lang=confirmed['lang'],
+                    has_active_subscription=confirmed['has_active_subscription']
                 )
                 return True
 
@@ -318,9 +274,10 @@ class YooKassaGateway(BasePaymentGateway):
             LOG.error(f"Error checking YooKassa payment {payment_id}: {e}")
             return False
 
-    async def cancel_payment(self, payment_id: int) -> bool:
+    async def cancel_payment(self, session, payment_id: int) -> bool:
         try:
-            payment = await self.payment_repo.get_payment(payment_id)
+            payment_repo = await self._get_payment_repo(session)
+            payment = await payment_repo.get_payment(payment_id)
             if not payment or payment.get('status') != 'pending':
                 LOG.warning(f"Payment {payment_id} not found or not pending")
                 return False
@@ -341,6 +298,7 @@ class YooKassaGateway(BasePaymentGateway):
 
             LOG.info(f"Cancelling YooKassa payment {yookassa_payment_id}")
 
+            count("http")
             cancelled_payment = await asyncio.to_thread(
                 YooKassaPayment.cancel, yookassa_payment_id, idempotency_key
             )
@@ -1,16 +1,12 @@
 import logging
 import uuid
-import asyncio
 from decimal import Decimal, ROUND_HALF_UP
 from typing import Optional
 
-from gateway import *
 from app.payments.models import PaymentResult, PaymentMethod
+from app.payments.registry import gateway_registry
 from app.repo.payments import PaymentRepository
 from app.repo.user import UserRepository
-from app.repo.db import get_session
-from app.utils.redis import get_redis
-from config import bot
 
 LOG = logging.getLogger(__name__)
 
@@ -19,14 +15,9 @@ class PaymentManager:
         self.session = session
         self.redis_client = redis_client
         self.payment_repo = PaymentRepository(session, redis_client)
-        self.gateways: dict[PaymentMethod, BasePaymentGateway] = {
-            PaymentMethod.TON: TonGateway(session, redis_client, bot=bot),
-            PaymentMethod.STARS: TelegramStarsGateway(bot, session, redis_client),
-            PaymentMethod.CRYPTOBOT: CryptoBotGateway(session, redis_client, bot=bot),
-            PaymentMethod.YOOKASSA: YooKassaGateway(session, redis_client, bot=bot),
-        }
+        # Gateways are process-wide; this manager only supplies the session
+        self.gateways = gateway_registry
         self.user_repo = UserRepository(session, redis_client)
-        self.polling_task: Optional[asyncio.Task] = None
 
     async def create_payment(
         self,
@@ -82,6 +73,7 @@ class PaymentManager:
             try:
                 gateway = self.gateways[method]
                 result = await gateway.create_payment(
+                    self.session,
                     t,
                     tg_id=tg_id,
                     amount=amount,
@@ -90,9 +82,8 @@ class PaymentManager:
                     comment=comment
                 )
 
+                # Polled by the payment_polling job (app.utils.payment_polling)
                 LOG.info(f"Payment created: {method} for user {tg_id}, amount {amount}, id={payment_id}")
-                if method in [PaymentMethod.TON, PaymentMethod.CRYPTOBOT, PaymentMethod.YOOKASSA]:
-                    await self.start_polling_if_needed()
                 return result
             except Exception as gateway_error:
                 # CRITICAL FIX: If gateway fails, cancel the payment in DB
@@ -124,7 +115,7 @@ class PaymentManager:
             
             # Check if gateway supports remote cancellation
             if gateway and hasattr(gateway, 'cancel_payment'):
-                await gateway.cancel_payment(payment_id)
+                await gateway.cancel_payment(self.session, payment_id)
             
         except Exception as e:
             LOG.error(f"Remote cancellation for payment {payment_id} failed: {e}", exc_info=True)
@@ -133,91 +124,15 @@ class PaymentManager:
         await self.payment_repo.update_payment_status(payment_id, 'cancelled')
         LOG.info(f"Locally cancelled payment {payment_id}.")
 
-    async def confirm_payment(self, payment_id: int, tg_id: int, amount: Decimal, tx_hash: Optional[str] = None):
-        try:
-            # Credit payment amount
-            await self.user_repo.change_balance(tg_id, amount)
-
-            if tx_hash:
-                await self.payment_repo.update_payment_status(payment_id, "confirmed", tx_hash)
-
-            LOG.info(f"Payment {payment_id} confirmed: +{amount} for user {tg_id}, tx={tx_hash}")
-
-            return None
-        except Exception as e:
-            LOG.error(f"Confirm payment error for user {tg_id}: {type(e).__name__}: {e}")
-            raise
-
-    async def start_polling_if_needed(self):
-        if self.polling_task is None or self.polling_task.done():
-            self.polling_task = asyncio.create_task(self.run_polling_loop())
-
-    async def run_polling_loop(self):
-        while True:
-            try:
-                # Create new session for each polling iteration
-                async with get_session() as session:
-                    redis_client = await get_redis()
-                    temp_payment_repo = PaymentRepository(session, redis_client)
-
-                    # Check TON payments
-                    ton_pendings = await temp_payment_repo.get_pending_payments(PaymentMethod.TON.value)
-                    if ton_pendings:
-                        from app.utils.updater import TonTransactionsUpdater
-                        updater = TonTransactionsUpdater()
-                        await updater.run_once()
-
-                    # Check CryptoBot payments
-                    cryptobot_pendings = await temp_payment_repo.get_pending_payments(PaymentMethod.CRYPTOBOT.value)
-                    if cryptobot_pendings:
-                        for payment in cryptobot_pendings:
-                            # Create new session for each check
-                            async with get_session() as check_session:
-                                check_redis = await get_redis()
-                                check_gateway = self.gateways[PaymentMethod.CRYPTOBOT].__class__(check_session, check_redis, bot=bot)
-                                await check_gateway.check_payment(payment['id'])
-
-                    # Check YooKassa payments (including recently expired ones)
-                    # CRITICAL: Check expired payments too, in case user paid after local timeout
-                    # but before YooKassa timeout (local=10min, YooKassa=60min)
-                    yookassa_pendings = await temp_payment_repo.get_pending_or_recent_expired_payments(
-                        PaymentMethod.YOOKASSA.value,
-                        expired_hours=1
-                    )
-                    if yookassa_pendings:
-                        for payment in yookassa_pendings:
-                            # Create new session for each check
-                            async with get_session() as check_session:
-                                check_redis = await get_redis()
-                                check_gateway = self.gateways[PaymentMethod.YOOKASSA].__class__(check_session, check_redis, bot=bot)
-                                await check_gateway.check_payment(payment['id'])
-
-                    # If no pending payments, stop polling
-                    if not ton_pendings and not cryptobot_pendings and not yookassa_pendings:
-                        break
-            except Exception as e:
-                LOG.error(f"Polling loop error: {type(e).__name__}: {e}")
-            await asyncio.sleep(60)
-
     async def check_payment(self, payment_id: int) -> bool:
         try:
             payment = await self.payment_repo.get_payment(payment_id)
             if not payment or payment['status'] != 'pending':
                 return False
 
+            # Gateways confirm and credit through PaymentRepository.confirm_payment themselves
             gateway = self.gateways[PaymentMethod(payment['method'])]
-            confirmed = await gateway.check_payment(payment_id)
-
-            # NOTE: TON and CryptoBot gateways handle balance updates internally
-            # to maintain atomicity with transaction locks. Only call confirm_payment
-            # for gateways that don't do this (currently: Stars via webhook)
-            # For TON/CryptoBot, check_payment() already updated balance + payment status
-
-            # Don't double-credit: TON and CryptoBot already updated balance in check_payment()
-            # if confirmed and payment['method'] not in ['ton', 'cryptobot']:
-            #     await self.confirm_payment(payment_id, payment['tg_id'], payment['amount'])
-
-            return confirmed
+            return await gateway.check_payment(self.session, payment_id)
         except Exception as e:
             LOG.error(f"Check payment error for payment {payment_id}: {type(e).__name__}: {e}")
             return False
@@ -225,9 +140,3 @@ class PaymentManager:
     async def get_pending_payments(self, method: Optional[PaymentMethod | str] = None):
         return await self.payment_repo.get_pending_payments(method if method else None)
 
-    async def close(self):
-        for gateway in self.gateways.values():
-            if hasattr(gateway, 'close'):
-                await gateway.close()
-        if self.polling_task:
-            self.polling_task.cancel()
\ No newline at end of file
@@ -0,0 +1,66 @@
+import logging
+from typing import Dict, Optional
+
+from aiogram import Bot
+
+from app.payments.gateway import (
+    BasePaymentGateway,
+    CryptoBotGateway,
+    TelegramStarsGateway,
+    TonGateway,
+    YooKassaGateway,
+)
+from app.payments.models import PaymentMethod
+
+LOG = logging.getLogger(__name__)
+
+
+class GatewayRegistry:
+    """
+    Process-level set of payment gateways.
+
+    Gateways are created once and reused by every PaymentManager, so pooled
+    clients (CryptoPay session, configured YooKassa SDK) and static data (bot
+    usernames) survive across requests. Sessions are passed per call.
+    """
+
+    def __init__(self, bot: Optional[Bot] = None):
+        self._bot = bot
+        self._gateways: Optional[Dict[PaymentMethod, BasePaymentGateway]] = None
+
+    def _build(self) -> Dict[PaymentMethod, BasePaymentGateway]:
+        bot = self._bot
+        if bot is None:
+            from config import bot
+
+        return {
+            PaymentMethod.TON: TonGateway(bot=bot),
+            PaymentMethod.STARS: TelegramStarsGateway(bot),
+            PaymentMethod.CRYPTOBOT: CryptoBotGateway(bot=bot),
+            PaymentMethod.YOOKASSA: YooKassaGateway(bot=bot),
+        }
+
+    @property
+    def gateways(self) -> Dict[PaymentMethod, BasePaymentGateway]:
+        if self._gateways is None:
+            self._gateways = self._build()
+        return self._gateways
+
+    def get(self, method: PaymentMethod) -> Optional[BasePaymentGateway]:
+        return self.gateways.get(method)
+
+    def __getitem__(self, method: PaymentMethod) -> BasePaymentGateway:
+        return self.gateways[method]
+
+    async def close(self):
+        if self._gateways is None:
+            return
+        for method, gateway in self._gateways.items():
+            try:
+                await gateway.close()
+            except Exception as e:
+                LOG.warning(f"Error closing {method.value} gateway: {e}")
+        self._gateways = None
+
+
+gateway_registry = GatewayRegistry()
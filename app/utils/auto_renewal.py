@@ -1,17 +1,14 @@
 import asyncio
 import logging
-from datetime import datetime, timedelta
-from decimal import Decimal
-from sqlalchemy import select
+from typing import Dict, List, Optional
 from aiogram import Bot
-from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
 
 from app.repo.db import get_session
-from app.repo.models import User
 from app.repo.user import UserRepository
 from app.utils.redis import get_redis
+from app.utils.send_queue import send_queue, Priority
 from app.locales.locales import get_translator
-from config import PLANS
+from config import PLANS, NOTIFICATION_SENDERS
 
 LOG = logging.getLogger(__name__)
 
@@ -23,154 +20,92 @@ class AutoRenewalTask:
     - User has sufficient balance
     - Balance >= cheapest plan price (1 month)
 
-    Runs every 6 hours to check for users needing auto-renewal.
+    Renewals are driven by lifecycle events; run_once is the daily sweep
+    scheduled in run.py.
     """
 
-    def __init__(self, bot: Bot, check_interval_seconds: int = 3600 * 6):
+    def __init__(
+        self,
+        bot: Bot,
+        panel_concurrency: int = 10,
+        notify_concurrency: int = NOTIFICATION_SENDERS
+    ):
         """
         Args:
             bot: Aiogram Bot instance for sending notifications
-            check_interval_seconds: How often to check (default: 6 hours)
+            panel_concurrency: Simultaneous panel requests when pushing new expiry dates
+            notify_concurrency: Concurrent notification senders
         """
         self.bot = bot
-        self.check_interval = check_interval_seconds
-        self.task: asyncio.Task = None
-        self._running = False
+        self.panel_concurrency = panel_concurrency
+        self.notify_concurrency = notify_concurrency
 
-    async def _attempt_auto_renewal(self, user: User, redis) -> bool:
+    async def _notify(self, item: Dict, days: int, price: float) -> str:
         """
-        Attempt to auto-renew user subscription with 1-month plan.
-
-        Args:
-            user: User model instance
-            redis: Redis client
+        Tell a user their subscription was renewed.
 
         Returns:
-            True if renewed successfully, False otherwise
+            'sent', 'blocked' or 'failed'
+        """
+        t = get_translator(item['lang'])
+        message = t('auto_renewal_success',
+                   days=days,
+                   price=price,
+                   balance=float(item['balance']),
+                   expire_date=item['subscription_end'].strftime('%Y.%m.%d'))
+
+        return await send_queue.send_message(item['tg_id'], message, priority=Priority.TRANSACTIONAL)
+
+    async def run_once(self) -> Dict:
+        """Run a single auto-renewal cycle over every eligible user (errors propagate to the scheduler)"""
+        return await self.renew()
+
+    async def renew(self, tg_ids: Optional[List[int]] = None) -> Dict:
+        """
+        Renew eligible subscriptions (all of them, or only those of tg_ids).
+
+        Renews with set-based batches, then pushes the new expiry dates to the
+        panel and sends notifications concurrently.
         """
-        try:
-            # Get 1-month plan (most affordable)
-            monthly_plan = PLANS['sub_1m']
-            price = Decimal(str(monthly_plan['price']))
-            days = monthly_plan['days']
-
-            # Check if user has sufficient balance
-            if user.balance < price:
-                LOG.debug(f"User {user.tg_id} has insufficient balance for auto-renewal: {user.balance} < {price}")
-                return False
-
-            # Renew subscription
-            async with get_session() as session:
-                user_repo = UserRepository(session, redis)
-
-                success = await user_repo.buy_subscription(
-                    tg_id=user.tg_id,
-                    days=days,
-                    price=float(price)
-                )
-
-                if success:
-                    LOG.info(f"Auto-renewed subscription for user {user.tg_id}: {days} days for {price} RUB")
-
-                    # Send notification
-                    try:
-                        t = get_translator(user.lang)
-                        new_balance = user.balance - price
-                        sub_end = await user_repo.get_subscription_end(user.tg_id)
-                        expire_date = datetime.fromtimestamp(sub_end).strftime('%Y.%m.%d')
-
-                        message = t('auto_renewal_success',
-                                   days=days,
-                                   price=float(price),
-                                   balance=float(new_balance),
-                                   expire_date=expire_date)
-
-                        await self.bot.send_message(chat_id=user.tg_id, text=message)
-                    except (TelegramForbiddenError, TelegramBadRequest) as e:
-                        LOG.warning(f"Could not notify user {user.tg_id} about auto-renewal: {e}")
-
-                    return True
-                else:
-                    LOG.warning(f"Failed to auto-renew subscription for user {user.tg_id}")
-                    return False
-
-        except Exception as e:
-            LOG.error(f"Error during auto-renewal for user {user.tg_id}: {type(e).__name__}: {e}")
-            return False
-
-    async def run_once(self):
-        """Run a single auto-renewal check cycle"""
-        try:
-            redis = await get_redis()
-
-            async with get_session() as session:
-                # Get users whose subscription expires in <= 1 day
-                now = datetime.utcnow()
-                threshold = now + timedelta(days=1)
-
-                result = await session.execute(
-                    select(User).where(
-                        User.subscription_end.isnot(None),
-                        User.subscription_end <= threshold,  # Expires soon
-                        User.subscription_end >= now  # Not yet expired
-                    )
-                )
-                users = result.scalars().all()
-
-                LOG.info(f"Checking {len(users)} users for auto-renewal eligibility")
-
-                renewal_count = 0
-                for user in users:
-                    # Skip if balance too low (< monthly plan price)
-                    monthly_price = Decimal(str(PLANS['sub_1m']['price']))
-                    if user.balance < monthly_price:
-                        continue
-
-                    # Check if already auto-renewed today
-                    redis_key = f"auto_renewal:{user.tg_id}:{now.strftime('%Y%m%d')}"
-                    already_processed = await redis.get(redis_key)
-                    if already_processed:
-                        continue
-
-                    # Attempt auto-renewal
-                    success = await self._attempt_auto_renewal(user, redis)
-                    if success:
-                        renewal_count += 1
-                        # Mark as processed for today
-                        await redis.setex(redis_key, 86400, "1")
-
-                LOG.info(f"Auto-renewal check completed: {renewal_count} subscriptions renewed")
-
-        except Exception as e:
-            LOG.error(f"Auto-renewal check error: {type(e).__name__}: {e}")
-
-    async def run_loop(self):
-        """Continuously run auto-renewal checks"""
-        self._running = True
-        LOG.info(f"Auto-renewal task started (interval: {self.check_interval}s)")
-
-        while self._running:
-            try:
-                await self.run_once()
-            except Exception as e:
-                LOG.error(f"Error in auto-renewal loop: {type(e).__name__}: {e}")
-
-            # Wait for next check
-            await asyncio.sleep(self.check_interval)
-
-        LOG.info("Auto-renewal task stopped")
-
-    def start(self):
-        """Start the background auto-renewal task"""
-        if self.task is None or self.task.done():
-            self.task = asyncio.create_task(self.run_loop())
-            LOG.info("Auto-renewal task created")
-        else:
-            LOG.warning("Auto-renewal task already running")
-
-    def stop(self):
-        """Stop the background auto-renewal task"""
-        self._running = False
-        if self.task and not self.task.done():
-            self.task.cancel()
-            LOG.info("Auto-renewal task cancelled")
+        # Renew with the 1-month plan (most affordable)
+        monthly_plan = PLANS['sub_1m']
+        price = float(monthly_plan['price'])
+        days = monthly_plan['days']
+
+        redis = await get_redis()
+        async with get_session() as session:
+            user_repo = UserRepository(session, redis)
+            renewed = await user_repo.bulk_renew_subscriptions(
+                days=days, price=price, window_hours=24, tg_ids=tg_ids
+            )
+
+            panel_updates = [
+                (username, int(item['subscription_end'].timestamp()))
+                for item in renewed
+                for username in item['usernames']
+            ]
+            panel_updated = await user_repo.push_subscription_ends(
+                panel_updates, concurrency=self.panel_concurrency
+            )
+
+        semaphore = asyncio.Semaphore(self.notify_concurrency)
+
+        async def notify(item: Dict) -> str:
+            # Renewed either way; only the receipt is skipped for unreachable users
+            if not item['reachable']:
+                return 'skipped'
+            async with semaphore:
+                return await self._notify(item, days, price)
+
+        results = await asyncio.gather(*[notify(item) for item in renewed])
+
+        stats = {
+            'renewed': len(renewed),
+            'panel_updated': panel_updated,
+            'panel_failed': len(panel_updates) - panel_updated,
+            'notified': results.count('sent'),
+            'blocked': results.count('blocked'),
+            'skipped': results.count('skipped'),
+        }
+        LOG.info(f"Auto-renewal completed: {stats}")
+        return stats
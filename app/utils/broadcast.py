@@ -0,0 +1,340 @@
+import asyncio
+import logging
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+
+from app.repo.db import get_session
+from app.repo.broadcasts import BroadcastRepository, ACTIVE_STATUSES
+from app.repo.models import BroadcastJob
+from app.repo.user import UserRepository
+from app.locales.locales import get_translator
+from app.utils.redis import get_redis
+from app.utils.send_queue import send_queue, Priority, SENT, BLOCKED
+from config import BROADCAST_WORKERS
+
+LOG = logging.getLogger(__name__)
+
+LEASE_KEY = "broadcast:runner:{job_id}"
+LEASE_TTL = 60  # Refreshed every LEASE_TTL / 3 seconds while the runner is alive
+
+# Extend / release the lease only if this runner still holds it
+_EXTEND_LEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE_LEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def _format_eta(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m {seconds % 60}s"
+    return f"{seconds}s"
+
+
+class BroadcastEngine:
+    """
+    Runs admin broadcasts as persisted jobs.
+
+    The admin's message is copied (so media and formatting are kept) to
+    recipients streamed page by page in tg_id order. Each page is sent by a
+    small pool of workers through the send queue, then the cursor and counters
+    are saved; pausing and cancelling take effect after the page in flight,
+    and a restart resends at most that page. A runner that hits an error
+    pauses the job with the error shown to the admin, who can resume it.
+    Send outcomes update the users'
+    delivery state (see app.utils.delivery), so unreachable users drop out of
+    later streams. The admin's progress message is edited with counters and ETA.
+
+    A runner holds a Redis lease on its job (LEASE_KEY), so with several
+    webhook workers a resume that lands on another process never starts a
+    second runner while the first is still sending.
+    """
+
+    def __init__(
+        self,
+        workers: int = BROADCAST_WORKERS,
+        page_size: int = 200,
+        progress_interval: float = 5.0
+    ):
+        """
+        Args:
+            workers: Concurrent sends per job
+            page_size: Recipients per page (the unit of progress and of pause/cancel latency)
+            progress_interval: Minimum seconds between progress message edits
+        """
+        self.bot: Optional[Bot] = None
+        self.workers = workers
+        self.page_size = page_size
+        self.progress_interval = progress_interval
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    async def start(self, bot: Bot, resume: bool = True):
+        """Resume jobs that were running when the bot stopped (in one process only)"""
+        self.bot = bot
+        if not resume:
+            return
+        async with get_session() as session:
+            jobs = await BroadcastRepository(session).get_running()
+        for job in jobs:
+            LOG.info(f"Resuming broadcast {job.id} after tg_id {job.cursor}")
+            self.run_job(job.id)
+
+    async def stop(self):
+        """Stop runners; jobs stay 'running' and continue from their cursor on the next start"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def create(
+        self,
+        created_by: int,
+        target: str,
+        source_chat_id: int,
+        source_message_id: int,
+        preview: Optional[str] = None,
+        lang: str = "ru",
+        progress_chat_id: Optional[int] = None,
+        progress_message_id: Optional[int] = None
+    ) -> BroadcastJob:
+        """Create a job for the current recipients of `target`; start it with run_job()"""
+        async with get_session() as session:
+            total = await UserRepository(session).count_broadcast_recipients(target)
+            return await BroadcastRepository(session).create(
+                created_by=created_by,
+                target=target,
+                source_chat_id=source_chat_id,
+                source_message_id=source_message_id,
+                total=total,
+                preview=preview,
+                lang=lang,
+                progress_chat_id=progress_chat_id,
+                progress_message_id=progress_message_id,
+            )
+
+    def run_job(self, job_id: int):
+        """Start a runner here; it exits at once if a runner in any process holds the lease"""
+        if job_id in self._tasks:
+            return
+        task = asyncio.create_task(self._run(job_id))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+
+    async def pause(self, job_id: int) -> bool:
+        async with get_session() as session:
+            return await BroadcastRepository(session).set_status(job_id, "paused", expected=("running",))
+
+    async def resume(self, job_id: int) -> bool:
+        async with get_session() as session:
+            resumed = await BroadcastRepository(session).set_status(job_id, "running", expected=("paused",))
+        if resumed:
+            self.run_job(job_id)
+        return resumed
+
+    async def cancel(self, job_id: int) -> bool:
+        async with get_session() as session:
+            cancelled = await BroadcastRepository(session).set_status(job_id, "cancelled", expected=ACTIVE_STATUSES)
+            job = await BroadcastRepository(session).get(job_id)
+        # A paused job has no runner to report the result
+        if cancelled and not await self._has_runner(job_id):
+            await self._render(job)
+        return cancelled
+
+    async def _has_runner(self, job_id: int) -> bool:
+        try:
+            redis = await get_redis()
+            return bool(await redis.exists(LEASE_KEY.format(job_id=job_id)))
+        except Exception as e:
+            LOG.warning(f"Could not check the runner of broadcast {job_id}: {e}")
+            return False
+
+    async def _keep_lease(self, redis, key: str, token: str, lost: asyncio.Event):
+        while True:
+            await asyncio.sleep(LEASE_TTL / 3)
+            try:
+                if not await redis.eval(_EXTEND_LEASE_SCRIPT, 1, key, token, LEASE_TTL):
+                    LOG.error(f"Runner lease {key} lost, stopping after the current page")
+                    lost.set()
+                    return
+            except Exception as e:
+                LOG.warning(f"Could not refresh runner lease {key}: {e}")
+
+    async def _pause_on_error(self, job_id: int, error: str) -> Optional[BroadcastJob]:
+        """Pause the job with the error, so the admin sees it and can resume from the saved cursor"""
+        LOG.error(f"Broadcast {job_id} stopped by error: {error}")
+        try:
+            async with get_session() as session:
+                repo = BroadcastRepository(session)
+                await repo.set_status(job_id, "paused", expected=("running",), error=error)
+                return await repo.get(job_id)
+        except Exception as e:
+            # Left 'running': resumed from the saved cursor on the next start
+            LOG.error(f"Could not pause broadcast {job_id}: {type(e).__name__}: {e}")
+            return None
+
+    async def _send_page(self, job: BroadcastJob, page: List[int]) -> List[str]:
+        results: List[Optional[str]] = [None] * len(page)
+        recipients = iter(enumerate(page))
+
+        async def worker():
+            for index, tg_id in recipients:
+                results[index] = await send_queue.copy_message(
+                    tg_id, job.source_chat_id, job.source_message_id, priority=Priority.BULK
+                )
+
+        await asyncio.gather(*(worker() for _ in range(min(self.workers, len(page)))))
+        return results
+
+    async def _run(self, job_id: int):
+        """Run the job while holding its lease"""
+        key = LEASE_KEY.format(job_id=job_id)
+        token = uuid.uuid4().hex
+        while True:
+            try:
+                redis = await get_redis()
+                acquired = await redis.set(key, token, nx=True, ex=LEASE_TTL)
+            except Exception as e:
+                await self._render(await self._pause_on_error(job_id, f"{type(e).__name__}: {e}"))
+                return
+            if not acquired:
+                LOG.info(f"Broadcast {job_id} already has a runner, not starting another")
+                return
+
+            lost = asyncio.Event()
+            heartbeat = asyncio.create_task(self._keep_lease(redis, key, token, lost))
+            try:
+                await self._run_pages(job_id, lost)
+            finally:
+                heartbeat.cancel()
+                try:
+                    await redis.eval(_RELEASE_LEASE_SCRIPT, 1, key, token)
+                except Exception as e:
+                    LOG.warning(f"Could not release runner lease {key}: {e}")
+
+            # A resume that arrived while this runner was stopping saw the lease
+            # and did not start; pick the job up again if it is running
+            try:
+                async with get_session() as session:
+                    job = await BroadcastRepository(session).get(job_id)
+            except Exception as e:
+                LOG.error(f"Could not recheck broadcast {job_id}: {type(e).__name__}: {e}")
+                return
+            if job is None or job.status != "running":
+                return
+
+    async def _run_pages(self, job_id: int, lost: asyncio.Event):
+        async with get_session() as session:
+            job = await BroadcastRepository(session).get(job_id)
+        if job is None or job.status != "running":
+            return
+
+        started = time.monotonic()
+        sent_this_run = 0
+        last_report = 0.0
+        status = job.status
+
+        try:
+            while status == "running" and not lost.is_set():
+                async with get_session() as session:
+                    page = await UserRepository(session).get_broadcast_recipients(
+                        job.target, after=job.cursor, limit=self.page_size
+                    )
+                if not page:
+                    async with get_session() as session:
+                        await BroadcastRepository(session).set_status(job_id, "completed", expected=("running",))
+                        status = (await BroadcastRepository(session).get(job_id)).status
+                    break
+
+                results = await self._send_page(job, page)
+                sent = sum(1 for r in results if r == SENT)
+                blocked = sum(1 for r in results if r == BLOCKED)
+                failed = len(page) - sent - blocked
+
+                async with get_session() as session:
+                    status = await BroadcastRepository(session).save_progress(
+                        job_id, cursor=page[-1], sent=sent, failed=failed, blocked=blocked
+                    )
+
+                job.cursor = page[-1]
+                job.sent += sent
+                job.failed += failed
+                job.blocked += blocked
+                sent_this_run += len(page)
+
+                if status == "running" and time.monotonic() - last_report >= self.progress_interval:
+                    last_report = time.monotonic()
+                    rate = sent_this_run / max(last_report - started, 1e-6)
+                    await self._render(job, rate=rate)
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            stored = await self._pause_on_error(job_id, f"{type(e).__name__}: {e}")
+            if stored is None:
+                return
+            status, job.error = stored.status, stored.error
+
+        if status == "running":
+            return  # Lease lost: whoever holds it now reports progress
+        job.status = status
+        await self._render(job)
+        LOG.info(
+            f"Broadcast {job_id} {status}: {job.sent} sent, {job.failed} failed, "
+            f"{job.blocked} blocked out of {job.total}"
+        )
+
+    async def _render(self, job: Optional[BroadcastJob], rate: Optional[float] = None):
+        """Show the job state in the admin's progress message"""
+        if job is None or not job.progress_message_id or self.bot is None:
+            return
+        # Imported here: app.admin imports this module through its handlers
+        from app.admin.keyboards import admin_panel_kb, broadcast_job_kb
+
+        t = get_translator(job.lang)
+        processed = job.sent + job.failed + job.blocked
+        total = max(job.total, processed)
+
+        if job.status == "running":
+            eta = _format_eta((total - processed) / rate) if rate else "—"
+            text = t('broadcast_progress', processed=processed, total=total,
+                     percent=int(processed * 100 / total) if total else 100,
+                     sent=job.sent, failed=job.failed, blocked=job.blocked, eta=eta)
+            keyboard = broadcast_job_kb(t, job.id, paused=False)
+        elif job.status == "paused":
+            text = t('broadcast_paused', processed=processed, total=total,
+                     sent=job.sent, failed=job.failed, blocked=job.blocked)
+            if job.error:
+                text += t('broadcast_paused_error', error=job.error)
+            keyboard = broadcast_job_kb(t, job.id, paused=True)
+        else:
+            key = 'broadcast_completed' if job.status == "completed" else 'broadcast_stopped'
+            text = t(key, total=total, success=job.sent, failed=job.failed, blocked=job.blocked)
+            keyboard = admin_panel_kb(t)
+
+        try:
+            await self.bot.edit_message_text(
+                text, chat_id=job.progress_chat_id, message_id=job.progress_message_id, reply_markup=keyboard
+            )
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                LOG.warning(f"Could not update progress of broadcast {job.id}: {e}")
+        except Exception as e:
+            LOG.warning(f"Could not update progress of broadcast {job.id}: {type(e).__name__}: {e}")
+
+
+broadcast_engine = BroadcastEngine()
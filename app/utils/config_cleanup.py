@@ -1,30 +1,212 @@
 import asyncio
 import logging
+import time
+import uuid
 from datetime import datetime, timedelta
-from sqlalchemy import select, update, func
+from typing import Awaitable, Callable, Dict, List, Optional
+from sqlalchemy import select, func, text
 from app.db.db import get_session
 from app.db.models import User, Config
 from app.api import ClientApiManager
 from app.models.server import Server, ServerTypes
 from config import MARZBAN_BASE_URL, MARZBAN_USERNAME, MARZBAN_PASSWORD
 from app.utils.redis import get_redis
+from app.utils.qr_cache import qr_cache
 
 LOG = logging.getLogger(__name__)
 
+CHECKPOINT_KEY = "config_cleanup:checkpoint:{days_threshold}"  # Per threshold: the admin run and the weekly job resume separately
+CHECKPOINT_TTL = 86400 * 7
+LOCK_KEY = "config_cleanup:lock"
+LOCK_TTL = 600  # Refreshed after every chunk
+
+# Marks a chunk deleted and decrements the owners' config counters in one statement
+_MARK_DELETED_SQL = text("""
+    WITH marked AS (
+        UPDATE configs SET deleted = true
+        WHERE id = ANY(:ids) AND deleted = false
+        RETURNING tg_id
+    ), counts AS (
+        SELECT tg_id, COUNT(*) AS n FROM marked GROUP BY tg_id
+    )
+    UPDATE users u SET configs = GREATEST(u.configs - counts.n, 0)
+    FROM counts WHERE u.tg_id = counts.tg_id
+    RETURNING u.tg_id
+""")
+
+ProgressCallback = Callable[[Dict, int], Awaitable[None]]
+
+
+class CleanupAlreadyRunning(Exception):
+    pass
+
+
+async def _load_checkpoint(redis, days_threshold: int) -> Optional[Dict]:
+    data = await redis.hgetall(CHECKPOINT_KEY.format(days_threshold=days_threshold))
+    return data or None
+
+
+async def _save_checkpoint(redis, days_threshold: int, cutoff: datetime, last_id: int, stats: Dict):
+    key = CHECKPOINT_KEY.format(days_threshold=days_threshold)
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.hset(key, mapping={
+            'days_threshold': days_threshold,
+            'cutoff': cutoff.isoformat(),
+            'last_id': last_id,
+            **stats,
+        })
+        pipe.expire(key, CHECKPOINT_TTL)
+        await pipe.execute()
+
+
+async def _get_marzban_server() -> Server:
+    server = Server(
+        id="default_marzban",
+        name="Default Marzban",
+        types=ServerTypes.MARZBAN,
+        data={
+            "host": MARZBAN_BASE_URL,
+            "username": MARZBAN_USERNAME,
+            "password": MARZBAN_PASSWORD,
+        },
+    )
+    from app.api.clients.marzban import MarzbanApiManager
+    api = MarzbanApiManager(host=server.data["host"])
+    token = await api.get_token(
+        username=server.data["username"], password=server.data["password"]
+    )
+    server.access = token.access_token if token else None
+    return server
+
+
+async def _remove_from_panel(api_manager, server, semaphore: asyncio.Semaphore, username: str):
+    async with semaphore:
+        try:
+            await api_manager.remove_user(server, username)
+            LOG.info(f"Deleted Marzban user {username}")
+        except Exception as e:
+            LOG.warning(f"Failed to delete Marzban user {username}: {e} (continuing with DB cleanup)")
+
+
+async def _delete_chunk(session, redis, api_manager, server, semaphore, chunk, stats: Dict):
+    """Delete one chunk of (id, tg_id, username, vless_link) config rows from the panel and the DB"""
+    stats['total_checked'] += len(chunk)
+
+    to_delete: List = []
+    for row in chunk:
+        # Skip if no username (shouldn't happen, but defensive)
+        if not row.username:
+            LOG.warning(f"Config {row.id} has no username, skipping")
+            stats['skipped'] += 1
+            continue
+        to_delete.append(row)
+
+    if not to_delete:
+        return
+
+    await asyncio.gather(*[
+        _remove_from_panel(api_manager, server, semaphore, row.username)
+        for row in to_delete
+    ])
+
+    try:
+        result = await session.execute(
+            _MARK_DELETED_SQL, {"ids": [row.id for row in to_delete]}
+        )
+        touched_users = [r[0] for r in result.all()]
+        await session.commit()
+        stats['deleted'] += len(to_delete)
+    except Exception as e:
+        LOG.error(f"Error marking configs {to_delete[0].id}..{to_delete[-1].id} deleted: {type(e).__name__}: {e}")
+        await session.rollback()
+        stats['failed'] += len(to_delete)
+        return
+
+    if touched_users:
+        try:
+            await redis.delete(*[f"user:{tg_id}:configs" for tg_id in touched_users])
+        except Exception as e:
+            LOG.warning(f"Failed to invalidate config caches: {e}")
+    await qr_cache.invalidate(row.vless_link for row in to_delete)
+
+
+def _expired_configs_query(threshold_date: datetime):
+    """Non-deleted configs of users whose subscription ended before threshold_date"""
+    return (
+        select(Config.id, Config.tg_id, Config.username, Config.vless_link)
+        .join(User, Config.tg_id == User.tg_id)
+        .where(
+            Config.deleted == False,
+            User.subscription_end.isnot(None),
+            User.subscription_end < threshold_date
+        )
+    )
+
+
+async def cleanup_user_configs(tg_ids: List[int], days_threshold: int = 14, concurrency: int = 10) -> dict:
+    """
+    Clean up expired configs of specific users (used by the lifecycle dispatcher).
+
+    Same rules as cleanup_expired_configs, without checkpointing.
+    """
+    stats = {
+        'total_checked': 0,
+        'deleted': 0,
+        'failed': 0,
+        'skipped': 0
+    }
+    if not tg_ids:
+        return stats
+
+    server = await _get_marzban_server()
+    if not server.access:
+        LOG.error("Failed to get access token for Marzban server. Aborting cleanup.")
+        return stats
+
+    redis = await get_redis()
+    threshold_date = datetime.utcnow() - timedelta(days=days_threshold)
+    async with get_session() as session:
+        result = await session.execute(
+            _expired_configs_query(threshold_date)
+            .where(Config.tg_id.in_(tg_ids))
+            .order_by(Config.id)
+        )
+        chunk = result.all()
+        if chunk:
+            await _delete_chunk(
+                session, redis, ClientApiManager(), server, asyncio.Semaphore(concurrency), chunk, stats
+            )
+
+    if stats['deleted']:
+        LOG.info(f"Cleaned up configs of {len(tg_ids)} expired users: {stats}")
+    return stats
 
-async def cleanup_expired_configs(days_threshold: int = 14) -> dict:
+
+async def cleanup_expired_configs(
+    days_threshold: int = 14,
+    chunk_size: int = 200,
+    concurrency: int = 10,
+    progress: Optional[ProgressCallback] = None,
+    progress_interval: float = 3.0
+) -> dict:
     """
     Clean up configs for users with expired subscriptions (> days_threshold days).
 
-    Process:
-    1. Find all configs where subscription_end < (now - days_threshold)
-    2. Delete config from Marzban
-    3. Mark config as deleted in DB
-    4. Decrement user's config count
-    5. Invalidate Redis cache
+    Works through expired configs in id order, one chunk at a time:
+    1. Delete the chunk's users from Marzban (bounded concurrency)
+    2. Mark the chunk deleted and decrement config counts (one statement, one commit)
+    3. Invalidate Redis caches (one pipeline)
+    4. Save a checkpoint (last id, stats, cutoff) in Redis
+
+    A run that crashes is resumed from its checkpoint by the next call with the
+    same threshold. Only one run can be active at a time.
 
     Args:
         days_threshold: Number of days after subscription expiry to keep configs (default: 14)
+        chunk_size: Configs per chunk
+        concurrency: Simultaneous panel delete requests
+        progress: Awaited with (stats, total) after chunks, at most every progress_interval seconds
+        progress_interval: Minimum seconds between progress callbacks
 
     Returns:
         dict with statistics: {
@@ -33,6 +215,10 @@ async def cleanup_expired_configs(days_threshold: int = 14) -> dict:
             'failed': int,
             'skipped': int
         }
+
+    Raises:
+        CleanupAlreadyRunning: If another cleanup run holds the lock
+        Exception: Whatever stopped the run (its checkpoint is kept)
     """
     stats = {
         'total_checked': 0,
@@ -41,164 +227,103 @@ async def cleanup_expired_configs(days_threshold: int = 14) -> dict:
         'skipped': 0
     }
 
-    try:
-        async with get_session() as session:
-            redis = await get_redis()
-            
-            server = Server(
-                id="default_marzban",
-                name="Default Marzban",
-                types=ServerTypes.MARZBAN,
-                data={
-                    "host": MARZBAN_BASE_URL,
-                    "username": MARZBAN_USERNAME,
-                    "password": MARZBAN_PASSWORD,
-                },
-            )
-            from app.api.clients.marzban import MarzbanApiManager
-            api = MarzbanApiManager(host=server.data["host"])
-            token = await api.get_token(
-                username=server.data["username"], password=server.data["password"]
-            )
-            server.access = token.access_token if token else None
-
-            if not server.access:
-                LOG.error("Failed to get access token for Marzban server. Aborting cleanup.")
-                return stats
+    redis = await get_redis()
+    lock_token = uuid.uuid4().hex
+    if not await redis.set(LOCK_KEY, lock_token, nx=True, ex=LOCK_TTL):
+        raise CleanupAlreadyRunning()
 
-            api_manager = ClientApiManager()
-
-            # Calculate threshold date
-            now = datetime.utcnow()
-            threshold_date = now - timedelta(days=days_threshold)
+    try:
+        server = await _get_marzban_server()
+        if not server.access:
+            LOG.error("Failed to get access token for Marzban server. Aborting cleanup.")
+            return stats
 
+        api_manager = ClientApiManager()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        checkpoint = await _load_checkpoint(redis, days_threshold)
+        if checkpoint:
+            # Keep the original cutoff so the resumed run covers the same set
+            threshold_date = datetime.fromisoformat(checkpoint['cutoff'])
+            last_id = int(checkpoint['last_id'])
+            for key in stats:
+                stats[key] = int(checkpoint.get(key, 0))
+            LOG.info(f"Resuming expired config cleanup after config {last_id} (cutoff: {threshold_date})")
+        else:
+            threshold_date = datetime.utcnow() - timedelta(days=days_threshold)
+            last_id = 0
             LOG.info(f"Starting expired config cleanup (threshold: {days_threshold} days, cutoff: {threshold_date})")
 
-            # Find all non-deleted configs for users with expired subscriptions
-            result = await session.execute(
-                select(Config, User.subscription_end)
-                .join(User, Config.tg_id == User.tg_id)
-                .where(
-                    Config.deleted == False,
-                    User.subscription_end.isnot(None),
-                    User.subscription_end < threshold_date
-                )
+        expired = _expired_configs_query(threshold_date)
+
+        async with get_session() as session:
+            remaining = await session.scalar(
+                select(func.count()).select_from(expired.where(Config.id > last_id).subquery())
             )
-            configs_to_delete = result.all()
+        total = stats['total_checked'] + (remaining or 0)
+        LOG.info(f"Found {remaining} expired configs to clean up")
+
+        last_progress = 0.0
+        while True:
+            async with get_session() as session:
+                result = await session.execute(
+                    expired.where(Config.id > last_id).order_by(Config.id).limit(chunk_size)
+                )
+                chunk = result.all()
+                if not chunk:
+                    break
 
-            stats['total_checked'] = len(configs_to_delete)
-            LOG.info(f"Found {stats['total_checked']} expired configs to clean up")
+                last_id = chunk[-1].id
+                await _delete_chunk(session, redis, api_manager, server, semaphore, chunk, stats)
 
-            for config, subscription_end in configs_to_delete:
-                try:
-                    tg_id = config.tg_id
-                    username = config.username
-                    config_id = config.id
-                    
-                    # Skip if no username (shouldn't happen, but defensive)
-                    if not username:
-                        LOG.warning(f"Config {config_id} has no username, skipping")
-                        stats['skipped'] += 1
-                        continue
-
-                    LOG.info(f"Cleaning up config {config_id} (user: {tg_id}, username: {username}, expired: {subscription_end})")
-
-                    # 1. Delete from Marzban
-                    try:
-                        await api_manager.remove_user(server, username)
-                        LOG.info(f"Deleted Marzban user {username}")
-                    except Exception as e:
-                        LOG.warning(f"Failed to delete Marzban user {username}: {e} (continuing with DB cleanup)")
-
-                    # 2. Mark as deleted in DB
-                    config.deleted = True
-
-                    # 3. Decrement user's config count
-                    await session.execute(
-                        update(User)
-                        .where(User.tg_id == tg_id)
-                        .values(configs=func.greatest(User.configs - 1, 0))
-                    )
-
-                    await session.commit()
-
-                    # 4. Invalidate Redis cache
-                    try:
-                        await redis.delete(f"user:{tg_id}:configs")
-                    except Exception as e:
-                        LOG.warning(f"Failed to invalidate cache for user {tg_id}: {e}")
-
-                    stats['deleted'] += 1
-                    LOG.info(f"Successfully cleaned up config {config_id}")
+            await _save_checkpoint(redis, days_threshold, threshold_date, last_id, stats)
+            await redis.expire(LOCK_KEY, LOCK_TTL)
 
+            if progress and time.monotonic() - last_progress >= progress_interval:
+                last_progress = time.monotonic()
+                try:
+                    await progress(stats, total)
                 except Exception as e:
-                    LOG.error(f"Error cleaning up config {config.id}: {type(e).__name__}: {e}")
-                    stats['failed'] += 1
-                    await session.rollback()
+                    LOG.debug(f"Cleanup progress callback failed: {e}")
 
-            LOG.info(f"Config cleanup completed: {stats}")
-            return stats
+        await redis.delete(CHECKPOINT_KEY.format(days_threshold=days_threshold))
+        LOG.info(f"Config cleanup completed: {stats}")
+        return stats
 
     except Exception as e:
+        # The checkpoint stays, so the next run continues from the last finished chunk
         LOG.error(f"Fatal error in cleanup_expired_configs: {type(e).__name__}: {e}")
-        stats['failed'] = stats['total_checked']
-        return stats
+        raise
+
+    finally:
+        try:
+            if await redis.get(LOCK_KEY) == lock_token:
+                await redis.delete(LOCK_KEY)
+        except Exception as e:
+            LOG.warning(f"Failed to release config cleanup lock: {e}")
 
 
 class ConfigCleanupTask:
     """
     Background task that periodically cleans up expired configs.
 
-    Runs once per week by default and removes configs for users
-    whose subscriptions expired more than 14 days ago.
+    Scheduled weekly in run.py; removes configs for users whose
+    subscriptions expired more than `days_threshold` days ago.
     """
 
-    def __init__(self, check_interval_seconds: int = 86400 * 7, days_threshold: int = 14):
+    def __init__(self, days_threshold: int = 14):
         """
         Args:
-            check_interval_seconds: How often to run cleanup (default: 7 days)
             days_threshold: Days after expiry to keep configs (default: 14)
         """
-        self.check_interval = check_interval_seconds
         self.days_threshold = days_threshold
-        self.task: asyncio.Task = None
-        self._running = False
 
-    async def run_once(self):
-        """Run a single cleanup cycle"""
+    async def run_once(self) -> Dict:
+        """Run a single cleanup cycle (errors propagate to the scheduler, which records them)"""
         try:
             stats = await cleanup_expired_configs(self.days_threshold)
-            LOG.info(f"Expired config cleanup stats: {stats}")
-        except Exception as e:
-            LOG.error(f"Config cleanup error: {type(e).__name__}: {e}")
-
-    async def run_loop(self):
-        """Continuously run cleanup checks"""
-        self._running = True
-        LOG.info(f"Config cleanup task started (interval: {self.check_interval}s, threshold: {self.days_threshold} days)")
-
-        while self._running:
-            try:
-                await self.run_once()
-            except Exception as e:
-                LOG.error(f"Error in config cleanup loop: {type(e).__name__}: {e}")
-
-            # Wait for next check
-            await asyncio.sleep(self.check_interval)
-
-        LOG.info("Config cleanup task stopped")
-
-    def start(self):
-        """Start the background cleanup task"""
-        if self.task is None or self.task.done():
-            self.task = asyncio.create_task(self.run_loop())
-            LOG.info("Config cleanup task created")
-        else:
-            LOG.warning("Config cleanup task already running")
-
-    def stop(self):
-        """Stop the background cleanup task"""
-        self._running = False
-        if self.task and not self.task.done():
-            self.task.cancel()
-            LOG.info("Config cleanup task cancelled")
+        except CleanupAlreadyRunning:
+            LOG.info("Config cleanup already running, skipping")
+            return {'skipped': 'already_running'}
+        LOG.info(f"Expired config cleanup stats: {stats}")
+        return stats
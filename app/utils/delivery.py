@@ -0,0 +1,165 @@
+import asyncio
+import logging
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware
+
+from app.repo.db import get_session
+from app.repo.user import UserRepository
+from app.utils.redis import get_redis
+
+LOG = logging.getLogger(__name__)
+
+UNREACHABLE_KEY = "delivery:unreachable"
+
+SUCCESS_STATUSES = ("sent", "active")
+
+
+class DeliveryTracker:
+    """
+    Records send outcomes that say something about a chat and keeps users' delivery state.
+
+    Senders only call record(); outcomes are merged per chat in memory and
+    written to users.blocked_at / delivery_failures / delivery_error in one
+    statement per flush. Users who become unreachable (blocked the bot, or too
+    many consecutive chat-level failures; outages are not reported here, see
+    SendQueue._finish) are also kept in a Redis set, so the middleware
+    can clear the state with one SREM when they interact again.
+    """
+
+    def __init__(self, flush_interval: float = 5.0, max_buffer: int = 2000):
+        """
+        Args:
+            flush_interval: Seconds between writes
+            max_buffer: Buffered chats that trigger an early write
+        """
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._buffer: Dict[int, Tuple[str, int, Optional[str]]] = {}
+        self._wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def record(self, chat_id: int, status: str, error: Optional[str] = None):
+        """
+        Note a send outcome ('sent', 'blocked', 'failed') or an interaction ('active').
+
+        Group chats (negative ids) are not tracked.
+        """
+        if chat_id <= 0:
+            return
+        if status in SUCCESS_STATUSES:
+            self._buffer[chat_id] = (status, 0, None)
+        else:
+            _, failures, _ = self._buffer.get(chat_id, (status, 0, None))
+            self._buffer[chat_id] = (status, failures + 1, error[:500] if error else None)
+        if len(self._buffer) >= self.max_buffer:
+            self._wakeup.set()
+
+    async def flush(self) -> int:
+        """Write buffered outcomes. Returns the number of users whose state changed."""
+        if not self._buffer:
+            return 0
+        batch, self._buffer = self._buffer, {}
+        results = [(chat_id, *state) for chat_id, state in batch.items()]
+
+        try:
+            async with get_session() as session:
+                changed = await UserRepository(session).apply_delivery_results(results)
+        except Exception as e:
+            LOG.error(f"Could not store delivery state of {len(results)} chats: {type(e).__name__}: {e}")
+            # Keep outcomes that arrived meanwhile, put the failed batch back under them
+            for chat_id, state in batch.items():
+                self._buffer.setdefault(chat_id, state)
+            return 0
+
+        unreachable = [tg_id for tg_id, flag in changed.items() if flag]
+        reachable = [tg_id for tg_id, flag in changed.items() if not flag]
+        try:
+            redis = await get_redis()
+            async with redis.pipeline(transaction=False) as pipe:
+                if unreachable:
+                    pipe.sadd(UNREACHABLE_KEY, *unreachable)
+                if reachable:
+                    pipe.srem(UNREACHABLE_KEY, *reachable)
+                await pipe.execute()
+        except Exception as e:
+            LOG.warning(f"Could not update unreachable set: {e}")
+
+        if unreachable:
+            LOG.info(f"{len(unreachable)} users marked unreachable")
+        return len(changed)
+
+    async def sync_unreachable(self) -> int:
+        """
+        Rebuild the Redis set from the database (on start, in one process).
+
+        The set is built under a temporary key and swapped in with RENAME, so
+        other processes keep using (and SREM-ing from) the old set meanwhile.
+        """
+        redis = await get_redis()
+        building = f"{UNREACHABLE_KEY}:rebuild"
+        count = 0
+        after = 0
+        await redis.delete(building)
+        while True:
+            async with get_session() as session:
+                tg_ids = await UserRepository(session).get_unreachable_ids(after=after)
+            if not tg_ids:
+                break
+            await redis.sadd(building, *tg_ids)
+            count += len(tg_ids)
+            after = tg_ids[-1]
+
+        if count:
+            await redis.rename(building, UNREACHABLE_KEY)
+        else:
+            await redis.delete(UNREACHABLE_KEY)
+        return count
+
+    async def run_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def start(self, sync: bool = False):
+        if sync:
+            try:
+                count = await self.sync_unreachable()
+                LOG.info(f"Loaded {count} unreachable users")
+            except Exception as e:
+                LOG.warning(f"Could not load unreachable users: {e}")
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run_loop())
+
+    async def stop(self):
+        """Stop the loop and write what is left"""
+        if self.task and not self.task.done():
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        await self.flush()
+
+
+delivery_tracker = DeliveryTracker()
+
+
+class DeliveryStateMiddleware(BaseMiddleware):
+    """Outer update middleware: a user who interacts with the bot is reachable again"""
+
+    def __init__(self, tracker: DeliveryTracker = delivery_tracker):
+        super().__init__()
+        self.tracker = tracker
+
+    async def __call__(self, handler: Callable, event: Any, data: Dict[str, Any]):
+        user = data.get("event_from_user")
+        if user is not None:
+            try:
+                redis = await get_redis()
+                if await redis.srem(UNREACHABLE_KEY, user.id):
+                    self.tracker.record(user.id, "active")
+            except Exception as e:
+                LOG.debug(f"Delivery state check failed for {user.id}: {e}")
+        return await handler(event, data)
@@ -0,0 +1,115 @@
+import json
+import logging
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from app.utils.redis import get_redis
+from config import FSM_TTL_SECONDS
+
+LOG = logging.getLogger(__name__)
+
+# Expected types of known FSM data keys. Unknown keys are accepted as long as
+# they are plain JSON; live objects (Message, ORM rows, ...) never are.
+DATA_SCHEMA: Dict[str, tuple] = {
+    # Admin broadcast
+    "broadcast_text": (str,),
+    "source_chat_id": (int,),
+    "source_message_id": (int,),
+    "target": (str,),
+    "schedule_time": (str,),
+    # Admin user management
+    "grant_user_id": (int,),
+    "balance_user_id": (int,),
+    # Custom top-up amount
+    "method": (str,),
+}
+
+
+def _reject(value: Any):
+    raise TypeError(
+        f"{type(value).__name__} cannot be stored in FSM data; store ids or plain values instead"
+    )
+
+
+def dump_data(data: Mapping[str, Any]) -> str:
+    """Validate FSM data against DATA_SCHEMA and encode it as compact JSON"""
+    for key, value in data.items():
+        expected = DATA_SCHEMA.get(key)
+        if expected and value is not None and not isinstance(value, expected):
+            raise TypeError(
+                f"FSM data '{key}' must be {' or '.join(t.__name__ for t in expected)}, "
+                f"got {type(value).__name__}"
+            )
+    return json.dumps(dict(data), separators=(",", ":"), ensure_ascii=False, default=_reject)
+
+
+def load_data(raw: Optional[str]) -> Dict[str, Any]:
+    if not raw:
+        return {}
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        LOG.warning("Dropping undecodable FSM data")
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+class RedisFSMStorage(BaseStorage):
+    """
+    FSM storage in the shared Redis, so flows survive restarts and work across processes.
+
+    State and data of one chat/user live in a single hash (fields `s` and `d`)
+    with a TTL that is refreshed on every write, so abandoned flows expire on
+    their own. Data is validated and stored as compact JSON.
+    """
+
+    def __init__(self, prefix: str = "fsm", ttl: int = FSM_TTL_SECONDS):
+        """
+        Args:
+            prefix: Redis key prefix
+            ttl: Seconds an untouched flow is kept
+        """
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def _key(self, key: StorageKey) -> str:
+        parts = [self.prefix, str(key.bot_id), str(key.chat_id), str(key.user_id)]
+        if key.thread_id:
+            parts.append(f"t{key.thread_id}")
+        if key.business_connection_id:
+            parts.append(f"b{key.business_connection_id}")
+        if key.destiny != "default":
+            parts.append(key.destiny)
+        return ":".join(parts)
+
+    async def _write(self, key: StorageKey, field: str, value: Optional[str]):
+        redis = await get_redis()
+        name = self._key(key)
+        async with redis.pipeline(transaction=True) as pipe:
+            if value is None:
+                pipe.hdel(name, field)
+            else:
+                pipe.hset(name, field, value)
+                pipe.expire(name, self.ttl)
+            await pipe.execute()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await self._write(key, "s", value)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        redis = await get_redis()
+        return await redis.hget(self._key(key), "s")
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await self._write(key, "d", dump_data(data) if data else None)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        redis = await get_redis()
+        return load_data(await redis.hget(self._key(key), "d"))
+
+    async def close(self) -> None:
+        # The Redis client is shared with the rest of the app and closed by close_cache()
+        pass
@@ -0,0 +1,387 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import re
+import socket
+import time
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass, fields
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+import aiohttp
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from sqlalchemy import event
+
+from config import SLOW_UPDATE_SECONDS
+
+LOG = logging.getLogger(__name__)
+
+METRICS_KEY = "metrics:bot"
+COUNTERS_KEY = "metrics:bot:counters"
+METRICS_STALE_SECONDS = 300
+
+# Callback data segments that identify an object rather than an action
+_ID_SEGMENT = re.compile(r'^(\d+|[0-9a-fA-F-]{16,}|[A-Za-z0-9-]{24,})$')
+_SEPARATORS = re.compile(r'([_:])')
+
+
+@dataclass
+class UpdateCost:
+    """Resources used while handling one update"""
+    db: int = 0      # SQL statements
+    redis: int = 0   # Redis commands
+    http: int = 0    # External HTTP requests (panel, payment and rate APIs)
+    tg: int = 0      # Telegram Bot API requests
+
+    def as_dict(self) -> Dict[str, int]:
+        return {f.name: getattr(self, f.name) for f in fields(self)}
+
+
+_current: ContextVar[Optional[UpdateCost]] = ContextVar("update_cost", default=None)
+
+
+def count(kind: str, n: int = 1):
+    """Add to the cost of the update being handled (no-op outside handlers)"""
+    cost = _current.get()
+    if cost is not None:
+        setattr(cost, kind, getattr(cost, kind) + n)
+
+
+def callback_prefix(data: str) -> str:
+    """
+    Action part of callback data: 'qr_cfg_123' -> 'qr_cfg_', 'sub_1m' -> 'sub_1m'.
+
+    Everything from the first id-like segment on is dropped.
+    """
+    prefix = ""
+    for part in _SEPARATORS.split(data):
+        if part not in ("_", ":") and _ID_SEGMENT.match(part):
+            return prefix
+        prefix += part
+    return prefix
+
+
+# ----------------------------
+# Resource counters
+# ----------------------------
+
+def instrument_engine(engine):
+    """Count SQL statements issued through an (async) engine"""
+    event.listen(engine.sync_engine, "before_cursor_execute", lambda *args: count("db"))
+
+
+def instrument_redis(client):
+    """Count commands of a redis.asyncio client, including pipelined ones"""
+    execute_command = client.execute_command
+    make_pipeline = client.pipeline
+
+    async def counted_execute_command(*args, **kwargs):
+        count("redis")
+        return await execute_command(*args, **kwargs)
+
+    def counted_pipeline(*args, **kwargs):
+        pipe = make_pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        async def counted_execute(*a, **kw):
+            count("redis", len(pipe.command_stack))
+            return await execute(*a, **kw)
+
+        pipe.execute = counted_execute
+        return pipe
+
+    client.execute_command = counted_execute_command
+    client.pipeline = counted_pipeline
+
+
+async def count_http_request(request):
+    """httpx request event hook"""
+    count("http")
+
+
+def http_trace_config() -> aiohttp.TraceConfig:
+    """
+    aiohttp trace config counting the requests of a session we create.
+
+    SDKs that own their HTTP client (CryptoBot, YooKassa, tonapi) are counted
+    with count("http") at their call sites instead.
+    """
+    async def on_request_start(session, context, params):
+        count("http")
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    return trace_config
+
+
+class TelegramRequestCounter(BaseRequestMiddleware):
+    """Bot session middleware counting Bot API requests"""
+
+    async def __call__(self, make_request, bot, method):
+        count("tg")
+        return await make_request(bot, method)
+
+
+# ----------------------------
+# Aggregation
+# ----------------------------
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # Nearest rank
+    index = max(0, math.ceil(q * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+class _Series:
+    __slots__ = ("durations", "count", "errors", "totals", "max_duration")
+
+    def __init__(self, samples: int):
+        self.durations: Deque[float] = deque(maxlen=samples)
+        self.count = 0
+        self.errors = 0
+        self.totals = UpdateCost()
+        self.max_duration = 0.0
+
+    def add(self, duration: float, cost: UpdateCost, failed: bool):
+        self.durations.append(duration)
+        self.count += 1
+        self.errors += failed
+        self.max_duration = max(self.max_duration, duration)
+        for name, value in cost.as_dict().items():
+            setattr(self.totals, name, getattr(self.totals, name) + value)
+
+    def summary(self) -> Dict[str, Any]:
+        values = sorted(self.durations)
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "p50": round(_percentile(values, 0.50), 4),
+            "p95": round(_percentile(values, 0.95), 4),
+            "p99": round(_percentile(values, 0.99), 4),
+            "max": round(self.max_duration, 4),
+            # Average resources per update
+            **{name: round(total / self.count, 2) for name, total in self.totals.as_dict().items()},
+        }
+
+
+class HandlerMetrics:
+    """
+    Latency and resource histograms per handler and per action.
+
+    Percentiles come from the last `samples` updates of each series; counts
+    and resource averages cover the whole process lifetime.
+
+    Action keys come from client-controlled data (forged callback data or
+    commands), so at most `max_actions` of them get their own series; later
+    ones are folded into `<kind>:other`. Handler series are bounded by the
+    code and not capped.
+    """
+
+    def __init__(self, samples: int = 1000, max_actions: int = 200):
+        self.samples = samples
+        self.max_actions = max_actions
+        self._series: Dict[str, _Series] = {}
+        self._actions = 0
+
+    def record(self, keys: List[str], duration: float, cost: UpdateCost, failed: bool = False):
+        for key in keys:
+            series = self._series.get(key)
+            if series is None:
+                if not key.startswith("handler:"):
+                    if self._actions >= self.max_actions:
+                        key = f"{key.split(':', 1)[0]}:other"
+                        series = self._series.get(key)
+                    if series is None:
+                        self._actions += 1
+                if series is None:
+                    series = self._series[key] = _Series(self.samples)
+            series.add(duration, cost, failed)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {key: series.summary() for key, series in sorted(self._series.items())}
+
+
+handler_metrics = HandlerMetrics()
+
+
+class InstrumentationMiddleware(BaseMiddleware):
+    """
+    Inner middleware measuring wall time and DB/Redis/HTTP/Bot API calls per update.
+
+    Each update is recorded under its handler (`handler:<name>`) and its action
+    (`cb:<callback prefix>` or `cmd:<command>`). Updates slower than
+    SLOW_UPDATE_SECONDS are logged with the breakdown.
+    """
+
+    def __init__(self, metrics: HandlerMetrics = handler_metrics, slow_seconds: float = SLOW_UPDATE_SECONDS):
+        super().__init__()
+        self.metrics = metrics
+        self.slow_seconds = slow_seconds
+
+    @staticmethod
+    def _action(event: Any) -> str:
+        data = getattr(event, "data", None)
+        if isinstance(data, str):
+            return f"cb:{callback_prefix(data)}"
+        text = getattr(event, "text", None)
+        if isinstance(text, str) and text.startswith("/"):
+            return f"cmd:{text.split()[0].split('@')[0]}"
+        return f"msg:{event.__class__.__name__}"
+
+    @staticmethod
+    def _handler_name(data: Dict[str, Any]) -> str:
+        handler = data.get("handler")
+        callback = getattr(handler, "callback", None)
+        if callback is None:
+            return "unknown"
+        return f"{callback.__module__.rsplit('.', 1)[-1]}.{callback.__qualname__}"
+
+    async def __call__(self, handler: Callable, event: Any, data: Dict[str, Any]):
+        cost = UpdateCost()
+        token = _current.set(cost)
+        started = time.perf_counter()
+        failed = False
+        try:
+            return await handler(event, data)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            _current.reset(token)
+
+            name = self._handler_name(data)
+            action = self._action(event)
+            self.metrics.record([f"handler:{name}", action], duration, cost, failed)
+
+            if duration >= self.slow_seconds:
+                LOG.warning(
+                    f"Slow update {action} in {name}: {duration:.2f}s "
+                    f"(db={cost.db}, redis={cost.redis}, http={cost.http}, tg={cost.tg})"
+                )
+
+
+# ----------------------------
+# Publishing
+# ----------------------------
+
+def _instance_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+async def publish_metrics(redis, extra: Optional[Dict[str, Any]] = None):
+    """Write this process's snapshot to the metrics hash read by the manager"""
+    payload = {
+        "updated_at": datetime.utcnow().isoformat(),
+        "handlers": handler_metrics.snapshot(),
+        **(extra or {}),
+    }
+    await redis.hset(METRICS_KEY, _instance_id(), json.dumps(payload, separators=(",", ":")))
+
+
+async def run_metrics_publisher(interval: int = 30, extra: Optional[Callable[[], Dict[str, Any]]] = None):
+    """
+    Periodically publish handler metrics (and `extra()`, e.g. executor stats).
+
+    Args:
+        interval: Seconds between snapshots
+        extra: Returns additional sections of the snapshot
+    """
+    from app.utils.redis import get_redis
+
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await publish_metrics(await get_redis(), extra() if extra else None)
+            except Exception as e:
+                LOG.warning(f"Could not publish handler metrics: {e}")
+    except asyncio.CancelledError:
+        try:
+            redis = await get_redis()
+            await redis.hdel(METRICS_KEY, _instance_id())
+        except Exception:
+            pass
+
+
+def counter_field(name: str, **labels: Any) -> str:
+    """Hash field of a counter: 'payments_created|method=ton'"""
+    if not labels:
+        return name
+    return name + "|" + ",".join(f"{key}={value}" for key, value in sorted(labels.items()))
+
+
+def parse_counter_field(field: str) -> Tuple[str, Dict[str, str]]:
+    name, _, rest = field.partition("|")
+    labels = dict(part.split("=", 1) for part in rest.split(",") if "=" in part)
+    return name, labels
+
+
+async def incr_counter(name: str, amount: int = 1, **labels: Any):
+    """
+    Add to an application counter shared by all bot processes.
+
+    Counters live in one Redis hash, so they survive restarts and add up
+    across webhook workers; the manager exports them to Prometheus.
+    """
+    from app.utils.redis import get_redis
+
+    try:
+        redis = await get_redis()
+        await redis.hincrby(COUNTERS_KEY, counter_field(name, **labels), amount)
+    except Exception as e:
+        LOG.debug(f"Could not update counter {name}: {e}")
+
+
+async def get_counters(redis) -> Dict[str, int]:
+    return {field: int(value) for field, value in (await redis.hgetall(COUNTERS_KEY)).items()}
+
+
+async def get_handler_metrics(redis) -> Dict[str, Any]:
+    """
+    Handler metrics of all live bot processes.
+
+    Series present in several processes are merged: counts add up, resource
+    averages are count-weighted and percentiles take the worst process.
+    """
+    instances = await redis.hgetall(METRICS_KEY)
+    now = datetime.utcnow()
+    merged: Dict[str, Dict[str, Any]] = {}
+    live = []
+
+    for instance, raw in instances.items():
+        try:
+            payload = json.loads(raw)
+            updated_at = datetime.fromisoformat(payload["updated_at"])
+        except (ValueError, KeyError, TypeError):
+            continue
+        if (now - updated_at).total_seconds() > METRICS_STALE_SECONDS:
+            await redis.hdel(METRICS_KEY, instance)
+            continue
+
+        live.append({"instance": instance, **{k: v for k, v in payload.items() if k != "handlers"}})
+        for key, summary in payload.get("handlers", {}).items():
+            current = merged.get(key)
+            if current is None:
+                merged[key] = dict(summary)
+                continue
+            total = current["count"] + summary["count"]
+            for name in ("db", "redis", "http", "tg"):
+                current[name] = round(
+                    (current[name] * current["count"] + summary[name] * summary["count"]) / max(total, 1), 2
+                )
+            for name in ("p50", "p95", "p99", "max"):
+                current[name] = max(current[name], summary[name])
+            current["count"] = total
+            current["errors"] += summary["errors"]
+
+    handlers = [{"key": key, **summary} for key, summary in merged.items()]
+    handlers.sort(key=lambda item: item["p95"], reverse=True)
+    return {"instances": live, "handlers": handlers}
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import time
+from app.repo.db import get_session
+from app.repo.ledger import LedgerRepository
+
+LOG = logging.getLogger(__name__)
+
+
+class LedgerRollupTask:
+    """
+    Background task that folds pending ledger credits into users.balance in
+    batches and periodically audits running balances against the ledger.
+    """
+
+    def __init__(
+        self,
+        check_interval_seconds: int = 60,
+        audit_interval_seconds: int = 3600,
+        batch_size: int = 1000
+    ):
+        self.check_interval = check_interval_seconds
+        self.audit_interval = audit_interval_seconds
+        self.batch_size = batch_size
+        self.task: asyncio.Task = None
+        self._running = False
+        self._last_audit = 0.0
+
+    async def rollup(self) -> int:
+        """Apply pending credits until none are left. Returns number of entries applied."""
+        total = 0
+        async with get_session() as session:
+            ledger = LedgerRepository(session)
+            while True:
+                applied = await ledger.rollup(batch_size=self.batch_size)
+                total += applied
+                if applied < self.batch_size:
+                    break
+        return total
+
+    async def audit(self) -> list:
+        async with get_session() as session:
+            mismatches = await LedgerRepository(session).audit()
+
+        for item in mismatches:
+            LOG.error(f"Ledger audit mismatch for user {item['tg_id']}: "
+                      f"balance={item['balance']}, ledger={item['ledger_balance']}")
+        if not mismatches:
+            LOG.info("Ledger audit passed")
+        return mismatches
+
+    async def run_once(self):
+        """Run a single rollup cycle (and an audit when due)"""
+        try:
+            applied = await self.rollup()
+            if applied > 0:
+                LOG.info(f"Ledger rollup applied {applied} entries")
+
+            if time.monotonic() - self._last_audit >= self.audit_interval:
+                self._last_audit = time.monotonic()
+                await self.audit()
+
+        except Exception as e:
+            LOG.error(f"Ledger rollup error: {type(e).__name__}: {e}")
+
+    async def run_loop(self):
+        """Continuously run rollup cycles"""
+        self._running = True
+        LOG.info(f"Ledger rollup task started (interval: {self.check_interval}s, audit: {self.audit_interval}s)")
+
+        while self._running:
+            try:
+                await self.run_once()
+            except Exception as e:
+                LOG.error(f"Error in ledger rollup loop: {type(e).__name__}: {e}")
+
+            await asyncio.sleep(self.check_interval)
+
+        LOG.info("Ledger rollup task stopped")
+
+    def start(self):
+        """Start the background rollup task"""
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run_loop())
+            LOG.info("Ledger rollup task created")
+        else:
+            LOG.warning("Ledger rollup task already running")
+
+    def stop(self):
+        """Stop the background rollup task"""
+        self._running = False
+        if self.task and not self.task.done():
+            self.task.cancel()
+            LOG.info("Ledger rollup task cancelled")
@@ -0,0 +1,109 @@
+import logging
+import time
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+from config import CONFIG_RETENTION_DAYS
+
+LOG = logging.getLogger(__name__)
+
+EVENTS_KEY = "lifecycle:events"
+PROCESSING_KEY = "lifecycle:processing"
+
+# Event kinds and their due time relative to subscription_end (seconds).
+# The 1-day warning comes a few minutes after renewal, so a renewed user's
+# warning is already stale (its subscription_end changed) when it comes due.
+EVENT_OFFSETS: Tuple[Tuple[str, int], ...] = (
+    ("notify_3d", -3 * 86400),
+    ("renew", -86400),
+    ("notify_1d", -86400 + 300),
+    ("expired", 0),
+    ("cleanup", CONFIG_RETENTION_DAYS * 86400),
+)
+
+# Events already this far overdue when scheduled are not worth sending
+MAX_LATENESS_SECONDS = 3600
+
+# Move due events to the processing set; they are acked once handled, or
+# returned to the queue if the dispatcher dies before acking
+_CLAIM_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, member in ipairs(due) do
+    redis.call('ZREM', KEYS[1], member)
+    redis.call('ZADD', KEYS[2], ARGV[3], member)
+end
+return due
+"""
+
+_REQUEUE_SCRIPT = """
+local stuck = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, member in ipairs(stuck) do
+    redis.call('ZREM', KEYS[2], member)
+    redis.call('ZADD', KEYS[1], ARGV[1], member)
+end
+return #stuck
+"""
+
+
+def event_member(kind: str, tg_id: int, subscription_end_ts: int) -> str:
+    return f"{kind}:{tg_id}:{subscription_end_ts}"
+
+
+def parse_member(member: str) -> Optional[Tuple[str, int, int]]:
+    """(kind, tg_id, subscription_end_ts) of an event member, or None if malformed"""
+    try:
+        kind, tg_id, end_ts = member.rsplit(":", 2)
+        return kind, int(tg_id), int(end_ts)
+    except ValueError:
+        return None
+
+
+async def schedule_subscription_events(redis, subscriptions: Iterable[Tuple[int, Optional[datetime]]]):
+    """
+    Index lifecycle events for new subscription end dates.
+
+    Each event carries the subscription_end it was computed for; events of an
+    older end date are not removed here but dropped by the dispatcher, which
+    compares them with the user's current subscription_end.
+
+    Args:
+        redis: Redis client
+        subscriptions: (tg_id, subscription_end) pairs
+    """
+    now = time.time()
+    events = {}
+    for tg_id, subscription_end in subscriptions:
+        if subscription_end is None:
+            continue
+        end_ts = int(subscription_end.timestamp())
+        for kind, offset in EVENT_OFFSETS:
+            due = end_ts + offset
+            if due >= now - MAX_LATENESS_SECONDS:
+                events[event_member(kind, tg_id, end_ts)] = due
+
+    if not events:
+        return
+
+    try:
+        # Chunked so a backfill of many users does not build one huge command
+        members = list(events.items())
+        for i in range(0, len(members), 1000):
+            await redis.zadd(EVENTS_KEY, dict(members[i:i + 1000]))
+    except Exception as e:
+        LOG.warning(f"Redis error scheduling lifecycle events: {e}")
+
+
+async def claim_due_events(redis, limit: int = 500, visibility_timeout: int = 600) -> List[str]:
+    now = time.time()
+    return await redis.eval(
+        _CLAIM_SCRIPT, 2, EVENTS_KEY, PROCESSING_KEY, now, limit, now + visibility_timeout
+    )
+
+
+async def ack_events(redis, members: List[str]):
+    if members:
+        await redis.zrem(PROCESSING_KEY, *members)
+
+
+async def requeue_stuck_events(redis, limit: int = 1000) -> int:
+    return await redis.eval(_REQUEUE_SCRIPT, 2, EVENTS_KEY, PROCESSING_KEY, time.time(), limit)
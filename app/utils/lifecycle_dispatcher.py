@@ -0,0 +1,168 @@
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from sqlalchemy import select
+
+from app.repo.db import get_session
+from app.repo.models import User
+from app.repo.user import reachable_users
+from app.utils.redis import get_redis
+from app.utils.lifecycle import (
+    ack_events,
+    claim_due_events,
+    parse_member,
+    requeue_stuck_events,
+    schedule_subscription_events,
+)
+from app.utils.notifications import SubscriptionNotificationTask
+from app.utils.auto_renewal import AutoRenewalTask
+from app.utils.config_cleanup import cleanup_user_configs
+from config import CONFIG_RETENTION_DAYS
+
+LOG = logging.getLogger(__name__)
+
+BACKFILL_KEY = "lifecycle:backfilled"
+
+NOTIFY_KINDS = ("notify_3d", "notify_1d", "expired")
+
+
+class LifecycleDispatcher:
+    """
+    Pops due subscription lifecycle events and routes them to their handlers.
+
+    Events are indexed by due time in a Redis sorted set (see app.utils.lifecycle)
+    whenever a subscription end date changes, so each run only touches the events
+    that are due. Events whose subscription_end no longer matches the user's are
+    stale and are dropped.
+    """
+
+    def __init__(
+        self,
+        notifications: SubscriptionNotificationTask,
+        auto_renewal: AutoRenewalTask,
+        batch_size: int = 500,
+        max_batches: int = 20
+    ):
+        """
+        Args:
+            notifications: Task whose pipeline sends expiry notifications
+            auto_renewal: Task whose bulk path renews subscriptions
+            batch_size: Events claimed per batch
+            max_batches: Batches handled per run (the rest waits for the next run)
+        """
+        self.notifications = notifications
+        self.auto_renewal = auto_renewal
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+
+    async def backfill(self, redis) -> int:
+        """Index events for existing subscriptions once (first start with the index)"""
+        if not await redis.set(BACKFILL_KEY, datetime.utcnow().isoformat(), nx=True):
+            return 0
+
+        threshold = datetime.utcnow() - timedelta(days=CONFIG_RETENTION_DAYS + 1)
+        count = 0
+        async with get_session() as session:
+            result = await session.stream(
+                select(User.tg_id, User.subscription_end)
+                .where(User.subscription_end.isnot(None), User.subscription_end >= threshold)
+                .execution_options(yield_per=1000)
+            )
+            async for rows in result.partitions():
+                await schedule_subscription_events(redis, [(r.tg_id, r.subscription_end) for r in rows])
+                count += len(rows)
+
+        LOG.info(f"Lifecycle index backfilled for {count} subscriptions")
+        return count
+
+    async def _load_current(self, tg_ids: List[int]) -> Dict[int, object]:
+        async with get_session() as session:
+            result = await session.execute(
+                select(
+                    User.tg_id, User.lang, User.balance, User.subscription_end, User.notifications,
+                    reachable_users().label("reachable"),
+                )
+                .where(User.tg_id.in_(tg_ids))
+            )
+            return {row.tg_id: row for row in result.all()}
+
+    async def _dispatch(self, members: List[str], stats: Dict[str, int]) -> List[str]:
+        """Route one batch of claimed events. Returns the members to ack."""
+        by_kind: Dict[str, List[int]] = defaultdict(list)
+        member_of: Dict[tuple, str] = {}
+        ack = []
+
+        parsed = []
+        for member in members:
+            event = parse_member(member)
+            if event is None:
+                LOG.warning(f"Dropping malformed lifecycle event {member!r}")
+                ack.append(member)
+                continue
+            parsed.append((member, event))
+
+        users = await self._load_current(list({tg_id for _, (_, tg_id, _) in parsed}))
+
+        for member, (kind, tg_id, end_ts) in parsed:
+            user = users.get(tg_id)
+            if user is None or user.subscription_end is None or int(user.subscription_end.timestamp()) != end_ts:
+                stats['stale'] += 1
+                ack.append(member)
+                continue
+            by_kind[kind].append(tg_id)
+            member_of[(kind, tg_id)] = member
+
+        for kind, tg_ids in by_kind.items():
+            try:
+                if kind == "renew":
+                    result = await self.auto_renewal.renew(tg_ids=tg_ids)
+                    stats['renewed'] += result['renewed']
+                elif kind in NOTIFY_KINDS:
+                    rows = [
+                        users[tg_id] for tg_id in tg_ids
+                        if users[tg_id].notifications and users[tg_id].reachable
+                    ]
+                    result = await self.notifications.notify_rows(rows)
+                    stats['notified'] += result.sent
+                elif kind == "cleanup":
+                    result = await cleanup_user_configs(tg_ids, days_threshold=CONFIG_RETENTION_DAYS)
+                    stats['configs_deleted'] += result['deleted']
+                else:
+                    LOG.warning(f"Unknown lifecycle event kind {kind!r}, dropping {len(tg_ids)} events")
+            except Exception as e:
+                # Not acked: requeued after the visibility timeout
+                LOG.error(f"Lifecycle handler {kind} failed for {len(tg_ids)} users: {type(e).__name__}: {e}")
+                stats['failed'] += len(tg_ids)
+                continue
+
+            stats[kind] += len(tg_ids)
+            ack.extend(member_of[(kind, tg_id)] for tg_id in tg_ids)
+
+        return ack
+
+    async def run_once(self) -> Dict[str, int]:
+        """Handle all events that are due now"""
+        stats: Dict[str, int] = defaultdict(int)
+        redis = await get_redis()
+
+        await self.backfill(redis)
+
+        requeued = await requeue_stuck_events(redis)
+        if requeued:
+            LOG.warning(f"Requeued {requeued} lifecycle events left unacked")
+
+        for _ in range(self.max_batches):
+            members = await claim_due_events(redis, limit=self.batch_size)
+            if not members:
+                break
+            stats['claimed'] += len(members)
+            ack = await self._dispatch(members, stats)
+            await ack_events(redis, ack)
+            if len(members) < self.batch_size:
+                break
+
+        if stats['claimed']:
+            LOG.info(f"Lifecycle dispatch: {dict(stats)}")
+        return dict(stats)
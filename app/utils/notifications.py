@@ -1,20 +1,59 @@
 import asyncio
 import logging
 import random
+import time
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
+from typing import Dict, List, Optional
 from sqlalchemy import select
 from aiogram import Bot
-from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
 
 from app.repo.db import get_session
 from app.repo.models import User
+from app.repo.user import reachable_users
 from app.utils.redis import get_redis
 from app.locales.locales import get_translator
+from app.utils.send_queue import send_queue, Priority
 from app.core.keyboards import balance_button_kb, get_renewal_notification_keyboard
+from config import NOTIFICATION_SENDERS
 
 LOG = logging.getLogger(__name__)
 
 
+@dataclass
+class Notification:
+    """A notification due for one user in the current run"""
+    tg_id: int
+    days: int | str
+    ttl: int
+    redis_key: str
+    lang: str = 'ru'
+    balance: float = 0.0
+
+
+@dataclass
+class NotificationStats:
+    """Per-run counters, published to Redis under SubscriptionNotificationTask.STATS_KEY"""
+    started_at: datetime = field(default_factory=datetime.utcnow)
+    scanned: int = 0
+    sent: int = 0
+    skipped: int = 0
+    blocked: int = 0
+    failed: int = 0
+    duration: float = 0.0
+
+    def as_dict(self) -> Dict[str, str]:
+        return {
+            'started_at': self.started_at.isoformat(),
+            'scanned': str(self.scanned),
+            'sent': str(self.sent),
+            'skipped': str(self.skipped),
+            'blocked': str(self.blocked),
+            'failed': str(self.failed),
+            'duration': f"{self.duration:.3f}",
+        }
+
+
 class SubscriptionNotificationTask:
     """
     Background task that checks for expiring subscriptions and sends notifications.
@@ -24,20 +63,32 @@ class SubscriptionNotificationTask:
     - 1-day warning when subscription expires in <= 1 day
     - Expired notification when subscription expired within last 24 hours
 
-    Uses Redis to track sent notifications and avoid spam.
+    Users are read in keyset pages (tg_id order): each page is claimed in
+    Redis with one pipelined SET NX, sent by a bounded pool of senders
+    through the shared send queue, and marked as sent with one pipelined
+    write.
     All notifications include a Balance button to encourage renewal.
     """
 
-    def __init__(self, bot: Bot, check_interval_seconds: int = 3600 * 3):
+    STATS_KEY = "stats:notifications"
+    CLAIM_TTL = 3600  # Claim lifetime while a batch is being sent
+
+    def __init__(
+        self,
+        bot: Bot,
+        batch_size: int = 500,
+        concurrency: int = NOTIFICATION_SENDERS
+    ):
         """
         Args:
             bot: Aiogram Bot instance for sending messages
-            check_interval_seconds: How often to check (default: 3 hours)
+            batch_size: Users fetched and claimed per batch
+            concurrency: Number of concurrent senders
         """
         self.bot = bot
-        self.check_interval = check_interval_seconds
-        self.task: asyncio.Task = None
-        self._running = False
+        self.batch_size = batch_size
+        self.concurrency = max(1, concurrency)
+        self.last_stats: Optional[NotificationStats] = None
 
     def _get_random_message(self, lang: str, days: int | str, user_balance: float = 0) -> str:
         """
@@ -92,7 +143,7 @@ class SubscriptionNotificationTask:
 
         return random.choice(variants)
 
-    async def _send_notification(self, tg_id: int, lang: str, days: int | str, user_balance: float = 0) -> bool:
+    async def _send_notification(self, tg_id: int, lang: str, days: int | str, user_balance: float = 0) -> str:
         """
         Send subscription expiry notification to user.
 
@@ -103,158 +154,218 @@ class SubscriptionNotificationTask:
             user_balance: User's current balance
 
         Returns:
-            True if sent successfully, False otherwise
+            'sent', 'blocked' (user blocked the bot) or 'failed'
         """
-        try:
-            message = self._get_random_message(lang, days, user_balance)
-            if not message:
-                return False
-
-            t = get_translator(lang)
-            # Use renewal keyboard with both "Renew" and "Balance" buttons
-            keyboard = get_renewal_notification_keyboard(t)
-
-            await self.bot.send_message(
-                chat_id=tg_id,
-                text=message,
-                reply_markup=keyboard
-            )
-
-            LOG.info(f"Sent {days}-day expiry notification to user {tg_id}")
-            return True
+        message = self._get_random_message(lang, days, user_balance)
+        if not message:
+            return 'failed'
 
-        except TelegramForbiddenError:
-            LOG.warning(f"User {tg_id} blocked the bot")
-            return False
-        except TelegramBadRequest as e:
-            LOG.warning(f"Bad request sending notification to {tg_id}: {e}")
-            return False
-        except Exception as e:
-            LOG.error(f"Error sending notification to {tg_id}: {type(e).__name__}: {e}")
-            return False
-
-    async def _check_and_notify_user(self, user: User, redis):
+        t = get_translator(lang)
+        # Use renewal keyboard with both "Renew" and "Balance" buttons
+        keyboard = get_renewal_notification_keyboard(t)
+
+        status = await send_queue.send_message(
+            tg_id, message, priority=Priority.NOTIFICATION, reply_markup=keyboard
+        )
+        if status == 'sent':
+            LOG.debug(f"Sent {days}-day expiry notification to user {tg_id}")
+        return status
+
+    @staticmethod
+    def _classify(tg_id: int, subscription_end: datetime, now: datetime) -> Optional[Notification]:
         """
-        Check if user needs notification and send if needed.
+        Decide which notification (if any) a user is due.
 
         Args:
-            user: User model instance
-            redis: Redis client
-        """
-        # Skip if notifications disabled
-        if not user.notifications:
-            return
-
-        # Skip if no subscription
-        if not user.subscription_end:
-            return
-
-        now = datetime.utcnow()
-        time_left = user.subscription_end - now
-        days_left = time_left.total_seconds() / 86400
+            tg_id: Telegram user ID
+            subscription_end: Subscription end time
+            now: Reference time for this run
 
-        # Format subscription end date for Redis key
-        sub_end_date = user.subscription_end.strftime('%Y%m%d')
+        Returns:
+            Notification descriptor, or None if nothing is due
+        """
+        days_left = (subscription_end - now).total_seconds() / 86400
 
-        # Determine notification type based on days left
         if -1 <= days_left <= 0:
             # Subscription expired within last 24 hours
-            notification_type = 'expired'
-            days = 'expired'
-            ttl = 86400 * 7  # 7 days TTL
+            notification_type, days, ttl = 'expired', 'expired', 86400 * 7
         elif 0 < days_left <= 1:
             # 1 day warning
-            notification_type = '1d'
-            days = 1
-            ttl = 86400 * 2  # 2 days TTL
+            notification_type, days, ttl = '1d', 1, 86400 * 2
         elif 1 < days_left <= 3:
             # 3 day warning
-            notification_type = '3d'
-            days = 3
-            ttl = 86400 * 4  # 4 days TTL
+            notification_type, days, ttl = '3d', 3, 86400 * 4
         else:
             # Too far in future or expired too long ago
-            return
+            return None
+
+        sub_end_date = subscription_end.strftime('%Y%m%d')
+        return Notification(
+            tg_id=tg_id,
+            days=days,
+            ttl=ttl,
+            redis_key=f"notif:{notification_type}:{tg_id}:{sub_end_date}",
+        )
 
-        # Check if already sent
-        redis_key = f"notif:{notification_type}:{user.tg_id}:{sub_end_date}"
+    async def _claim(self, redis, batch: List[Notification]) -> List[Notification]:
+        """
+        Claim a batch of notifications with pipelined SET NX.
 
+        Only the caller that creates the marker sends the message, so overlapping
+        runs (or several bot instances) never notify a user twice. The claim uses
+        a short TTL and is extended to the full TTL once the message is sent.
+        """
+        async with redis.pipeline(transaction=False) as pipe:
+            for item in batch:
+                pipe.set(item.redis_key, "pending", ex=self.CLAIM_TTL, nx=True)
+            claimed = await pipe.execute()
+        return [item for item, ok in zip(batch, claimed) if ok]
+
+    async def _commit_markers(self, redis, done: List[Notification], released: List[Notification]):
+        """Write 'sent' markers and release failed claims in one round-trip"""
+        if not done and not released:
+            return
         try:
-            already_sent = await redis.get(redis_key)
-            if already_sent:
-                return  # Already sent this notification
+            async with redis.pipeline(transaction=False) as pipe:
+                for item in done:
+                    pipe.set(item.redis_key, "1", ex=item.ttl)
+                if released:
+                    pipe.delete(*[item.redis_key for item in released])
+                await pipe.execute()
         except Exception as e:
-            LOG.warning(f"Redis error checking notification for {user.tg_id}: {e}")
-            return
-
-        # Send notification with user balance (for pricing info in 1-day warning)
-        success = await self._send_notification(user.tg_id, user.lang, days, float(user.balance))
+            LOG.warning(f"Redis error writing notification markers: {e}")
 
-        # Mark as sent if successful
-        if success:
+    async def _sender(self, queue: asyncio.Queue, results: Dict[str, List[Notification]]):
+        while True:
+            item = await queue.get()
             try:
-                await redis.setex(redis_key, ttl, "1")
-            except Exception as e:
-                LOG.warning(f"Redis error marking notification sent for {user.tg_id}: {e}")
+                status = await self._send_notification(item.tg_id, item.lang, item.days, item.balance)
+                results[status].append(item)
+            finally:
+                queue.task_done()
 
-    async def run_once(self):
-        """Run a single notification check cycle"""
+    async def _process_batch(self, redis, batch: List[Notification], stats: NotificationStats):
         try:
-            redis = await get_redis()
-
-            async with get_session() as session:
-                # Get all users with subscriptions expiring soon or recently expired
-                now = datetime.utcnow()
-                future_threshold = now + timedelta(days=3)  # Check up to 3 days in future
-                past_threshold = now - timedelta(days=1)  # Check up to 1 day in past
-
-                result = await session.execute(
-                    select(User).where(
-                        User.subscription_end.isnot(None),
-                        User.subscription_end >= past_threshold,  # Include recently expired
-                        User.subscription_end <= future_threshold  # Include soon to expire
-                    )
-                )
-                users = result.scalars().all()
-
-                LOG.info(f"Checking {len(users)} users for expiring/expired subscriptions")
+            claimed = await self._claim(redis, batch)
+        except Exception as e:
+            LOG.warning(f"Redis error claiming notifications: {e}")
+            stats.skipped += len(batch)
+            return
 
-                # Check each user
-                for user in users:
-                    await self._check_and_notify_user(user, redis)
+        stats.skipped += len(batch) - len(claimed)
+        if not claimed:
+            return
 
-                LOG.info("Subscription notification check completed")
+        results: Dict[str, List[Notification]] = {'sent': [], 'blocked': [], 'failed': []}
+        queue: asyncio.Queue = asyncio.Queue()
+        for item in claimed:
+            queue.put_nowait(item)
 
-        except Exception as e:
-            LOG.error(f"Subscription notification check error: {type(e).__name__}: {e}")
+        workers = [
+            asyncio.create_task(self._sender(queue, results))
+            for _ in range(min(self.concurrency, len(claimed)))
+        ]
+        try:
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        stats.sent += len(results['sent'])
+        stats.blocked += len(results['blocked'])
+        stats.failed += len(results['failed'])
+
+        # Blocked users keep their marker so they are not retried every run
+        await self._commit_markers(
+            redis,
+            done=results['sent'] + results['blocked'],
+            released=results['failed'],
+        )
+
+    async def _process_rows(self, redis, rows, now: datetime, stats: NotificationStats):
+        """Classify rows (tg_id, lang, balance, subscription_end) and send what is due"""
+        batch = []
+        for row in rows:
+            stats.scanned += 1
+            item = self._classify(row.tg_id, row.subscription_end, now)
+            if item is None:
+                continue
+            item.lang = row.lang
+            item.balance = float(row.balance or 0)
+            batch.append(item)
+
+        if batch:
+            await self._process_batch(redis, batch, stats)
+
+    async def notify_rows(self, rows) -> NotificationStats:
+        """
+        Send due notifications for already-loaded users (used by the lifecycle dispatcher).
 
-    async def run_loop(self):
-        """Continuously run notification checks"""
-        self._running = True
-        LOG.info(f"Subscription notification task started (interval: {self.check_interval}s)")
+        Args:
+            rows: Objects with tg_id, lang, balance and subscription_end
 
-        while self._running:
-            try:
-                await self.run_once()
-            except Exception as e:
-                LOG.error(f"Error in subscription notification loop: {type(e).__name__}: {e}")
+        Returns:
+            Stats for this call
+        """
+        stats = NotificationStats(started_at=datetime.utcnow())
+        started = time.monotonic()
+        redis = await get_redis()
+        for i in range(0, len(rows), self.batch_size):
+            await self._process_rows(redis, rows[i:i + self.batch_size], datetime.utcnow(), stats)
+        stats.duration = time.monotonic() - started
+        return stats
+
+    async def _publish_stats(self, redis, stats: NotificationStats):
+        try:
+            await redis.hset(self.STATS_KEY, mapping=stats.as_dict())
+        except Exception as e:
+            LOG.warning(f"Redis error publishing notification stats: {e}")
 
-            # Wait for next check
-            await asyncio.sleep(self.check_interval)
+    async def run_once(self) -> NotificationStats:
+        """Run a single notification check cycle (errors propagate to the scheduler after stats are published)"""
+        stats = NotificationStats(started_at=datetime.utcnow())
+        started = time.monotonic()
+        redis = await get_redis()
 
-        LOG.info("Subscription notification task stopped")
+        try:
+            # Get all users with subscriptions expiring soon or recently expired
+            now = datetime.utcnow()
+            future_threshold = now + timedelta(days=3)  # Check up to 3 days in future
+            past_threshold = now - timedelta(days=1)  # Check up to 1 day in past
+
+            query = (
+                select(User.tg_id, User.lang, User.balance, User.subscription_end)
+                .where(
+                    User.notifications.is_(True),
+                    reachable_users(),  # Skip users who blocked the bot or keep failing
+                    User.subscription_end.isnot(None),
+                    User.subscription_end >= past_threshold,  # Include recently expired
+                    User.subscription_end <= future_threshold  # Include soon to expire
+                )
+                .order_by(User.tg_id)
+                .limit(self.batch_size)
+            )
 
-    def start(self):
-        """Start the background notification task"""
-        if self.task is None or self.task.done():
-            self.task = asyncio.create_task(self.run_loop())
-            LOG.info("Subscription notification task created")
-        else:
-            LOG.warning("Subscription notification task already running")
-
-    def stop(self):
-        """Stop the background notification task"""
-        self._running = False
-        if self.task and not self.task.done():
-            self.task.cancel()
-            LOG.info("Subscription notification task cancelled")
+            # Keyset pages, each read in its own short session: no connection
+            # or snapshot is held while a page is being sent
+            last_tg_id = None
+            while True:
+                page = query if last_tg_id is None else query.where(User.tg_id > last_tg_id)
+                async with get_session() as session:
+                    rows = (await session.execute(page)).all()
+                if not rows:
+                    break
+                await self._process_rows(redis, rows, now, stats)
+                last_tg_id = rows[-1].tg_id
+        finally:
+            # Published for partial runs too
+            stats.duration = time.monotonic() - started
+            self.last_stats = stats
+            LOG.info(
+                f"Subscription notification check completed: scanned={stats.scanned}, sent={stats.sent}, "
+                f"skipped={stats.skipped}, blocked={stats.blocked}, failed={stats.failed}, "
+                f"duration={stats.duration:.1f}s"
+            )
+            await self._publish_stats(redis, stats)
+        return stats
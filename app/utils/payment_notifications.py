@@ -4,9 +4,9 @@ Payment notification utilities for sending payment confirmation messages to user
 import logging
 from decimal import Decimal
 from aiogram import Bot
-from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
 
 from app.locales.locales import get_translator
+from app.utils.send_queue import send_queue, Priority
 from app.core.keyboards import payment_success_actions
 
 LOG = logging.getLogger(__name__)
@@ -23,7 +23,7 @@ async def send_payment_notification(
     Send payment confirmation notification to user.
 
     Args:
-        bot: Aiogram Bot instance
+        bot: Aiogram Bot instance (kept for callers; sending goes through the send queue)
         tg_id: User Telegram ID
         amount: Total amount credited
         lang: User language (ru/en)
@@ -32,27 +32,21 @@ async def send_payment_notification(
     Returns:
         True if sent successfully, False otherwise
     """
-    try:
-        t = get_translator(lang)
+    t = get_translator(lang)
 
-        # Build success message
-        success_text = t('payment_success', amount=float(amount))
+    # Build success message
+    success_text = t('payment_success', amount=float(amount))
 
-        await bot.send_message(
-            chat_id=tg_id,
-            text=success_text,
-            reply_markup=payment_success_actions(t, has_active_subscription)
-        )
+    status = await send_queue.send_message(
+        tg_id,
+        success_text,
+        priority=Priority.CRITICAL,
+        reply_markup=payment_success_actions(t, has_active_subscription)
+    )
 
+    if status == 'sent':
         LOG.info(f"Payment notification sent to user {tg_id}: {amount} RUB")
         return True
 
-    except TelegramForbiddenError:
-        LOG.warning(f"User {tg_id} blocked the bot, cannot send payment notification")
-        return False
-    except TelegramBadRequest as e:
-        LOG.warning(f"Bad request sending payment notification to {tg_id}: {e}")
-        return False
-    except Exception as e:
-        LOG.error(f"Error sending payment notification to {tg_id}: {type(e).__name__}: {e}")
-        return False
+    LOG.warning(f"Payment notification to user {tg_id} not delivered: {status}")
+    return False
@@ -0,0 +1,60 @@
+import logging
+from typing import Dict
+
+from app.payments.models import PaymentMethod
+from app.payments.registry import gateway_registry
+from app.repo.db import get_session
+from app.repo.payments import PaymentRepository
+from app.utils.redis import get_redis
+from app.utils.updater import TonTransactionsUpdater
+
+LOG = logging.getLogger(__name__)
+
+
+class PaymentPollingTask:
+    """
+    Checks pending TON, CryptoBot and YooKassa payments with their gateways.
+
+    Scheduled as one job (see run.py), so a single poller serves every
+    webhook worker however many payments are open.
+    """
+
+    def __init__(self):
+        # Kept across runs so already seen TON transactions are skipped
+        self.ton_updater = TonTransactionsUpdater()
+
+    async def _check(self, method: PaymentMethod, payments) -> int:
+        """Check each payment in its own session; a failing one does not stop the rest"""
+        confirmed = 0
+        for payment in payments:
+            try:
+                async with get_session() as session:
+                    if await gateway_registry[method].check_payment(session, payment['id']):
+                        confirmed += 1
+            except Exception as e:
+                LOG.error(f"Check of {method.value} payment {payment['id']} failed: {type(e).__name__}: {e}")
+        return confirmed
+
+    async def run_once(self) -> Dict[str, int]:
+        """Run a single polling pass (errors outside single checks propagate to the scheduler)"""
+        async with get_session() as session:
+            payment_repo = PaymentRepository(session, await get_redis())
+            ton_pendings = await payment_repo.get_pending_payments(PaymentMethod.TON.value)
+            cryptobot_pendings = await payment_repo.get_pending_payments(PaymentMethod.CRYPTOBOT.value)
+            # Recently expired ones too: the user may pay after the local timeout
+            # but before YooKassa's (local=10min, YooKassa=60min)
+            yookassa_pendings = await payment_repo.get_pending_or_recent_expired_payments(
+                PaymentMethod.YOOKASSA.value,
+                expired_hours=1
+            )
+
+        if ton_pendings:
+            await self.ton_updater.run_once()
+
+        return {
+            'ton': len(ton_pendings),
+            'cryptobot': len(cryptobot_pendings),
+            'cryptobot_confirmed': await self._check(PaymentMethod.CRYPTOBOT, cryptobot_pendings),
+            'yookassa': len(yookassa_pendings),
+            'yookassa_confirmed': await self._check(PaymentMethod.YOOKASSA, yookassa_pendings),
+        }
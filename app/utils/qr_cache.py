@@ -0,0 +1,169 @@
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Dict, Iterable, List, Optional
+
+import qrcode
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile, Message
+
+from app.utils.redis import get_redis
+from config import QR_CACHE_BYTES
+
+LOG = logging.getLogger(__name__)
+
+FILE_ID_TTL = 86400 * 30
+
+
+def link_hash(link: str) -> str:
+    return hashlib.sha256(link.encode()).hexdigest()[:32]
+
+
+def file_id_key(link: str) -> str:
+    """Redis key holding the Telegram file_id of the link's QR code"""
+    return f"qr:{link_hash(link)}"
+
+
+def render_qr(link: str) -> bytes:
+    """Render the link as a PNG (CPU-bound, run it off the event loop)"""
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(link)
+    qr.make(fit=True)
+
+    img = qr.make_image(fill_color="black", back_color="white")
+    bio = BytesIO()
+    img.save(bio, format='PNG')
+    return bio.getvalue()
+
+
+class QRCache:
+    """
+    QR codes of config links, rendered once and uploaded once.
+
+    The first tap renders the PNG in a small thread pool and uploads it; the
+    file_id Telegram returns is kept in Redis (shared by all processes), so
+    later taps send by file_id without rendering or uploading. PNGs are also
+    kept in a per-process LRU bounded by `max_bytes`, for re-uploads when a
+    file_id stops working. Entries are keyed by a hash of the link, so a new
+    link never hits an old code.
+    """
+
+    def __init__(self, max_bytes: int = QR_CACHE_BYTES, workers: int = 2):
+        """
+        Args:
+            max_bytes: Total size of cached PNGs in this process
+            workers: Render threads
+        """
+        self.max_bytes = max_bytes
+        self._png: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self._rendering: Dict[str, asyncio.Future] = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="qr")
+
+    def _remember(self, key: str, png: bytes):
+        if len(png) > self.max_bytes:
+            return
+        old = self._png.pop(key, None)
+        if old is not None:
+            self._size -= len(old)
+        self._png[key] = png
+        self._size += len(png)
+        while self._size > self.max_bytes:
+            _, evicted = self._png.popitem(last=False)
+            self._size -= len(evicted)
+
+    async def get_png(self, link: str) -> bytes:
+        key = link_hash(link)
+        png = self._png.get(key)
+        if png is not None:
+            self._png.move_to_end(key)
+            return png
+
+        # Concurrent taps on the same link share one render
+        pending = self._rendering.get(key)
+        if pending is not None:
+            return await pending
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, render_qr, link)
+        self._rendering[key] = future
+        try:
+            png = await future
+        finally:
+            self._rendering.pop(key, None)
+        self._remember(key, png)
+        return png
+
+    async def _get_file_id(self, link: str) -> Optional[str]:
+        try:
+            redis = await get_redis()
+            return await redis.get(file_id_key(link))
+        except Exception as e:
+            LOG.warning(f"Could not read QR file_id: {e}")
+            return None
+
+    async def _set_file_id(self, link: str, file_id: Optional[str]):
+        try:
+            redis = await get_redis()
+            if file_id:
+                await redis.setex(file_id_key(link), FILE_ID_TTL, file_id)
+            else:
+                await redis.delete(file_id_key(link))
+        except Exception as e:
+            LOG.warning(f"Could not store QR file_id: {e}")
+
+    async def send(self, message: Message, link: str, **kwargs) -> Message:
+        """
+        Answer `message` with the QR code of `link`.
+
+        Args:
+            message: Message to answer in the same chat
+            link: Text to encode
+            **kwargs: Passed to answer_photo (caption, reply_markup, ...)
+        """
+        file_id = await self._get_file_id(link)
+        if file_id:
+            try:
+                return await message.answer_photo(photo=file_id, **kwargs)
+            except TelegramBadRequest as e:
+                LOG.warning(f"Cached QR file_id rejected, uploading again: {e}")
+                await self._set_file_id(link, None)
+
+        png = await self.get_png(link)
+        sent = await message.answer_photo(
+            photo=BufferedInputFile(png, filename="qr_code.png"), **kwargs
+        )
+        if sent.photo:
+            await self._set_file_id(link, sent.photo[-1].file_id)
+        return sent
+
+    async def invalidate(self, links: Iterable[str]):
+        """Forget the QR codes of links that are no longer valid (deleted configs)"""
+        keys: List[str] = []
+        for link in links:
+            if not link:
+                continue
+            png = self._png.pop(link_hash(link), None)
+            if png is not None:
+                self._size -= len(png)
+            keys.append(file_id_key(link))
+        if keys:
+            try:
+                redis = await get_redis()
+                await redis.delete(*keys)
+            except Exception as e:
+                LOG.warning(f"Could not invalidate QR codes: {e}")
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+qr_cache = QRCache()
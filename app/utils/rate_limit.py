@@ -1,18 +1,176 @@
 import asyncio
+import logging
 import time
-from typing import Any, Callable, Dict, Tuple
-from collections import OrderedDict
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from aiogram import BaseMiddleware
 
+from config import TELEGRAM_SEND_RATE, BOT_MODE
+
+LOG = logging.getLogger(__name__)
+
+# GCRA over several keys at once: the event passes only if every key allows it,
+# and then all keys are advanced. Times are integer milliseconds.
+# ARGV: now, then (emission interval, tolerance) per key.
+# Returns {allowed, retry_after_ms, index of the denying key}.
+_GCRA_SCRIPT = """
+local now = tonumber(ARGV[1])
+local new_tats = {}
+for i = 1, #KEYS do
+    local interval = tonumber(ARGV[i * 2])
+    local tolerance = tonumber(ARGV[i * 2 + 1])
+    local tat = tonumber(redis.call('GET', KEYS[i]) or now)
+    if tat < now then
+        tat = now
+    end
+    local new_tat = tat + interval
+    local allow_at = new_tat - interval - tolerance
+    if now < allow_at then
+        return {0, allow_at - now, i}
+    end
+    new_tats[i] = new_tat
+end
+for i = 1, #KEYS do
+    redis.call('SET', KEYS[i], new_tats[i], 'PX', math.max(1, math.ceil(new_tats[i] - now)))
+end
+return {1, 0, 0}
+"""
+
+
+@dataclass(frozen=True)
+class RateLimitPolicy:
+    """
+    GCRA policy: one event per `interval` seconds on average, with bursts of up to `burst`.
+
+    RateLimitPolicy(3.0) means "at most once per 3 seconds";
+    RateLimitPolicy(10 / 30, burst=30) means "30 events per 10 seconds".
+    """
+    interval: float
+    burst: int = 1
+
+    @property
+    def interval_ms(self) -> int:
+        return max(1, int(self.interval * 1000))
+
+    @property
+    def tolerance_ms(self) -> int:
+        return self.interval_ms * (self.burst - 1)
+
+
+class LocalGCRALimiter:
+    """
+    In-process GCRA state, used when Redis is unavailable (or not wanted).
+
+    check() never awaits, so it is atomic on the event loop without a lock.
+    State is split into shards so eviction works on small dicts and never
+    blocks the loop for long.
+    """
+
+    def __init__(self, shards: int = 16):
+        self._shards: List[Dict[str, int]] = [{} for _ in range(shards)]
+
+    def _shard(self, key: str) -> Dict[str, int]:
+        return self._shards[hash(key) % len(self._shards)]
+
+    def check(self, checks: List[Tuple[str, RateLimitPolicy]]) -> Tuple[bool, float, int]:
+        now = int(time.monotonic() * 1000)
+        new_tats = []
+        for index, (key, policy) in enumerate(checks):
+            tat = max(self._shard(key).get(key, now), now)
+            new_tat = tat + policy.interval_ms
+            allow_at = new_tat - policy.interval_ms - policy.tolerance_ms
+            if now < allow_at:
+                return False, (allow_at - now) / 1000, index
+            new_tats.append(new_tat)
+
+        for (key, _), new_tat in zip(checks, new_tats):
+            self._shard(key)[key] = new_tat
+        return True, 0.0, -1
+
+    def evict_expired(self) -> int:
+        """Drop keys whose state has fully decayed. Returns number of keys removed."""
+        now = int(time.monotonic() * 1000)
+        removed = 0
+        for shard in self._shards:
+            expired = [key for key, tat in list(shard.items()) if tat <= now]
+            for key in expired:
+                shard.pop(key, None)
+            removed += len(expired)
+        return removed
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self._shards)
+
+
+class RedisGCRALimiter:
+    """GCRA state in Redis, shared by every bot instance; one script call per event"""
+
+    def __init__(self, redis_client=None, prefix: str = "rl"):
+        self._redis = redis_client
+        self._script = None
+        self.prefix = prefix
+
+    async def _get_script(self):
+        if self._script is None:
+            if self._redis is None:
+                from app.utils.redis import get_redis
+                self._redis = await get_redis()
+            self._script = self._redis.register_script(_GCRA_SCRIPT)
+        return self._script
+
+    async def check(self, checks: List[Tuple[str, RateLimitPolicy]]) -> Tuple[bool, float, int]:
+        script = await self._get_script()
+        args = [int(time.time() * 1000)]
+        for _, policy in checks:
+            args.extend((policy.interval_ms, policy.tolerance_ms))
+
+        allowed, retry_after, index = await script(
+            keys=[f"{self.prefix}:{key}" for key, _ in checks], args=args
+        )
+        return bool(int(allowed)), int(retry_after) / 1000, int(index) - 1
+
 
 class RateLimitMiddleware(BaseMiddleware):
-    def __init__(self, default_limit: float = 1.5, custom_limits: Dict[str, float] | None = None, max_cache_size: int = 10000):
+    """
+    Throttles updates per user and per action.
+
+    Every event is checked against the policy of its key (command or callback
+    data) and against the user's global budget, atomically, in Redis, so
+    limits hold across bot instances. If Redis fails, an in-process limiter
+    takes over. No lock is held while answering throttled users.
+    """
+
+    def __init__(
+        self,
+        default_limit: float = 1.5,
+        custom_limits: Dict[str, float] | None = None,
+        user_budget: Tuple[int, float] | None = (30, 10.0),
+        use_redis: bool = True,
+        redis_client=None
+    ):
+        """
+        Args:
+            default_limit: Minimum seconds between identical actions of a user
+            custom_limits: Per-action minimum intervals (command or callback data -> seconds)
+            user_budget: (events, seconds) allowed per user across all actions, or None
+            use_redis: Keep state in Redis (shared) instead of in-process
+            redis_client: Redis client (defaults to the app client)
+        """
         super().__init__()
-        self.default_limit = default_limit
-        self.custom_limits = custom_limits or {}
-        self.last_time: OrderedDict[Tuple[int, str], float] = OrderedDict()
-        self.max_cache_size = max_cache_size  # Prevent unbounded memory growth
-        self._lock = asyncio.Lock()
+        self.default_policy = RateLimitPolicy(default_limit)
+        self.policies: Dict[str, RateLimitPolicy] = {
+            key: RateLimitPolicy(limit) for key, limit in (custom_limits or {}).items()
+        }
+        self.user_policy = (
+            RateLimitPolicy(user_budget[1] / user_budget[0], burst=user_budget[0])
+            if user_budget else None
+        )
+        self.redis_limiter = RedisGCRALimiter(redis_client) if use_redis else None
+        self.local_limiter = LocalGCRALimiter()
+        self.passed: Counter = Counter()
+        self.throttled: Counter = Counter()
+        self._redis_failed_at = 0.0
 
     def _get_key(self, event: Any) -> str:
         # Handle message commands
@@ -27,6 +185,16 @@ class RateLimitMiddleware(BaseMiddleware):
 
         return event.__class__.__name__
 
+    async def _check(self, checks: List[Tuple[str, RateLimitPolicy]]) -> Tuple[bool, float, int]:
+        # After a Redis failure, stay local for a while instead of failing every event
+        if self.redis_limiter and time.monotonic() - self._redis_failed_at > 30:
+            try:
+                return await self.redis_limiter.check(checks)
+            except Exception as e:
+                self._redis_failed_at = time.monotonic()
+                LOG.warning(f"Redis rate limiter unavailable, using in-process limits: {e}")
+        return self.local_limiter.check(checks)
+
     async def __call__(self, handler: Callable, event: Any, data: dict):
         user = getattr(event, "from_user", None)
         user_id = getattr(user, "id", None)
@@ -34,43 +202,42 @@ class RateLimitMiddleware(BaseMiddleware):
             return await handler(event, data)
 
         key = self._get_key(event)
-        limit = self.custom_limits.get(key, self.default_limit)
-        now = time.monotonic()
-        lk = (user_id, key)
+        policy = self.policies.get(key, self.default_policy)
+        metric = key if key in self.policies else "default"
 
-        async with self._lock:
-            last = self.last_time.get(lk)
-            if last is not None and (now - last) < limit:
-                msg = None
-                try:
-                    t = data.get("t")
-                    msg = t("too_fast") if t else "⏳ Too fast"
-                except Exception:
-                    msg = "⏳ Too fast"
-
-                if hasattr(event, "answer") and "callback" in event.__class__.__name__.lower():
-                    try:
-                        await event.answer(msg, show_alert=False)
-                    except Exception:
-                        pass
-                else:
-                    try:
-                        m = await event.answer(msg)
-                        asyncio.create_task(self._safe_delete(m, delay=2))
-                    except Exception:
-                        pass
-                return
+        checks = [(f"{{{user_id}}}:{key}", policy)]
+        if self.user_policy:
+            checks.append((f"{{{user_id}}}:*", self.user_policy))
 
-            self.last_time[lk] = now
+        allowed, _, denied_by = await self._check(checks)
+        if allowed:
+            self.passed[metric] += 1
+            return await handler(event, data)
 
-            # Enforce max cache size to prevent memory leak
-            if len(self.last_time) > self.max_cache_size:
-                # Remove oldest 10% of entries when limit exceeded
-                remove_count = self.max_cache_size // 10
-                for _ in range(remove_count):
-                    self.last_time.popitem(last=False)
+        self.throttled["user_budget" if denied_by == 1 else metric] += 1
 
-        return await handler(event, data)
+        msg = None
+        try:
+            t = data.get("t")
+            msg = t("too_fast") if t else "⏳ Too fast"
+        except Exception:
+            msg = "⏳ Too fast"
+
+        if hasattr(event, "answer") and "callback" in event.__class__.__name__.lower():
+            try:
+                await event.answer(msg, show_alert=False)
+            except Exception:
+                pass
+        else:
+            try:
+                m = await event.answer(msg)
+                asyncio.create_task(self._safe_delete(m, delay=2))
+            except Exception:
+                pass
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        """Passed and throttled event counts per policy since start"""
+        return {"passed": dict(self.passed), "throttled": dict(self.throttled)}
 
     @staticmethod
     async def _safe_delete(message, delay: float = 2.0):
@@ -81,22 +248,117 @@ class RateLimitMiddleware(BaseMiddleware):
             pass
 
 
-async def cleanup_rate_limit(middleware: RateLimitMiddleware, interval: int = 600, max_age: int = 1800):
+class TokenBucket:
+    """
+    Async token bucket shared by everything that sends messages in bulk.
+
+    acquire() waits until a token is available, so concurrent senders together
+    never exceed `rate` calls per second (with bursts of up to `capacity`).
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1.0):
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Drain the bucket for `seconds` (e.g. after a RetryAfter from Telegram)"""
+        self._refill()
+        self._tokens = min(self._tokens, 0.0) - seconds * self.rate
+
+
+class RedisTokenBucket:
     """
-    Periodically clean up old rate limit entries to prevent memory growth.
+    TokenBucket with its state in Redis, for several bot processes sharing one bot token.
+
+    Same interface as TokenBucket; the rate is enforced with the GCRA script
+    above, so `rate` calls per second hold across all processes. Falls back to
+    an in-process bucket while Redis is unreachable.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None, key: str = "telegram:send"):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.key = key
+        self.policy = RateLimitPolicy(1 / rate, burst=max(1, int(self.capacity)))
+        self.limiter = RedisGCRALimiter(prefix="bucket")
+        self._fallback = TokenBucket(rate, capacity)
+        self._pending: set = set()
+
+    async def acquire(self):
+        while True:
+            try:
+                allowed, retry_after, _ = await self.limiter.check([(self.key, self.policy)])
+            except Exception as e:
+                LOG.warning(f"Redis send bucket unavailable, using in-process bucket: {e}")
+                return await self._fallback.acquire()
+            if allowed:
+                return
+            await asyncio.sleep(retry_after)
+
+    def pause(self, seconds: float):
+        """Push the shared bucket `seconds` into the future (e.g. after a RetryAfter from Telegram)"""
+        self._fallback.pause(seconds)
+        task = asyncio.create_task(self._pause(seconds))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _pause(self, seconds: float):
+        try:
+            from app.utils.redis import get_redis
+            redis = await get_redis()
+            # A theoretical arrival time this far ahead leaves no tokens until `seconds` have passed
+            ttl_ms = int(seconds * 1000) + self.policy.tolerance_ms
+            await redis.set(
+                f"{self.limiter.prefix}:{self.key}",
+                int(time.time() * 1000) + ttl_ms,
+                px=max(1, ttl_ms),
+            )
+        except Exception as e:
+            LOG.warning(f"Could not pause Redis send bucket: {e}")
+
+
+# One bucket per bot token: in webhook mode it is shared by all worker processes
+telegram_send_bucket = (
+    RedisTokenBucket(rate=TELEGRAM_SEND_RATE) if BOT_MODE == "webhook"
+    else TokenBucket(rate=TELEGRAM_SEND_RATE)
+)
+
+
+async def cleanup_rate_limit(middleware: RateLimitMiddleware, interval: int = 600):
+    """
+    Periodically drop decayed entries of the in-process fallback limiter and log limiter stats.
+
+    Redis state expires on its own; only the fallback needs cleaning.
 
     Args:
         middleware: The RateLimitMiddleware instance to clean
         interval: How often to run cleanup (default: 600s = 10 minutes)
-        max_age: Remove entries older than this (default: 1800s = 30 minutes)
     """
     try:
         while True:
             await asyncio.sleep(interval)
-            cutoff = time.monotonic() - max_age
-            async with middleware._lock:
-                old_keys = [k for k, t in middleware.last_time.items() if t < cutoff]
-                for k in old_keys:
-                    middleware.last_time.pop(k, None)
+            removed = middleware.local_limiter.evict_expired()
+            if removed:
+                LOG.debug(f"Evicted {removed} in-process rate limit entries")
+            stats = middleware.get_stats()
+            if stats["throttled"]:
+                LOG.info(f"Rate limiter: passed={sum(stats['passed'].values())}, throttled={stats['throttled']}")
     except asyncio.CancelledError:
-        pass
\ No newline at end of file
+        pass
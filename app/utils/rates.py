@@ -1,53 +1,248 @@
-from decimal import Decimal
-from datetime import datetime, timedelta
+"""
+Exchange rate oracle.
+
+Rates are refreshed in the background from several public sources and the median
+of the successful answers is used. Readers never hit the network on the hot path
+while a value is fresh; a stale value is still served (and a refresh kicked off)
+as long as it is younger than RATES_MAX_STALENESS_SECONDS. Only one refresh per
+pair runs at a time, and the last good value is persisted in Redis so restarts
+and other processes start warm.
+"""
+import asyncio
+import json
+import logging
+import time
+from decimal import Decimal, InvalidOperation
+from statistics import median
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
 import aiohttp
 
-_ton_price_cache = {"price": None, "timestamp": None}
-_usdt_price_cache = {"price": None, "timestamp": None}
-_PRICE_CACHE_TTL_SECONDS = 60
+from app.utils.instrumentation import http_trace_config
+from app.utils.redis import get_redis
+from config import RATES_REFRESH_SECONDS, RATES_MAX_STALENESS_SECONDS
 
-async def get_ton_price() -> Decimal:
-    now = datetime.utcnow()
+LOG = logging.getLogger(__name__)
+
+TON_RUB = "ton_rub"
+USDT_RUB = "usdt_rub"
+
+_REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=5)
+_REDIS_KEY = "rates:{pair}"
+
+# Source ids per pair: (coingecko id, cryptocompare symbol, coinpaprika id)
+_PAIR_IDS: Dict[str, Tuple[str, str, str]] = {
+    TON_RUB: ("the-open-network", "TON", "ton-toncoin"),
+    USDT_RUB: ("tether", "USDT", "usdt-tether"),
+}
+
+
+class RateUnavailableError(Exception):
+    pass
+
+
+async def _from_coingecko(session: aiohttp.ClientSession, pair: str) -> Decimal:
+    coin_id = _PAIR_IDS[pair][0]
+    async with session.get(
+        "https://api.coingecko.com/api/v3/simple/price",
+        params={"ids": coin_id, "vs_currencies": "rub"},
+    ) as resp:
+        resp.raise_for_status()
+        data = await resp.json()
+        return Decimal(str(data[coin_id]["rub"]))
+
+
+async def _from_cryptocompare(session: aiohttp.ClientSession, pair: str) -> Decimal:
+    symbol = _PAIR_IDS[pair][1]
+    async with session.get(
+        "https://min-api.cryptocompare.com/data/price",
+        params={"fsym": symbol, "tsyms": "RUB"},
+    ) as resp:
+        resp.raise_for_status()
+        data = await resp.json()
+        return Decimal(str(data["RUB"]))
+
+
+async def _from_coinpaprika(session: aiohttp.ClientSession, pair: str) -> Decimal:
+    coin_id = _PAIR_IDS[pair][2]
+    async with session.get(
+        f"https://api.coinpaprika.com/v1/tickers/{coin_id}",
+        params={"quotes": "RUB"},
+    ) as resp:
+        resp.raise_for_status()
+        data = await resp.json()
+        return Decimal(str(data["quotes"]["RUB"]["price"]))
+
+
+RateSource = Callable[[aiohttp.ClientSession, str], Awaitable[Decimal]]
+
+DEFAULT_SOURCES: List[RateSource] = [_from_coingecko, _from_cryptocompare, _from_coinpaprika]
+
+
+class RateOracle:
+    def __init__(
+        self,
+        pairs: Tuple[str, ...] = (TON_RUB, USDT_RUB),
+        sources: Optional[List[RateSource]] = None,
+        refresh_seconds: int = RATES_REFRESH_SECONDS,
+        max_staleness_seconds: int = RATES_MAX_STALENESS_SECONDS,
+    ):
+        self.pairs = pairs
+        self.sources = sources or DEFAULT_SOURCES
+        self.refresh_seconds = refresh_seconds
+        self.max_staleness = max_staleness_seconds
+        self._rates: Dict[str, Tuple[Decimal, float]] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._http: Optional[aiohttp.ClientSession] = None
+        self.task: asyncio.Task = None
+        self._running = False
+
+    def _get_http(self) -> aiohttp.ClientSession:
+        if self._http is None or self._http.closed:
+            self._http = aiohttp.ClientSession(timeout=_REQUEST_TIMEOUT, trace_configs=[http_trace_config()])
+        return self._http
+
+    async def get(self, pair: str) -> Decimal:
+        """
+        Return the current rate for a pair.
 
-    if (_ton_price_cache["price"] and
-        _ton_price_cache["timestamp"] and
-        (now - _ton_price_cache["timestamp"]).total_seconds() < _PRICE_CACHE_TTL_SECONDS):
-        return _ton_price_cache["price"]
+        Fresh values are returned from memory. A value that is not fresh is
+        first reloaded from Redis, where the worker running the refresh loop
+        keeps it fresh. Stale values within the staleness bound are returned
+        immediately while a refresh runs in the background. Otherwise the
+        caller waits for the (shared) refresh, which raises
+        RateUnavailableError if no source answers.
+        """
+        now = time.time()
+        cached = self._rates.get(pair)
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(
-            "https://api.coingecko.com/api/v3/simple/price",
-            params={"ids": "the-open-network", "vs_currencies": "rub"},
-            timeout=aiohttp.ClientTimeout(total=5)
-        ) as resp:
-            data = await resp.json()
-            price = Decimal(str(data["the-open-network"]["rub"]))
+        if cached is None or now - cached[1] >= self.refresh_seconds:
+            persisted = await self._load_persisted(pair)
+            if persisted and (cached is None or persisted[1] > cached[1]):
+                cached = self._rates[pair] = persisted
 
-            _ton_price_cache["price"] = price
-            _ton_price_cache["timestamp"] = now
+        if cached:
+            price, fetched_at = cached
+            age = now - fetched_at
+            if age < self.refresh_seconds:
+                return price
+            if age < self.max_staleness:
+                self._refresh_in_background(pair)
+                return price
 
-            return price
+        # Past the staleness bound a cached value is never served
+        return await self._refresh(pair)
+
+    def _refresh_in_background(self, pair: str):
+        task = self._refresh_task(pair)
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    def _refresh_task(self, pair: str) -> asyncio.Task:
+        """Single-flight: concurrent callers share one refresh per pair."""
+        task = self._inflight.get(pair)
+        if task is None or task.done():
+            task = asyncio.create_task(self._fetch_and_store(pair))
+            self._inflight[pair] = task
+        return task
+
+    async def _refresh(self, pair: str) -> Decimal:
+        return await asyncio.shield(self._refresh_task(pair))
+
+    async def _fetch_and_store(self, pair: str) -> Decimal:
+        session = self._get_http()
+        results = await asyncio.gather(
+            *(source(session, pair) for source in self.sources),
+            return_exceptions=True
+        )
+
+        prices = []
+        for source, result in zip(self.sources, results):
+            if isinstance(result, Exception):
+                LOG.warning(f"Rate source {source.__name__} failed for {pair}: {type(result).__name__}: {result}")
+            elif isinstance(result, Decimal) and result > 0:
+                prices.append(result)
+
+        if not prices:
+            raise RateUnavailableError(f"No rate source answered for {pair}")
+
+        price = median(prices)
+        fetched_at = time.time()
+        self._rates[pair] = (price, fetched_at)
+        await self._persist(pair, price, fetched_at)
+        LOG.debug(f"Rate {pair} refreshed: {price} (median of {len(prices)})")
+        return price
+
+    async def _persist(self, pair: str, price: Decimal, fetched_at: float):
+        try:
+            redis = await get_redis()
+            await redis.set(
+                _REDIS_KEY.format(pair=pair),
+                json.dumps({"price": str(price), "ts": fetched_at}),
+                ex=self.max_staleness
+            )
+        except Exception as e:
+            LOG.warning(f"Redis error persisting rate {pair}: {e}")
+
+    async def _load_persisted(self, pair: str) -> Optional[Tuple[Decimal, float]]:
+        try:
+            redis = await get_redis()
+            raw = await redis.get(_REDIS_KEY.format(pair=pair))
+            if not raw:
+                return None
+            data = json.loads(raw)
+            cached = (Decimal(data["price"]), float(data["ts"]))
+        except (RuntimeError, ValueError, KeyError, InvalidOperation):
+            return None
+        except Exception as e:
+            LOG.warning(f"Redis error loading rate {pair}: {e}")
+            return None
+        return cached
+
+    async def refresh_all(self):
+        results = await asyncio.gather(
+            *(self._refresh(pair) for pair in self.pairs),
+            return_exceptions=True
+        )
+        for pair, result in zip(self.pairs, results):
+            if isinstance(result, Exception):
+                LOG.error(f"Rate refresh failed for {pair}: {result}")
+
+    async def run_loop(self):
+        """Refresh all pairs ahead of expiry so readers always hit memory or Redis (run by one worker)"""
+        self._running = True
+        LOG.info(f"Rate oracle started (refresh: {self.refresh_seconds}s, max staleness: {self.max_staleness}s)")
+
+        while self._running:
+            try:
+                await self.refresh_all()
+            except Exception as e:
+                LOG.error(f"Error in rate oracle loop: {type(e).__name__}: {e}")
+
+            await asyncio.sleep(max(1, self.refresh_seconds // 2))
+
+        LOG.info("Rate oracle stopped")
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run_loop())
+        else:
+            LOG.warning("Rate oracle already running")
+
+    async def stop(self):
+        self._running = False
+        if self.task and not self.task.done():
+            self.task.cancel()
+        if self._http is not None and not self._http.closed:
+            await self._http.close()
+
+
+rate_oracle = RateOracle()
+
+
+async def get_ton_price() -> Decimal:
+    return await rate_oracle.get(TON_RUB)
 
 
 async def get_usdt_rub_rate() -> Decimal:
-    """Get USDT to RUB exchange rate from CoinGecko API with caching"""
-    now = datetime.utcnow()
-
-    if (_usdt_price_cache["price"] and
-        _usdt_price_cache["timestamp"] and
-        (now - _usdt_price_cache["timestamp"]).total_seconds() < _PRICE_CACHE_TTL_SECONDS):
-        return _usdt_price_cache["price"]
-
-    async with aiohttp.ClientSession() as session:
-        async with session.get(
-            "https://api.coingecko.com/api/v3/simple/price",
-            params={"ids": "tether", "vs_currencies": "rub"},
-            timeout=aiohttp.ClientTimeout(total=5)
-        ) as resp:
-            data = await resp.json()
-            price = Decimal(str(data["tether"]["rub"]))
-
-            _usdt_price_cache["price"] = price
-            _usdt_price_cache["timestamp"] = now
-
-            return price
\ No newline at end of file
+    """Get USDT to RUB exchange rate (median of sources, served from cache)"""
+    return await rate_oracle.get(USDT_RUB)
@@ -3,12 +3,19 @@ import redis.asyncio as redis
 
 redis_client: redis.Redis = None
 
+# Every running handler makes several calls (rate limit, FSM, per-user mutex),
+# so the pool is sized from the handler concurrency plus the send queue and
+# background jobs. A burst beyond it waits up to POOL_TIMEOUT for a connection
+# instead of failing with "Too many connections".
+MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", int(os.getenv("UPDATE_CONCURRENCY", 64)) + 32))
+POOL_TIMEOUT = 10
+
 async def init_cache():
     global redis_client
     if redis_client is None:
         try:
             url = os.getenv("REDIS_URL", "redis://localhost")
-            redis_client = await redis.from_url(
+            pool = redis.BlockingConnectionPool.from_url(
                 url,
                 encoding="utf-8",
                 decode_responses=True,
@@ -16,8 +23,10 @@ async def init_cache():
                 socket_keepalive=True,
                 health_check_interval=30,
                 retry_on_timeout=True,
-                max_connections=10
+                max_connections=MAX_CONNECTIONS,
+                timeout=POOL_TIMEOUT
             )
+            redis_client = redis.Redis(connection_pool=pool)
             await redis_client.ping()
             print("Redis connected")
         except Exception as e:
@@ -33,5 +42,7 @@ async def close_cache():
     global redis_client
     if redis_client is not None:
         await redis_client.close()
+        # The client does not own a pool it was given
+        await redis_client.connection_pool.disconnect()
         print("Redis closed")
         redis_client = None
@@ -0,0 +1,419 @@
+import asyncio
+import json
+import logging
+import random
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from app.utils.redis import get_redis
+
+LOG = logging.getLogger(__name__)
+
+KEY_PREFIX = "scheduler"
+JOBS_KEY = f"{KEY_PREFIX}:jobs"
+HISTORY_SIZE = 50
+
+# Take the run lock only if the persisted next run is due, atomically, so an
+# instance that finished the slot (and moved next_run_at on) in between the
+# check and the lock cannot have it run twice.
+# Returns 1 when locked, 0 when another instance holds the lock, -1 when not due
+_ACQUIRE_LOCK_SCRIPT = """
+local next_run = redis.call('hget', KEYS[1], 'next_run_at')
+if next_run and next_run > ARGV[1] then
+    return -1
+end
+if redis.call('set', KEYS[2], ARGV[2], 'NX', 'EX', ARGV[3]) then
+    return 1
+end
+return 0
+"""
+
+# Delete the lock only if we still own it
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def _state_key(name: str) -> str:
+    return f"{KEY_PREFIX}:job:{name}"
+
+
+def _history_key(name: str) -> str:
+    return f"{KEY_PREFIX}:history:{name}"
+
+
+def _lock_key(name: str) -> str:
+    return f"{KEY_PREFIX}:lock:{name}"
+
+
+# ----------------------------
+# Triggers
+# ----------------------------
+class IntervalTrigger:
+    """Fire every `seconds` after the previous run started"""
+
+    def __init__(self, seconds: int):
+        if seconds <= 0:
+            raise ValueError("Interval must be positive")
+        self.seconds = seconds
+
+    def next_after(self, moment: datetime) -> datetime:
+        return moment + timedelta(seconds=self.seconds)
+
+    def __str__(self) -> str:
+        return f"every {self.seconds}s"
+
+
+class CronTrigger:
+    """
+    Standard 5-field cron expression (minute hour day-of-month month day-of-week), in UTC.
+
+    Supports '*', lists ('1,15'), ranges ('1-5') and steps ('*/10', '0-30/5').
+    Day-of-week uses 0-6 with 0 (or 7) = Sunday. As in cron, when both day fields
+    are restricted a day matches if either of them matches.
+    """
+
+    _BOUNDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression must have 5 fields: {expression!r}")
+
+        self.expression = expression
+        parsed = [self._parse_field(f, lo, hi) for f, (lo, hi) in zip(fields, self._BOUNDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        self.weekdays = {d % 7 for d in weekdays}
+        self._days_restricted = fields[2] != "*"
+        self._weekdays_restricted = fields[4] != "*"
+
+    @staticmethod
+    def _parse_field(field: str, lo: int, hi: int) -> set:
+        values = set()
+        for part in field.split(","):
+            step = 1
+            if "/" in part:
+                part, step_str = part.split("/", 1)
+                step = int(step_str)
+                if step <= 0:
+                    raise ValueError(f"Invalid cron step: {field!r}")
+
+            if part == "*":
+                start, end = lo, hi
+            elif "-" in part:
+                start_str, end_str = part.split("-", 1)
+                start, end = int(start_str), int(end_str)
+            else:
+                start = int(part)
+                end = hi if step > 1 else start
+
+            if start < lo or end > hi or start > end:
+                raise ValueError(f"Cron field {field!r} out of range {lo}-{hi}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, moment: datetime) -> bool:
+        day_ok = moment.day in self.days
+        # Python: Monday=0, cron: Sunday=0
+        weekday_ok = (moment.weekday() + 1) % 7 in self.weekdays
+        if self._days_restricted and self._weekdays_restricted:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+    def next_after(self, moment: datetime) -> datetime:
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=366 * 4)
+
+        while candidate <= limit:
+            if candidate.month not in self.months:
+                year = candidate.year + (candidate.month == 12)
+                month = candidate.month % 12 + 1
+                candidate = candidate.replace(year=year, month=month, day=1, hour=0, minute=0)
+                continue
+            if not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+                continue
+            if candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+                continue
+            return candidate
+
+        raise ValueError(f"Cron expression {self.expression!r} never fires")
+
+    def __str__(self) -> str:
+        return f"cron '{self.expression}'"
+
+
+# ----------------------------
+# Jobs
+# ----------------------------
+@dataclass
+class Job:
+    """
+    A scheduled coroutine.
+
+    Attributes:
+        name: Unique job name (used for Redis keys and the dashboard)
+        func: Coroutine function called with no arguments
+        trigger: IntervalTrigger or CronTrigger
+        jitter_seconds: Random delay added to every next-run time
+        max_runtime_seconds: Run is cancelled after this long (also the lock TTL)
+        run_on_start: Run immediately if the job has never run before
+    """
+    name: str
+    func: Callable[[], Awaitable[Any]]
+    trigger: Any
+    jitter_seconds: int = 0
+    max_runtime_seconds: int = 3600
+    run_on_start: bool = True
+    next_run_at: Optional[datetime] = None
+
+    def schedule_after(self, moment: datetime) -> datetime:
+        next_run = self.trigger.next_after(moment)
+        if self.jitter_seconds > 0:
+            next_run += timedelta(seconds=random.uniform(0, self.jitter_seconds))
+        return next_run
+
+
+class Scheduler:
+    """
+    Runs background jobs on interval or cron triggers.
+
+    Last/next run times live in Redis, so a restart resumes the schedule instead
+    of running everything at once, and every run takes a per-job Redis lock, so
+    with several bot instances each run happens once. Each job keeps a short run
+    history (see get_job_states) shown in the manager dashboard.
+    """
+
+    def __init__(self, poll_interval_seconds: int = 30):
+        """
+        Args:
+            poll_interval_seconds: Longest sleep between checks (picks up runs made by other instances)
+        """
+        self.poll_interval = poll_interval_seconds
+        self.jobs: Dict[str, Job] = {}
+        self.task: asyncio.Task = None
+        self._running = False
+        self._job_tasks: Dict[str, asyncio.Task] = {}
+        self._instance_id = uuid.uuid4().hex[:12]
+
+    def add_job(
+        self,
+        name: str,
+        func: Callable[[], Awaitable[Any]],
+        trigger,
+        jitter_seconds: int = 0,
+        max_runtime_seconds: int = 3600,
+        run_on_start: bool = True
+    ) -> Job:
+        if name in self.jobs:
+            raise ValueError(f"Job {name} already registered")
+        job = Job(
+            name=name,
+            func=func,
+            trigger=trigger,
+            jitter_seconds=jitter_seconds,
+            max_runtime_seconds=max_runtime_seconds,
+            run_on_start=run_on_start,
+        )
+        self.jobs[name] = job
+        return job
+
+    async def _load_next_run(self, redis, job: Job) -> Optional[datetime]:
+        value = await redis.hget(_state_key(job.name), "next_run_at")
+        return datetime.fromisoformat(value) if value else None
+
+    async def _init_job(self, redis, job: Job):
+        """Resume the persisted schedule, or compute the first run for a new job"""
+        now = datetime.utcnow()
+        next_run = None
+        try:
+            next_run = await self._load_next_run(redis, job)
+            await redis.sadd(JOBS_KEY, job.name)
+            await redis.hset(_state_key(job.name), mapping={"trigger": str(job.trigger)})
+        except Exception as e:
+            LOG.warning(f"Redis error loading schedule for job {job.name}: {e}")
+
+        if next_run is None:
+            if job.run_on_start:
+                next_run = now + timedelta(seconds=random.uniform(0, job.jitter_seconds))
+            else:
+                next_run = job.schedule_after(now)
+            try:
+                # Only the first instance to start sets the initial schedule
+                await redis.hsetnx(_state_key(job.name), "next_run_at", next_run.isoformat())
+                next_run = await self._load_next_run(redis, job) or next_run
+            except Exception as e:
+                LOG.warning(f"Redis error saving schedule for job {job.name}: {e}")
+
+        job.next_run_at = next_run
+        LOG.info(f"Job {job.name} scheduled ({job.trigger}), next run at {next_run:%Y-%m-%d %H:%M:%S} UTC")
+
+    async def _record(self, redis, job: Job, entry: Dict[str, Any]):
+        try:
+            async with redis.pipeline(transaction=True) as pipe:
+                pipe.hset(_state_key(job.name), mapping={
+                    "last_run_at": entry["started_at"],
+                    "last_finished_at": entry["finished_at"],
+                    "last_status": entry["status"],
+                    "last_duration": f"{entry['duration']:.3f}",
+                    "last_error": entry.get("error") or "",
+                    "last_instance": self._instance_id,
+                    "next_run_at": job.next_run_at.isoformat(),
+                })
+                pipe.lpush(_history_key(job.name), json.dumps(entry, default=str))
+                pipe.ltrim(_history_key(job.name), 0, HISTORY_SIZE - 1)
+                await pipe.execute()
+        except Exception as e:
+            LOG.warning(f"Redis error recording run of job {job.name}: {e}")
+
+    async def _run_job(self, job: Job):
+        redis = await get_redis()
+        lock_key = _lock_key(job.name)
+        token = f"{self._instance_id}:{uuid.uuid4().hex}"
+
+        try:
+            # isoformat strings of naive UTC datetimes compare in time order
+            acquired = await redis.eval(
+                _ACQUIRE_LOCK_SCRIPT, 2, _state_key(job.name), lock_key,
+                datetime.utcnow().isoformat(), token, job.max_runtime_seconds + 60
+            )
+            if acquired == -1:
+                # Another instance ran it already and moved the schedule on
+                job.next_run_at = await self._load_next_run(redis, job)
+                return
+        except Exception as e:
+            LOG.warning(f"Redis error locking job {job.name}: {e}")
+            job.next_run_at = datetime.utcnow() + timedelta(seconds=self.poll_interval)
+            return
+
+        if acquired != 1:
+            LOG.debug(f"Job {job.name} is running elsewhere, skipping")
+            job.next_run_at = datetime.utcnow() + timedelta(seconds=self.poll_interval)
+            return
+
+        started_at = datetime.utcnow()
+        started = time.monotonic()
+        entry: Dict[str, Any] = {"started_at": started_at.isoformat(), "instance": self._instance_id}
+
+        try:
+            result = await asyncio.wait_for(job.func(), timeout=job.max_runtime_seconds)
+            entry["status"] = "ok"
+            if isinstance(result, dict):
+                entry["result"] = result
+            elif hasattr(result, "as_dict"):
+                entry["result"] = result.as_dict()
+        except asyncio.TimeoutError:
+            entry["status"] = "timeout"
+            entry["error"] = f"exceeded {job.max_runtime_seconds}s"
+            LOG.error(f"Job {job.name} exceeded max runtime of {job.max_runtime_seconds}s and was cancelled")
+        except asyncio.CancelledError:
+            entry["status"] = "cancelled"
+            raise
+        except Exception as e:
+            entry["status"] = "error"
+            entry["error"] = f"{type(e).__name__}: {e}"
+            LOG.error(f"Job {job.name} failed: {type(e).__name__}: {e}")
+        finally:
+            entry["finished_at"] = datetime.utcnow().isoformat()
+            entry["duration"] = time.monotonic() - started
+            job.next_run_at = job.schedule_after(started_at)
+            if job.next_run_at <= datetime.utcnow():
+                # Overran its slot: schedule from now instead of firing back-to-back
+                job.next_run_at = job.schedule_after(datetime.utcnow())
+
+            await self._record(redis, job, entry)
+            try:
+                await redis.eval(_RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+            except Exception as e:
+                LOG.warning(f"Redis error releasing lock for job {job.name}: {e}")
+
+        LOG.info(f"Job {job.name} finished: {entry['status']} in {entry['duration']:.1f}s, "
+                 f"next run at {job.next_run_at:%Y-%m-%d %H:%M:%S} UTC")
+
+    async def run_loop(self):
+        """Dispatch due jobs until stopped"""
+        self._running = True
+        redis = await get_redis()
+        for job in self.jobs.values():
+            await self._init_job(redis, job)
+
+        LOG.info(f"Scheduler started with {len(self.jobs)} jobs (instance {self._instance_id})")
+
+        while self._running:
+            now = datetime.utcnow()
+            for job in self.jobs.values():
+                running = self._job_tasks.get(job.name)
+                if running and not running.done():
+                    continue
+                if job.next_run_at and job.next_run_at <= now:
+                    self._job_tasks[job.name] = asyncio.create_task(self._run_job(job))
+
+            pending = [j.next_run_at for j in self.jobs.values() if j.next_run_at]
+            delay = self.poll_interval
+            if pending:
+                delay = min(delay, max(1.0, (min(pending) - datetime.utcnow()).total_seconds()))
+            await asyncio.sleep(delay)
+
+        LOG.info("Scheduler stopped")
+
+    def start(self):
+        """Start the scheduler loop"""
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run_loop())
+            LOG.info("Scheduler task created")
+        else:
+            LOG.warning("Scheduler task already running")
+
+    def stop(self):
+        """Stop the scheduler and cancel running jobs"""
+        self._running = False
+        for task in self._job_tasks.values():
+            if not task.done():
+                task.cancel()
+        if self.task and not self.task.done():
+            self.task.cancel()
+            LOG.info("Scheduler task cancelled")
+
+
+async def get_job_states(redis, history: int = 10) -> List[Dict[str, Any]]:
+    """
+    Schedule and recent runs of every registered job (used by the manager dashboard).
+
+    Args:
+        redis: Redis client
+        history: Number of recent runs to include per job
+
+    Returns:
+        List of job dicts with state fields and a 'history' list
+    """
+    names = sorted(await redis.smembers(JOBS_KEY))
+    if not names:
+        return []
+
+    async with redis.pipeline(transaction=False) as pipe:
+        for name in names:
+            pipe.hgetall(_state_key(name))
+            pipe.lrange(_history_key(name), 0, history - 1)
+            pipe.ttl(_lock_key(name))
+        results = await pipe.execute()
+
+    jobs = []
+    for i, name in enumerate(names):
+        state, runs, lock_ttl = results[i * 3:i * 3 + 3]
+        jobs.append({
+            "name": name,
+            **state,
+            "running": lock_ttl is not None and lock_ttl > 0,
+            "history": [json.loads(run) for run in runs],
+        })
+    return jobs
@@ -0,0 +1,313 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+)
+
+from app.utils.rate_limit import telegram_send_bucket
+from app.utils.delivery import delivery_tracker
+
+LOG = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """Lower value is sent first"""
+    CRITICAL = 0       # Payment receipts, admin alerts
+    TRANSACTIONAL = 1  # Renewal receipts, traffic warnings
+    NOTIFICATION = 2   # Subscription expiry reminders
+    BULK = 3           # Broadcasts
+
+
+SENT = "sent"
+BLOCKED = "blocked"  # User blocked the bot or the chat is gone
+FAILED = "failed"
+
+# Bad requests that are about the chat itself rather than the message or an outage;
+# they count toward DELIVERY_MAX_FAILURES (rights or a peer may come back)
+_CHAT_BAD_REQUESTS = ("peer_id_invalid", "user not found", "not enough rights", "have no rights")
+
+
+@dataclass(order=True)
+class _Job:
+    priority: int
+    seq: int
+    chat_id: int = field(compare=False)
+    call: Callable[[Bot], Awaitable[Any]] = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    attempts: int = field(default=0, compare=False)
+
+
+class SendQueue:
+    """
+    Process-wide queue for outgoing Telegram messages.
+
+    Workers take jobs by priority, put back the ones whose chat is still
+    paced until the chat is due, wait for the global token bucket
+    (TELEGRAM_SEND_RATE per second), handle RetryAfter by pausing that chat
+    and retrying, and resolve each job's future with 'sent', 'blocked' or
+    'failed'. Only when several chats hit
+    flood control at once is the global bucket paused, and then briefly.
+    The queue is bounded, so producers of bulk traffic are slowed down
+    instead of buffering everything.
+    """
+
+    def __init__(
+        self,
+        workers: int = 8,
+        max_size: int = 5000,
+        per_chat_interval: float = 1.0,
+        max_attempts: int = 3,
+        max_tracked_chats: int = 50000,
+        global_flood_chats: int = 3,
+        flood_window: float = 10.0,
+        max_global_pause: float = 5.0
+    ):
+        """
+        Args:
+            workers: Concurrent senders
+            max_size: Maximum queued jobs (put() waits when full)
+            per_chat_interval: Minimum seconds between messages to the same chat
+            max_attempts: Attempts per job on RetryAfter / network errors
+            max_tracked_chats: Size bound of the per-chat pacing table
+            global_flood_chats: Distinct chats hitting RetryAfter within flood_window
+                                that are treated as a bot-wide limit
+            flood_window: Seconds over which RetryAfter chats are counted
+            max_global_pause: Longest pause of the global bucket
+        """
+        self.bot: Optional[Bot] = None
+        self.workers = workers
+        self.per_chat_interval = per_chat_interval
+        self.max_attempts = max_attempts
+        self.max_tracked_chats = max_tracked_chats
+        self.global_flood_chats = global_flood_chats
+        self.flood_window = flood_window
+        self.max_global_pause = max_global_pause
+        self.stats: Counter = Counter()
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue(maxsize=max_size)
+        self._seq = itertools.count()
+        self._next_send: OrderedDict[int, float] = OrderedDict()
+        self._flooded: OrderedDict[int, float] = OrderedDict()  # chat -> time of its last RetryAfter
+        self._tasks: list = []
+        self._retries: Dict[asyncio.Task, _Job] = {}
+
+    @property
+    def size(self) -> int:
+        return self._queue.qsize()
+
+    def start(self, bot: Optional[Bot] = None):
+        if self._tasks:
+            LOG.warning("Send queue already running")
+            return
+        if bot is None:
+            from config import bot
+        self.bot = bot
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        LOG.info(f"Send queue started ({self.workers} workers)")
+
+    async def stop(self, drain_timeout: float = 10.0):
+        """Let queued messages go out for up to drain_timeout seconds, then stop"""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            LOG.warning(f"Send queue stopped with {self.size} messages unsent")
+        retries = dict(self._retries)
+        for task in [*self._tasks, *retries]:
+            task.cancel()
+        await asyncio.gather(*self._tasks, *retries, return_exceptions=True)
+        self._tasks = []
+
+        for job in retries.values():
+            if not job.future.done():
+                job.future.set_result(FAILED)
+        self._retries.clear()
+
+        # Anyone still waiting gets a definite answer
+        while not self._queue.empty():
+            job = self._queue.get_nowait()
+            if not job.future.done():
+                job.future.set_result(FAILED)
+            self._queue.task_done()
+        LOG.info("Send queue stopped")
+
+    async def call(
+        self,
+        chat_id: int,
+        call: Callable[[Bot], Awaitable[Any]],
+        priority: Priority = Priority.NOTIFICATION,
+        wait: bool = True
+    ) -> Optional[str]:
+        """
+        Queue an arbitrary Bot API call addressed to chat_id.
+
+        Args:
+            chat_id: Target chat (used for per-chat pacing)
+            call: Receives the Bot and performs the request
+            priority: Queue priority
+            wait: Wait for the result instead of returning once queued
+
+        Returns:
+            'sent', 'blocked' or 'failed' when waiting, otherwise None
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(_Job(int(priority), next(self._seq), chat_id, call, future))
+        if not wait:
+            return None
+        return await future
+
+    async def send_message(
+        self,
+        chat_id: int,
+        text: str,
+        priority: Priority = Priority.NOTIFICATION,
+        wait: bool = True,
+        **kwargs
+    ) -> Optional[str]:
+        """Queue bot.send_message(chat_id, text, **kwargs); see call()"""
+        return await self.call(
+            chat_id,
+            lambda bot: bot.send_message(chat_id=chat_id, text=text, **kwargs),
+            priority=priority,
+            wait=wait,
+        )
+
+    async def copy_message(
+        self,
+        chat_id: int,
+        from_chat_id: int,
+        message_id: int,
+        priority: Priority = Priority.BULK,
+        wait: bool = True,
+        **kwargs
+    ) -> Optional[str]:
+        """Queue bot.copy_message(...); see call()"""
+        return await self.call(
+            chat_id,
+            lambda bot: bot.copy_message(
+                chat_id=chat_id, from_chat_id=from_chat_id, message_id=message_id, **kwargs
+            ),
+            priority=priority,
+            wait=wait,
+        )
+
+    def _chat_delay(self, chat_id: int) -> float:
+        return self._next_send.get(chat_id, 0.0) - time.monotonic()
+
+    def _mark_chat(self, chat_id: int, delay: float):
+        self._next_send[chat_id] = time.monotonic() + delay
+        self._next_send.move_to_end(chat_id)
+        while len(self._next_send) > self.max_tracked_chats:
+            self._next_send.popitem(last=False)
+
+    def _is_global_flood(self, chat_id: int) -> bool:
+        """Whether RetryAfter is hitting several chats at once (a bot-wide limit)"""
+        now = time.monotonic()
+        self._flooded[chat_id] = now
+        self._flooded.move_to_end(chat_id)
+        while self._flooded and next(iter(self._flooded.values())) < now - self.flood_window:
+            self._flooded.popitem(last=False)
+        return len(self._flooded) >= self.global_flood_chats
+
+    def _finish(self, job: _Job, result: str, error: Optional[str] = None, permanent: bool = False):
+        """
+        Resolve the job. Only outcomes that say something about the chat reach
+        the delivery tracker: a send, a block, or a chat-level failure
+        (`permanent`). Outages, exhausted retries and errors in our own request
+        never make a user unreachable.
+        """
+        self.stats[result] += 1
+        if result != FAILED or permanent:
+            delivery_tracker.record(job.chat_id, result, error)
+        if not job.future.done():
+            job.future.set_result(result)
+
+    async def _requeue(self, job: _Job, delay: float):
+        await asyncio.sleep(delay)
+        await self._queue.put(job)
+
+    async def _worker(self):
+        while True:
+            job: _Job = await self._queue.get()
+            try:
+                await self._process(job)
+            except Exception as e:
+                LOG.error(f"Send queue worker error for chat {job.chat_id}: {type(e).__name__}: {e}")
+                self._finish(job, FAILED, f"{type(e).__name__}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, job: _Job):
+        if job.future.cancelled():
+            return
+
+        # A chat that is paced or under flood control gets the job back later,
+        # so its waits never hold a worker that other chats could use
+        delay = self._chat_delay(job.chat_id)
+        if delay > 0:
+            self._defer(job, delay)
+            return
+        # Reserve the chat before sending so concurrent jobs for it wait their turn
+        self._mark_chat(job.chat_id, self.per_chat_interval)
+
+        await telegram_send_bucket.acquire()
+        job.attempts += 1
+        try:
+            await job.call(self.bot)
+            self._finish(job, SENT)
+
+        except TelegramRetryAfter as e:
+            LOG.warning(f"Flood control on chat {job.chat_id}: retry after {e.retry_after}s")
+            self.stats["retry_after"] += 1
+            # A per-chat limit only holds back that chat; other chats (payment
+            # receipts included) keep going unless the limit looks bot-wide
+            self._mark_chat(job.chat_id, e.retry_after)
+            if self._is_global_flood(job.chat_id):
+                telegram_send_bucket.pause(min(e.retry_after, self.max_global_pause))
+            self._retry(job, e.retry_after, str(e))
+
+        except TelegramForbiddenError as e:
+            LOG.debug(f"Chat {job.chat_id} blocked the bot")
+            self._finish(job, BLOCKED, str(e))
+
+        except TelegramBadRequest as e:
+            # "chat not found" and similar mean the chat is unreachable for good
+            LOG.warning(f"Bad request sending to {job.chat_id}: {e}")
+            text = str(e).lower()
+            if "chat not found" in text:
+                self._finish(job, BLOCKED, str(e))
+            else:
+                self._finish(job, FAILED, str(e), permanent=any(m in text for m in _CHAT_BAD_REQUESTS))
+
+        except TelegramNetworkError as e:
+            LOG.warning(f"Network error sending to {job.chat_id}: {e}")
+            self._retry(job, 2.0 * job.attempts, str(e))
+
+    def _retry(self, job: _Job, delay: float, error: str):
+        if job.attempts >= self.max_attempts:
+            self._finish(job, FAILED, error)
+            return
+        self._defer(job, delay)
+
+    def _defer(self, job: _Job, delay: float):
+        # Requeued from a separate task so this worker is free meanwhile
+        task = asyncio.create_task(self._requeue(job, delay))
+        self._retries[task] = job
+        task.add_done_callback(lambda t: self._retries.pop(t, None))
+
+    def get_stats(self) -> Dict[str, int]:
+        return {"queued": self.size, **self.stats}
+
+
+send_queue = SendQueue()
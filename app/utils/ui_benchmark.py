@@ -0,0 +1,56 @@
+"""
+Micro-benchmark of the UI work done per update: translator lookup, a few
+strings and the screen's keyboard, built from scratch versus from the
+per-language caches.
+
+    python -m app.utils.ui_benchmark
+"""
+import timeit
+
+from app.core import keyboards
+from app.locales.locales import LOCALES, get_translator
+
+STRINGS = ("welcome", "my_vpn", "balance", "settings", "back_main")
+
+
+def _uncached_translator(lang: str):
+    # What get_translator did before translators were prepared per language
+    lang_dict = LOCALES.get(lang, LOCALES["en"])
+
+    def translate(key: str, **kwargs):
+        text = lang_dict.get(key, key)
+        try:
+            return text.format(**kwargs)
+        except Exception:
+            return text
+
+    return translate
+
+
+def update_uncached(lang: str = "ru"):
+    t = _uncached_translator(lang)
+    for key in STRINGS:
+        t(key)
+    keyboards._main_kb.__wrapped__(t, is_admin=False)
+    keyboards.sub_kb.__wrapped__(t)
+
+
+def update_cached(lang: str = "ru"):
+    t = get_translator(lang)
+    for key in STRINGS:
+        t(key)
+    keyboards.main_kb(t)
+    keyboards.sub_kb(t)
+
+
+def run(number: int = 20000) -> dict[str, float]:
+    """Microseconds per update for both paths"""
+    update_cached()  # Warm the caches
+    return {
+        name: round(min(timeit.repeat(func, number=number, repeat=3)) / number * 1e6, 2)
+        for name, func in (("uncached_us", update_uncached), ("cached_us", update_cached))
+    }
+
+
+if __name__ == "__main__":
+    print(run())
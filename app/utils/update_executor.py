@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+
+from app.utils.redis import get_redis
+from config import UPDATE_CONCURRENCY, UPDATE_MAX_PENDING
+
+LOG = logging.getLogger(__name__)
+
+USER_LOCK_KEY = "updates:user:{key}"
+
+# Delete the lock only if we still own it
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# Upper bounds (seconds) of the wait-time histogram buckets
+WAIT_BUCKETS = (0.1, 0.5, 1.0, 5.0, float("inf"))
+
+
+class _UserQueue:
+    __slots__ = ("lock", "depth")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()  # FIFO: waiters acquire in arrival order
+        self.depth = 0
+
+
+class UpdateExecutor:
+    """
+    Runs update handlers serially per user and in parallel across users.
+
+    Each user has a FIFO lock, so two quick clicks are handled one after the
+    other, in order. That lock only covers this process: with `distributed`
+    (webhook mode with several workers, where one user's updates are spread
+    across processes) each update also holds a per-user Redis mutex, so the
+    handlers still never overlap; across processes they run in the order the
+    mutex is taken, not strictly in arrival order.
+
+    Across users at most `max_concurrency` handlers run at once; the rest
+    wait for a slot. Waiting updates are counted, and once
+    `max_pending` wait, `overloaded` tells the transport to push back (the
+    webhook server answers 503, and Telegram redelivers later).
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = UPDATE_CONCURRENCY,
+        max_pending: int = UPDATE_MAX_PENDING,
+        slow_wait_seconds: float = 5.0,
+        distributed: bool = False,
+        lock_ttl_seconds: float = 120.0,
+        lock_wait_seconds: float = 60.0
+    ):
+        """
+        Args:
+            max_concurrency: Handlers running at once across all users
+            max_pending: Waiting updates above which the executor reports overload
+            slow_wait_seconds: Waits longer than this are logged
+            distributed: Also serialize each user's updates across processes through Redis
+            lock_ttl_seconds: Expiry of the Redis mutex (covers a crashed holder)
+            lock_wait_seconds: Longest wait for the Redis mutex before running without it
+        """
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.slow_wait_seconds = slow_wait_seconds
+        self.distributed = distributed
+        self.lock_ttl = lock_ttl_seconds
+        self.lock_wait = lock_wait_seconds
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._users: Dict[int, _UserQueue] = {}
+        self.pending = 0
+        self.running = 0
+        self.stats: Counter = Counter()
+        self.wait_buckets: Counter = Counter()
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.max_user_depth = 0
+
+    @property
+    def overloaded(self) -> bool:
+        return self.pending >= self.max_pending
+
+    def _record_wait(self, waited: float):
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        for bound in WAIT_BUCKETS:
+            if waited <= bound:
+                self.wait_buckets[bound] += 1
+                break
+        if waited >= self.slow_wait_seconds:
+            LOG.warning(
+                f"Update waited {waited:.1f}s for execution "
+                f"(pending={self.pending}, running={self.running})"
+            )
+
+    async def _acquire_remote(self, key: int) -> Optional[str]:
+        """Take the user's Redis mutex; returns its token, or None to run without it"""
+        token = uuid.uuid4().hex
+        lock_key = USER_LOCK_KEY.format(key=key)
+        deadline = time.monotonic() + self.lock_wait
+        delay = 0.005
+        try:
+            redis = await get_redis()
+            while not await redis.set(lock_key, token, nx=True, px=int(self.lock_ttl * 1000)):
+                if time.monotonic() >= deadline:
+                    self.stats["lock_timeouts"] += 1
+                    LOG.warning(f"Update lock of {key} still held after {self.lock_wait:.0f}s, running without it")
+                    return None
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.05)
+        except Exception as e:
+            self.stats["lock_errors"] += 1
+            LOG.warning(f"Update lock of {key} unavailable, running without it: {e}")
+            return None
+        return token
+
+    async def _release_remote(self, key: int, token: str):
+        try:
+            redis = await get_redis()
+            await redis.eval(_RELEASE_LOCK_SCRIPT, 1, USER_LOCK_KEY.format(key=key), token)
+        except Exception as e:
+            LOG.warning(f"Could not release update lock of {key}: {e}")
+
+    async def run(self, key: Optional[int], call: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run `call` after earlier updates of `key` and once a global slot is free.
+
+        Args:
+            key: User (or chat) id; None runs without per-user ordering
+            call: The handler chain
+        """
+        started = time.monotonic()
+        self.pending += 1
+        self.stats["updates"] += 1
+        if self.overloaded:
+            self.stats["overloaded"] += 1
+
+        queue = None
+        if key is not None:
+            queue = self._users.get(key)
+            if queue is None:
+                queue = self._users[key] = _UserQueue()
+            queue.depth += 1
+            self.max_user_depth = max(self.max_user_depth, queue.depth)
+
+        waiting = True
+        try:
+            if queue:
+                await queue.lock.acquire()
+            token = None
+            try:
+                if queue and self.distributed:
+                    token = await self._acquire_remote(key)
+                async with self._slots:
+                    waiting = False
+                    self.pending -= 1
+                    self._record_wait(time.monotonic() - started)
+                    self.running += 1
+                    try:
+                        return await call()
+                    finally:
+                        self.running -= 1
+            finally:
+                if token:
+                    await self._release_remote(key, token)
+                if queue:
+                    queue.lock.release()
+        finally:
+            if waiting:
+                self.pending -= 1
+            if queue:
+                queue.depth -= 1
+                if queue.depth == 0:
+                    self._users.pop(key, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Current queue depth and wait times since start"""
+        handled = sum(self.wait_buckets.values())
+        return {
+            "pending": self.pending,
+            "running": self.running,
+            "users_queued": len(self._users),
+            "max_user_depth": self.max_user_depth,
+            "updates": self.stats["updates"],
+            "overloaded": self.stats["overloaded"],
+            "lock_timeouts": self.stats["lock_timeouts"],
+            "lock_errors": self.stats["lock_errors"],
+            "wait_avg": round(self.wait_total / handled, 3) if handled else 0.0,
+            "wait_max": round(self.wait_max, 3),
+            "wait_buckets": {
+                ("+Inf" if bound == float("inf") else str(bound)): self.wait_buckets[bound]
+                for bound in WAIT_BUCKETS
+            },
+        }
+
+
+class UpdateExecutorMiddleware(BaseMiddleware):
+    """Outer update middleware that runs every update through an UpdateExecutor"""
+
+    def __init__(self, executor: UpdateExecutor):
+        super().__init__()
+        self.executor = executor
+
+    async def __call__(self, handler: Callable, event: Any, data: Dict[str, Any]):
+        user = data.get("event_from_user")
+        chat = data.get("event_chat")
+        key = user.id if user else (chat.id if chat else None)
+        return await self.executor.run(key, lambda: handler(event, data))
+
+
+update_executor = UpdateExecutor()
@@ -9,10 +9,15 @@ from sqlalchemy.exc import IntegrityError
 
 from app.repo.db import get_session
 from app.payments.manager import PaymentManager
-from app.payments.models import PaymentMethod
 from app.repo.models import TonTransaction
+from app.repo.payments import PaymentRepository
+from app.repo.user import UserRepository
+from app.locales.locales import get_translator
+from app.utils.instrumentation import count
+from app.utils.payment_notifications import send_payment_notification
 from app.utils.redis import get_redis
-from config import TON_ADDRESS, TONAPI_KEY, PAYMENT_TIMEOUT_MINUTES
+from app.utils.send_queue import send_queue, Priority
+from config import TON_ADDRESS, TONAPI_KEY, PAYMENT_TIMEOUT_MINUTES, ADMIN_TG_IDS, bot
 
 LOG = logging.getLogger(__name__)
 
@@ -24,6 +29,7 @@ class TonTransactionsUpdater:
 
     async def fetch_new_transactions(self, limit: int = 50):
         try:
+            count("http")
             result = await self.tonapi.blockchain.get_account_transactions(
                 account_id=self.ton_address,
                 limit=limit
@@ -93,15 +99,55 @@ class TonTransactionsUpdater:
                 await session.rollback()
 
     async def process_pending_payments(self):
+        """Match new transactions to pending TON payments and notify users and admins."""
+        redis_client = await get_redis()
         async with get_session() as session:
-            redis_client = await get_redis()
-            manager = PaymentManager(session, redis_client)
-            pendings = await manager.get_pending_payments(PaymentMethod.TON)
-            for payment in pendings:
-                try:
-                    await manager.check_payment(payment['id'])
-                except Exception as e:
-                    LOG.error(f"[TonTransactionsUpdater] check_payment error: {e}")
+            repo = PaymentRepository(session, redis_client)
+            try:
+                result = await repo.match_ton_transactions()
+            except Exception as e:
+                LOG.error(f"[TonTransactionsUpdater] match_ton_transactions error: {e}")
+                return
+
+        for item in result['confirmed']:
+            await send_payment_notification(
+                bot=bot,
+                tg_id=item['tg_id'],
+                amount=item['amount'],
+                lang=item['lang'] or "ru",
+                has_active_subscription=item['has_active_subscription']
+            )
+
+        if result['unmatched']:
+            await self.report_unmatched(result['unmatched'])
+
+    async def report_unmatched(self, unmatched):
+        """Send unmatched transactions (wrong comment, underpayment) to admins for manual review."""
+        for item in unmatched:
+            LOG.warning(
+                f"[TonTransactionsUpdater] unmatched tx {item['tx_hash']}: reason={item['reason']}, "
+                f"amount={item['amount']}, comment={item['comment']!r}, sender={item['sender']}"
+            )
+
+        texts = {}
+        redis_client = await get_redis()
+        async with get_session() as session:
+            user_repo = UserRepository(session, redis_client)
+            for admin_id in ADMIN_TG_IDS:
+                lang = await user_repo.get_lang(admin_id)
+                if lang not in texts:
+                    t = get_translator(lang)
+                    items = "\n".join(
+                        t('admin_ton_unmatched_item',
+                          amount=item['amount'],
+                          sender=item['sender'] or '-',
+                          comment=item['comment'] or '-',
+                          reason=item['reason'],
+                          tx_hash=item['tx_hash'])
+                        for item in unmatched[:20]
+                    )
+                    texts[lang] = t('admin_ton_unmatched', count=len(unmatched), items=items)
+                await send_queue.send_message(admin_id, texts[lang], priority=Priority.CRITICAL, wait=False)
 
     async def run_once(self):
         txs = await self.fetch_new_transactions()
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import re
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from aiogram import Bot
+from sqlalchemy import select
+
+from app.repo.db import get_session
+from app.repo.models import User
+from app.repo.usage import UsageRepository
+from app.repo.user import reachable_users
+from app.api.clients.marzban import MarzbanApiManager
+from app.api.helpers import ensure_utc, format_bytes
+from app.locales.locales import get_translator
+from app.utils.send_queue import send_queue, Priority
+from config import MARZBAN_BASE_URL, MARZBAN_USERNAME, MARZBAN_PASSWORD
+
+LOG = logging.getLogger(__name__)
+
+_USERNAME_RE = re.compile(r'^orbit_(\d+)$')
+
+
+class UsageSyncTask:
+    """
+    Syncs traffic usage (used_traffic, online_at, ...) from the panel into the bot database.
+
+    Panel users are read page by page in creation order, and each page is
+    stored with one multi-row upsert that only writes changed rows and adds
+    the traffic delta to the daily history. Memory stays bounded by the page
+    size regardless of the number of users. Users crossing the warning share
+    of their data limit get a notification.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        page_size: int = 1000,
+        warn_ratio: float = 0.9,
+        history_days: int = 90
+    ):
+        """
+        Args:
+            bot: Aiogram Bot instance for limit warnings
+            page_size: Panel users per request (and per upsert)
+            warn_ratio: Share of data_limit that triggers a warning
+            history_days: Days of daily history to keep
+        """
+        self.bot = bot
+        self.page_size = page_size
+        self.warn_ratio = warn_ratio
+        self.history_days = history_days
+
+    @staticmethod
+    def _parse_user(user: Dict) -> Optional[Dict]:
+        username = user.get("username")
+        if not username:
+            return None
+
+        match = _USERNAME_RE.match(username)
+        online_at = None
+        if user.get("online_at"):
+            try:
+                online_at = ensure_utc(user["online_at"]).replace(tzinfo=None)
+            except ValueError:
+                pass
+
+        return {
+            "username": username,
+            "tg_id": int(match.group(1)) if match else None,
+            "used_traffic": int(user.get("used_traffic") or 0),
+            "lifetime_used_traffic": int(user.get("lifetime_used_traffic") or 0),
+            "data_limit": user.get("data_limit"),
+            "status": user.get("status"),
+            "online_at": online_at,
+        }
+
+    def _crossed_limit(self, row: Dict) -> bool:
+        limit = row["data_limit"]
+        if not limit or row["tg_id"] is None:
+            return False
+        threshold = limit * self.warn_ratio
+        return row["prev_used_traffic"] < threshold <= row["used_traffic"]
+
+    async def _warn(self, rows: List[Dict]):
+        """Notify users who just crossed the warning threshold"""
+        async with get_session() as session:
+            result = await session.execute(
+                select(User.tg_id, User.lang, User.notifications)
+                .where(User.tg_id.in_([row["tg_id"] for row in rows]), reachable_users())
+            )
+            users = {r.tg_id: r for r in result.all()}
+
+        for row in rows:
+            user = users.get(row["tg_id"])
+            if not user or not user.notifications:
+                continue
+
+            t = get_translator(user.lang)
+            text = t('traffic_limit_warning',
+                     used=format_bytes(row["used_traffic"]),
+                     limit=format_bytes(row["data_limit"]))
+
+            await send_queue.send_message(row["tg_id"], text, priority=Priority.TRANSACTIONAL, wait=False)
+
+    async def run_once(self) -> Dict:
+        """Run a single sync over all panel users (errors propagate to the scheduler)"""
+        stats = {'pages': 0, 'scanned': 0, 'changed': 0, 'warned': 0}
+        started = time.monotonic()
+
+        try:
+            api = MarzbanApiManager(host=MARZBAN_BASE_URL)
+            token = await api.get_token(username=MARZBAN_USERNAME, password=MARZBAN_PASSWORD)
+            if not token:
+                raise RuntimeError("Failed to get access token for Marzban server")
+
+            now = datetime.utcnow()
+            offset = 0
+            while True:
+                page = await api.get_users_page(token.access_token, offset=offset, limit=self.page_size)
+                if not page:
+                    break
+
+                rows = [row for row in map(self._parse_user, page) if row]
+                async with get_session() as session:
+                    changed = await UsageRepository(session).upsert_page(rows, now=now)
+
+                stats['pages'] += 1
+                stats['scanned'] += len(page)
+                stats['changed'] += len(changed)
+
+                to_warn = [row for row in changed if self._crossed_limit(row)]
+                if to_warn:
+                    stats['warned'] += len(to_warn)
+                    await self._warn(to_warn)
+
+                if len(page) < self.page_size:
+                    break
+                offset += self.page_size
+
+            async with get_session() as session:
+                await UsageRepository(session).prune_history(keep_days=self.history_days)
+
+        finally:
+            stats['duration'] = round(time.monotonic() - started, 1)
+            LOG.info(f"Usage sync completed: {stats}")
+        return stats
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import multiprocessing
+import signal
+import time
+from typing import Callable, Dict, Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+
+from app.utils.update_executor import UpdateExecutor
+
+LOG = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """
+    aiohttp server that receives Telegram updates and feeds them to the dispatcher.
+
+    Each request is answered as soon as the update is accepted, and handled
+    in the background with dp.feed_webhook_update, so a slow handler never
+    holds Telegram's connection. Several worker processes bind the same port
+    (SO_REUSEPORT) and the kernel spreads connections from the reverse proxy
+    across them.
+    """
+
+    def __init__(
+        self,
+        dp: Dispatcher,
+        bot: Bot,
+        path: str,
+        secret: str = "",
+        host: str = "127.0.0.1",
+        port: int = 8081,
+        executor: Optional[UpdateExecutor] = None
+    ):
+        """
+        Args:
+            dp: Dispatcher with routers and middlewares
+            bot: Bot the updates belong to
+            path: URL path Telegram posts updates to
+            secret: Expected secret token header ('' disables the check)
+            host: Listen address
+            port: Listen port
+            executor: Update executor to ask for backpressure
+        """
+        self.dp = dp
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.host = host
+        self.port = port
+        self.executor = executor
+        self._runner: Optional[web.AppRunner] = None
+        self._handling: set = set()
+
+    async def _handle_update(self, request: web.Request) -> web.Response:
+        if self.secret and request.headers.get(SECRET_HEADER) != self.secret:
+            return web.Response(status=401)
+
+        # Too much queued already: Telegram keeps the update and redelivers it later
+        if self.executor and self.executor.overloaded:
+            return web.Response(status=503, headers={"Retry-After": "1"})
+
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        task = asyncio.create_task(self._feed(update))
+        self._handling.add(task)
+        task.add_done_callback(self._handling.discard)
+        return web.Response()
+
+    async def _feed(self, update: Dict):
+        try:
+            await self.dp.feed_webhook_update(self.bot, update)
+        except Exception as e:
+            LOG.error(f"Error handling update {update.get('update_id')}: {type(e).__name__}: {e}")
+
+    async def _health(self, request: web.Request) -> web.Response:
+        stats = {"status": "ok", "handling": len(self._handling)}
+        if self.executor:
+            stats["executor"] = self.executor.get_stats()
+        return web.json_response(stats)
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post(self.path, self._handle_update)
+        app.router.add_get("/health", self._health)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port, reuse_port=True).start()
+        LOG.info(f"Webhook server listening on {self.host}:{self.port}{self.path}")
+
+    async def stop(self, drain_timeout: float = 30.0):
+        """Stop accepting updates and let the ones being handled finish"""
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+        if self._handling:
+            LOG.info(f"Waiting for {len(self._handling)} updates in progress")
+            await asyncio.wait(list(self._handling), timeout=drain_timeout)
+
+
+async def wait_for_shutdown():
+    """Wait until the process gets SIGINT or SIGTERM"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+
+def run_workers(target: Callable[[int], None], workers: int, shutdown_timeout: float = 60.0):
+    """
+    Run `target(index)` in `workers` processes and restart any that die.
+
+    On SIGINT/SIGTERM the workers are asked to stop (SIGTERM) and given
+    shutdown_timeout seconds before they are killed.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    processes: Dict[int, multiprocessing.Process] = {}
+    stopping = False
+
+    def spawn(index: int):
+        process = ctx.Process(target=target, args=(index,), name=f"bot-worker-{index}")
+        process.start()
+        processes[index] = process
+        LOG.info(f"Started worker {index} (pid {process.pid})")
+
+    def request_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    for index in range(workers):
+        spawn(index)
+
+    while not stopping:
+        time.sleep(1)
+        for index, process in list(processes.items()):
+            if not process.is_alive() and not stopping:
+                LOG.error(f"Worker {index} exited with code {process.exitcode}, restarting")
+                spawn(index)
+
+    LOG.info("Stopping workers...")
+    for process in processes.values():
+        if process.is_alive():
+            process.terminate()
+
+    deadline = time.monotonic() + shutdown_timeout
+    for index, process in processes.items():
+        process.join(timeout=max(0.0, deadline - time.monotonic()))
+        if process.is_alive():
+            LOG.warning(f"Worker {index} did not stop in time, killing it")
+            process.kill()
+            process.join()
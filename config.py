@@ -92,10 +92,29 @@ DATABASE_URL = f"postgresql+asyncpg://{DATABASE_USER}:{DATABASE_PASSWORD}@{DATAB
 # --- Redis Configuration ---
 REDIS_URL: Final[str] = os.getenv("REDIS_URL", "redis://localhost")
 REDIS_TTL: Final[int] = 300  # Cache TTL in seconds (5 minutes)
+FSM_TTL_SECONDS: Final[int] = _get_env_int("FSM_TTL_SECONDS", 86400)  # Abandoned FSM flows expire after this
+QR_CACHE_BYTES: Final[int] = _get_env_int("QR_CACHE_BYTES", 16 * 1024 * 1024)  # Rendered QR PNGs kept per process
 
 # --- Server Configuration ---
 PORT: Final[int] = _get_env_int("PORT", 5000)
 
+# --- Telegram Transport Configuration ---
+BOT_MODE: Final[str] = os.getenv("BOT_MODE", "polling").lower()  # "polling" (development) or "webhook"
+WEBHOOK_BASE_URL: Final[str] = os.getenv("WEBHOOK_BASE_URL", "")  # Public https URL of the reverse proxy
+WEBHOOK_PATH: Final[str] = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET: Final[str] = os.getenv("WEBHOOK_SECRET", "")  # Checked against X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_HOST: Final[str] = os.getenv("WEBHOOK_HOST", "127.0.0.1")  # Workers listen here, behind the proxy
+WEBHOOK_PORT: Final[int] = _get_env_int("WEBHOOK_PORT", 8081)  # Shared by all workers (SO_REUSEPORT)
+WEBHOOK_WORKERS: Final[int] = _get_env_int("WEBHOOK_WORKERS", 4)  # Worker processes
+UPDATE_CONCURRENCY: Final[int] = _get_env_int("UPDATE_CONCURRENCY", 64)  # Handlers running at once per process
+UPDATE_MAX_PENDING: Final[int] = _get_env_int("UPDATE_MAX_PENDING", 1000)  # Waiting updates before pushing back
+SLOW_UPDATE_SECONDS: Final[float] = _get_env_float("SLOW_UPDATE_SECONDS", 1.0)  # Updates slower than this are logged
+
+if BOT_MODE not in ("polling", "webhook"):
+    raise ConfigurationError(f"BOT_MODE must be 'polling' or 'webhook', got '{BOT_MODE}'")
+if BOT_MODE == "webhook" and not WEBHOOK_BASE_URL:
+    raise ConfigurationError("WEBHOOK_BASE_URL is required when BOT_MODE=webhook")
+
 # --- Marzban VPN Panel Configuration ---
 MARZBAN_USERNAME: Final[str] = _get_required_env("MARZBAN_USERNAME")
 MARZBAN_PASSWORD: Final[str] = _get_required_env("MARZBAN_PASSWORD")
@@ -132,10 +151,21 @@ YOOKASSA_TESTNET: Final[bool] = os.getenv("YOOKASSA_TESTNET", "false").lower() =
 PAYMENT_TIMEOUT_MINUTES: Final[int] = 60  # Auto-expire pending payments after 60 minutes (1 hour)
 TELEGRAM_STARS_RATE: Final[float] = 1.35  # Stars to RUB conversion
 
+# --- Exchange Rate Configuration ---
+RATES_REFRESH_SECONDS: Final[int] = _get_env_int("RATES_REFRESH_SECONDS", 60)  # Background refresh period
+RATES_MAX_STALENESS_SECONDS: Final[int] = _get_env_int("RATES_MAX_STALENESS_SECONDS", 900)  # Oldest rate still served
+
+# --- Notification Configuration ---
+TELEGRAM_SEND_RATE: Final[int] = _get_env_int("TELEGRAM_SEND_RATE", 25)  # Global outgoing messages per second
+NOTIFICATION_SENDERS: Final[int] = _get_env_int("NOTIFICATION_SENDERS", 8)  # Concurrent notification senders
+BROADCAST_WORKERS: Final[int] = _get_env_int("BROADCAST_WORKERS", 8)  # Concurrent senders per broadcast job
+DELIVERY_MAX_FAILURES: Final[int] = _get_env_int("DELIVERY_MAX_FAILURES", 5)  # Consecutive failures before a chat is skipped
+
 # --- Business Logic Constants ---
 FREE_TRIAL_DAYS: Final[int] = 3
 REFERRAL_BONUS: Final[float] = 50.0
 MAX_IPS_PER_CONFIG: Final[int] = _get_env_int("MAX_IPS_PER_CONFIG", 2)
+CONFIG_RETENTION_DAYS: Final[int] = 14  # Configs are removed this long after the subscription expires
 
 MIN_PAYMENT_AMOUNT: Final[int] = 200
 MAX_PAYMENT_AMOUNT: Final[int] = 100000
@@ -74,8 +74,10 @@ class MetricsConfig:
     """Metrics configuration"""
     prometheus_export: bool = False
     prometheus_port: int = 9090
+    prometheus_host: str = "127.0.0.1"  # The endpoint has no auth; expose it deliberately
     retention_days: int = 7
     collect_interval: int = 10  # seconds
+    data_dir: str = "data/metrics"  # Memory-mapped history, one file per service
 
 
 @dataclass
@@ -181,7 +183,10 @@ class ManagerConfig:
                 },
                 'metrics': {
                     'prometheus_export': self.metrics.prometheus_export,
+                    'prometheus_port': self.metrics.prometheus_port,
+                    'prometheus_host': self.metrics.prometheus_host,
                     'retention_days': self.metrics.retention_days,
+                    'data_dir': self.metrics.data_dir,
                 },
             },
             'logging': {
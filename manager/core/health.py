@@ -1,7 +1,7 @@
 """Health checking system"""
 import asyncio
 import time
-from typing import Dict, List, Callable, Awaitable
+from typing import Dict, List, Callable, Awaitable, Optional
 from datetime import datetime, timedelta
 
 from manager.core.models import HealthStatus, HealthCheckResult, Alert, AlertLevel
@@ -41,38 +41,67 @@ class HealthChecker:
         """Register callback for health alerts."""
         self._alert_callbacks.append(callback)
 
-    async def check_service(self, service_name: str) -> HealthCheckResult:
-        """Perform health check for a specific service."""
+    async def check_service(
+        self,
+        service_name: str,
+        timeout: Optional[float] = None,
+        retries: int = 1
+    ) -> HealthCheckResult:
+        """
+        Perform health check for a specific service.
+
+        Args:
+            service_name: Registered service
+            timeout: Seconds one attempt may take (None: no limit)
+            retries: Attempts before an unhealthy result is reported
+        """
         if service_name not in self._checks:
             return HealthCheckResult(
                 status=HealthStatus.UNKNOWN,
                 message=f"No health check registered for {service_name}"
             )
 
-        start_time = time.time()
-        try:
-            result = await self._checks[service_name]()
-            result.response_time_ms = (time.time() - start_time) * 1000
+        attempts = max(1, retries)
+        for attempt in range(1, attempts + 1):
+            result = await self._run_check(service_name, timeout)
+            if result.status != HealthStatus.UNHEALTHY or attempt == attempts:
+                break
+            LOG.debug(f"Health check of {service_name} failed (attempt {attempt}/{attempts}): {result.message}")
+            await asyncio.sleep(min(attempt, 5))
 
-            # Store result
-            old_result = self._last_results.get(service_name)
-            self._last_results[service_name] = result
+        # Store result
+        old_result = self._last_results.get(service_name)
+        self._last_results[service_name] = result
 
-            # Check if status changed and trigger alerts
-            if old_result and old_result.status != result.status:
-                await self._handle_status_change(service_name, old_result, result)
+        # Check if status changed and trigger alerts
+        if old_result and old_result.status != result.status:
+            await self._handle_status_change(service_name, old_result, result)
 
+        return result
+
+    async def _run_check(self, service_name: str, timeout: Optional[float]) -> HealthCheckResult:
+        """One attempt; timeouts and errors become unhealthy results."""
+        start_time = time.time()
+        try:
+            result = await asyncio.wait_for(self._checks[service_name](), timeout=timeout)
+            result.response_time_ms = (time.time() - start_time) * 1000
             return result
 
+        except asyncio.TimeoutError:
+            LOG.warning(f"Health check timed out for {service_name} after {timeout}s")
+            return HealthCheckResult(
+                status=HealthStatus.UNHEALTHY,
+                message=f"Health check timed out after {timeout}s",
+                response_time_ms=(time.time() - start_time) * 1000
+            )
+
         except Exception as e:
             LOG.error(f"Health check failed for {service_name}: {e}")
-            result = HealthCheckResult(
+            return HealthCheckResult(
                 status=HealthStatus.UNHEALTHY,
                 message=f"Health check error: {str(e)}",
                 response_time_ms=(time.time() - start_time) * 1000
             )
-            self._last_results[service_name] = result
-            return result
 
     async def check_all(self) -> Dict[str, HealthCheckResult]:
         """Perform health checks on all registered services."""
@@ -169,6 +198,10 @@ class HealthChecker:
             )
         )
 
+    def get_all_results(self) -> Dict[str, HealthCheckResult]:
+        """Get last health check results of all services (no new checks)."""
+        return dict(self._last_results)
+
     def get_overall_health(self) -> HealthStatus:
         """Get overall system health based on all services."""
         if not self._last_results:
@@ -1,59 +1,127 @@
 """Metrics collection system"""
-import asyncio
+import os
+import time
 import psutil
 from typing import Dict, List, Optional
-from datetime import datetime, timedelta
-from collections import defaultdict, deque
+from datetime import datetime
 
 from manager.core.models import ServiceMetrics
+from manager.core.timeseries import SeriesFile, default_tiers
 from manager.utils.logger import get_logger
 
 LOG = get_logger(__name__)
 
 
 class MetricsCollector:
-    """Collects and stores metrics for services"""
-
-    def __init__(self, retention_hours: int = 24):
+    """
+    Collects and stores metrics for services.
+
+    History lives in one memory-mapped SeriesFile per service under
+    `data_dir`: raw samples, 1-minute and 15-minute buckets, the last tier
+    covering the whole retention. It survives manager restarts and is
+    readable from the CLI while the daemon writes it; only recording and
+    clearing open a file for writing. Custom metrics are kept for the
+    latest sample only.
+    """
+
+    def __init__(self, retention_hours: int = 24, interval: int = 10, data_dir: str = "data/metrics"):
         self._retention_hours = retention_hours
-        self._metrics_history: Dict[str, deque] = defaultdict(
-            lambda: deque(maxlen=1000)  # Keep last 1000 data points
-        )
+        self._tiers = default_tiers(interval, retention_hours)
+        self._data_dir = data_dir
+        self._series: Dict[str, SeriesFile] = {}
+        self._latest: Dict[str, ServiceMetrics] = {}
         self._process_cache: Dict[str, psutil.Process] = {}
+        os.makedirs(data_dir, exist_ok=True)
+
+    def _get_series(self, service_name: str, writable: bool = False) -> Optional[SeriesFile]:
+        """
+        The service's series, or None if there is none to read.
+
+        Reads map existing files read-only and skip ones with another layout;
+        only writes (the daemon) create files or start them over.
+        """
+        series = self._series.get(service_name)
+        if series is not None and (series.writable or not writable):
+            return series
+        path = os.path.join(self._data_dir, f"{service_name}.tsdb")
+        if not writable and not os.path.exists(path):
+            return None
+        if series is not None:
+            series.close()
+            del self._series[service_name]
+        try:
+            series = SeriesFile(path, self._tiers, writable=writable)
+        except ValueError as e:
+            LOG.warning(f"Skipping metrics of {service_name}: {e}")
+            return None
+        self._series[service_name] = series
+        return series
+
+    def _known_services(self) -> List[str]:
+        names = set(self._series)
+        for filename in os.listdir(self._data_dir):
+            if filename.endswith(".tsdb"):
+                names.add(filename[:-len(".tsdb")])
+        return sorted(names)
+
+    @staticmethod
+    def _from_bucket(bucket: Dict[str, float]) -> ServiceMetrics:
+        n = bucket["n"] or 1
+        return ServiceMetrics(
+            timestamp=datetime.fromtimestamp(bucket["ts"]),
+            cpu_percent=bucket["cpu"] / n,
+            memory_mb=bucket["mem"] / n,
+            memory_percent=bucket["mem_pct"] / n,
+            uptime_seconds=int(bucket["uptime"]),
+            restart_count=int(bucket["restarts"]),
+        )
 
     def record_metrics(self, service_name: str, metrics: ServiceMetrics):
         """Record metrics for a service."""
-        self._metrics_history[service_name].append(metrics)
-        self._cleanup_old_metrics(service_name)
+        self._latest[service_name] = metrics
+        self._get_series(service_name, writable=True).append(
+            metrics.timestamp.timestamp(),
+            metrics.cpu_percent,
+            metrics.memory_mb,
+            metrics.memory_percent,
+            metrics.uptime_seconds,
+            metrics.restart_count,
+        )
 
     def get_latest_metrics(self, service_name: str) -> Optional[ServiceMetrics]:
         """Get the most recent metrics for a service."""
-        history = self._metrics_history.get(service_name)
-        if history:
-            return history[-1]
-        return None
+        latest = self._latest.get(service_name)
+        if latest is not None:
+            return latest
+        # Nothing recorded by this process: last stored sample
+        series = self._get_series(service_name)
+        bucket = series.latest() if series else None
+        return self._from_bucket(bucket) if bucket else None
 
     def get_metrics_history(
         self,
         service_name: str,
         hours: int = 1
     ) -> List[ServiceMetrics]:
-        """Get metrics history for the specified time period."""
-        history = self._metrics_history.get(service_name, deque())
-        cutoff = datetime.now() - timedelta(hours=hours)
+        """
+        Get metrics history for the specified time period.
 
-        return [
-            m for m in history
-            if m.timestamp >= cutoff
-        ]
+        Points come from the finest tier covering the period, averaged per bucket.
+        """
+        series = self._get_series(service_name)
+        if series is None:
+            return []
+        now = time.time()
+        return [self._from_bucket(b) for b in series.buckets(now - hours * 3600, now)]
 
     def get_all_latest_metrics(self) -> Dict[str, ServiceMetrics]:
         """Get latest metrics for all services."""
-        return {
-            service: history[-1]
-            for service, history in self._metrics_history.items()
-            if history
-        }
+        result = {}
+        for service in self._known_services():
+            latest = self.get_latest_metrics(service)
+            if latest is not None:
+                result[service] = latest
+        return result
 
     async def collect_process_metrics(
         self,
@@ -89,44 +157,31 @@ class MetricsCollector:
 
         return metrics
 
-    def _cleanup_old_metrics(self, service_name: str):
-        """Remove metrics older than retention period."""
-        history = self._metrics_history[service_name]
-        cutoff = datetime.now() - timedelta(hours=self._retention_hours)
-
-        # Remove old entries from the left
-        while history and history[0].timestamp < cutoff:
-            history.popleft()
-
     def get_aggregated_metrics(
         self,
         service_name: str,
         hours: int = 1
     ) -> Dict[str, float]:
         """Get aggregated metrics (avg, min, max) for a time period."""
-        history = self.get_metrics_history(service_name, hours)
-
-        if not history:
+        series = self._get_series(service_name)
+        if series is None:
             return {}
-
-        cpu_values = [m.cpu_percent for m in history]
-        mem_values = [m.memory_mb for m in history]
-
-        return {
-            "cpu_avg": sum(cpu_values) / len(cpu_values),
-            "cpu_max": max(cpu_values),
-            "cpu_min": min(cpu_values),
-            "memory_avg": sum(mem_values) / len(mem_values),
-            "memory_max": max(mem_values),
-            "memory_min": min(mem_values),
-            "samples_count": len(history)
-        }
+        now = time.time()
+        return series.aggregate(now - hours * 3600, now)
 
     def clear_metrics(self, service_name: Optional[str] = None):
         """Clear metrics history for a service or all services."""
-        if service_name:
-            if service_name in self._metrics_history:
-                self._metrics_history[service_name].clear()
-        else:
-            self._metrics_history.clear()
+        names = [service_name] if service_name else self._known_services()
+        for name in names:
+            # Existing files only; clearing is a write
+            if self._get_series(name):
+                self._get_series(name, writable=True).clear()
+            self._latest.pop(name, None)
+        if not service_name:
             self._process_cache.clear()
+
+    def close(self):
+        """Write the mapped files out and unmap them."""
+        for series in self._series.values():
+            series.close()
+        self._series.clear()
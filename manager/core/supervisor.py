@@ -13,7 +13,8 @@ from manager.core.models import (
     Alert,
     AlertLevel
 )
-from manager.config.manager_config import ManagerConfig
+from manager.config.manager_config import ManagerConfig, ServiceConfig
+from manager.monitoring.prometheus import PrometheusExporter
 from manager.utils.logger import get_logger
 
 LOG = get_logger(__name__)
@@ -36,9 +37,19 @@ class ServiceSupervisor:
         self._services: Dict[str, ManagedService] = {}
         self._health_checker = HealthChecker()
         self._metrics_collector = MetricsCollector(
-            retention_hours=config.metrics.retention_days * 24
+            retention_hours=config.metrics.retention_days * 24,
+            interval=config.metrics.collect_interval,
+            data_dir=config.metrics.data_dir
         )
-        self._monitoring_task: Optional[asyncio.Task] = None
+        self._exporter: Optional[PrometheusExporter] = None
+        if config.metrics.prometheus_export:
+            self._exporter = PrometheusExporter(
+                self,
+                host=config.metrics.prometheus_host,
+                port=config.metrics.prometheus_port
+            )
+        self._monitoring_tasks: List[asyncio.Task] = []
+        self._restart_tasks: Dict[str, asyncio.Task] = {}
         self._is_running = False
         self._restart_counts: Dict[str, int] = {}
         self._alert_callbacks = []
@@ -204,14 +215,31 @@ class ServiceSupervisor:
         }
 
     async def start_monitoring(self):
-        """Start background monitoring tasks."""
+        """
+        Start background monitoring tasks.
+
+        Each service gets its own health check loop with its configured
+        interval, timeout and retries, so a hung check delays only that
+        service. Metrics of all services are collected concurrently every
+        collect_interval, and restarts run as separate tasks.
+        """
         if self._is_running:
             LOG.warning("Monitoring already running")
             return
 
         self._is_running = True
-        self._monitoring_task = asyncio.create_task(self._monitoring_loop())
-        LOG.info("Started monitoring")
+        if self._exporter:
+            try:
+                await self._exporter.start()
+            except OSError as e:
+                LOG.error(f"Could not start Prometheus exporter: {e}")
+
+        self._monitoring_tasks = [
+            asyncio.create_task(self._health_loop(name), name=f"health:{name}")
+            for name in self._services
+        ]
+        self._monitoring_tasks.append(asyncio.create_task(self._metrics_loop(), name="metrics"))
+        LOG.info(f"Started monitoring of {len(self._services)} services")
 
     async def stop_monitoring(self):
         """Stop background monitoring."""
@@ -220,105 +248,131 @@ class ServiceSupervisor:
 
         self._is_running = False
 
-        if self._monitoring_task:
-            self._monitoring_task.cancel()
-            try:
-                await self._monitoring_task
-            except asyncio.CancelledError:
-                pass
+        tasks = self._monitoring_tasks + list(self._restart_tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._monitoring_tasks = []
+        self._restart_tasks.clear()
 
+        if self._exporter:
+            await self._exporter.stop()
+        self._metrics_collector.close()
         LOG.info("Stopped monitoring")
 
-    async def _monitoring_loop(self):
-        """Main monitoring loop."""
+    def _service_config(self, service_name: str) -> ServiceConfig:
+        """Scheduling and restart settings of a service (defaults if it has none)."""
+        config = getattr(self._services.get(service_name), "config", None)
+        return config if isinstance(config, ServiceConfig) else ServiceConfig()
+
+    async def _health_loop(self, service_name: str):
+        """Health checks of one service on its own interval."""
+        config = self._service_config(service_name)
         while self._is_running:
             try:
-                # Perform health checks
-                health_results = await self._health_checker.check_all()
-
-                # Collect metrics
-                for service_name, service in self._services.items():
-                    try:
-                        metrics = await service.get_metrics()
-                        self._metrics_collector.record_metrics(
-                            service_name,
-                            metrics
-                        )
-                    except Exception as e:
-                        LOG.error(f"Failed to collect metrics for {service_name}: {e}")
-
-                # Check for services that need restart
-                await self._check_restart_policies(health_results)
-
-                # Wait before next check
-                await asyncio.sleep(self.config.metrics.collect_interval)
-
+                result = await self._health_checker.check_service(
+                    service_name,
+                    timeout=config.health_check_timeout,
+                    retries=config.health_check_retries
+                )
+                await self._check_restart_policy(service_name, result)
             except asyncio.CancelledError:
-                break
+                raise
             except Exception as e:
-                LOG.error(f"Error in monitoring loop: {e}")
-                await asyncio.sleep(10)
-
-    async def _check_restart_policies(self, health_results):
-        """Check services that need automatic restart."""
-        for service_name, health_result in health_results.items():
-            if service_name not in self._services:
-                continue
-
-            service = self._services[service_name]
-            status = await service.get_status()
-
-            # Get restart policy from config
-            restart_policy = "always"  # Default
-            if service_name == "telegram_bot":
-                restart_policy = self.config.telegram_bot.restart_policy
-
-            # Check if service should be restarted
-            should_restart = False
-
-            if restart_policy == "always":
-                should_restart = (
-                    status == ServiceStatus.FAILED or
-                    health_result.status == HealthStatus.UNHEALTHY
-                )
-            elif restart_policy == "on-failure":
-                should_restart = status == ServiceStatus.FAILED
-
-            if should_restart:
-                restart_count = self._restart_counts.get(service_name, 0)
-                max_restarts = 5  # Default
-
-                if service_name == "telegram_bot":
-                    max_restarts = self.config.telegram_bot.max_restarts
-
-                if restart_count < max_restarts:
-                    LOG.warning(
-                        f"Auto-restarting {service_name} "
-                        f"(attempt {restart_count + 1}/{max_restarts})"
-                    )
-
-                    await asyncio.sleep(
-                        self.config.telegram_bot.restart_delay
-                    )
-                    await self.restart_service(service_name)
-
-                else:
-                    LOG.error(
-                        f"Service {service_name} exceeded max restart attempts "
-                        f"({max_restarts})"
-                    )
-
-                    # Send critical alert
-                    await self._send_alert(Alert(
-                        level=AlertLevel.CRITICAL,
-                        service=service_name,
-                        message=f"Service failed and exceeded max restart attempts ({max_restarts})",
-                        details={
-                            "restart_count": restart_count,
-                            "max_restarts": max_restarts,
-                            "health_status": health_result.status.value
-                        }
-                    ))
+                LOG.error(f"Error monitoring {service_name}: {e}")
+
+            await asyncio.sleep(config.health_check_interval)
+
+    async def _collect_metrics(self, service_name: str):
+        service = self._services[service_name]
+        timeout = self._service_config(service_name).health_check_timeout
+        try:
+            metrics = await asyncio.wait_for(service.get_metrics(), timeout=timeout)
+            self._metrics_collector.record_metrics(service_name, metrics)
+        except asyncio.TimeoutError:
+            LOG.warning(f"Metrics collection for {service_name} timed out after {timeout}s")
+        except Exception as e:
+            LOG.error(f"Failed to collect metrics for {service_name}: {e}")
+
+    async def _metrics_loop(self):
+        """Collect metrics of all services at once, every collect_interval."""
+        interval = self.config.metrics.collect_interval
+        loop = asyncio.get_running_loop()
+        while self._is_running:
+            started = loop.time()
+            await asyncio.gather(*(self._collect_metrics(name) for name in list(self._services)))
+
+            # Scrapes are served from this snapshot
+            if self._exporter:
+                try:
+                    await self._exporter.refresh()
+                except Exception as e:
+                    LOG.error(f"Failed to refresh Prometheus metrics: {e}")
+
+            await asyncio.sleep(max(0.0, interval - (loop.time() - started)))
+
+    async def _check_restart_policy(self, service_name: str, health_result):
+        """Schedule an automatic restart of the service if its policy asks for one."""
+        if service_name not in self._services:
+            return
+
+        restart_task = self._restart_tasks.get(service_name)
+        if restart_task and not restart_task.done():
+            return  # Already restarting
+
+        service = self._services[service_name]
+        status = await service.get_status()
+        config = self._service_config(service_name)
+
+        # Check if service should be restarted
+        should_restart = False
+
+        if config.restart_policy == "always":
+            should_restart = (
+                status == ServiceStatus.FAILED or
+                health_result.status == HealthStatus.UNHEALTHY
+            )
+        elif config.restart_policy == "on-failure":
+            should_restart = status == ServiceStatus.FAILED
+
+        if not should_restart:
+            return
+
+        restart_count = self._restart_counts.get(service_name, 0)
+        max_restarts = config.max_restarts
+
+        if restart_count < max_restarts:
+            LOG.warning(
+                f"Auto-restarting {service_name} in {config.restart_delay}s "
+                f"(attempt {restart_count + 1}/{max_restarts})"
+            )
+            self._restart_tasks[service_name] = asyncio.create_task(
+                self._delayed_restart(service_name, config.restart_delay),
+                name=f"restart:{service_name}"
+            )
+
+        else:
+            LOG.error(
+                f"Service {service_name} exceeded max restart attempts "
+                f"({max_restarts})"
+            )
+
+            # Send critical alert
+            await self._send_alert(Alert(
+                level=AlertLevel.CRITICAL,
+                service=service_name,
+                message=f"Service failed and exceeded max restart attempts ({max_restarts})",
+                details={
+                    "restart_count": restart_count,
+                    "max_restarts": max_restarts,
+                    "health_status": health_result.status.value
+                }
+            ))
+
+    async def _delayed_restart(self, service_name: str, delay: int):
+        """Restart a service after its restart delay, without holding up monitoring."""
+        await asyncio.sleep(delay)
+        await self.restart_service(service_name)
 
     async def _send_alert(self, alert: Alert):
         """Send alert to all registered callbacks."""
@@ -0,0 +1,309 @@
+"""Columnar ring-buffer time series persisted in memory-mapped files"""
+import math
+import mmap
+import os
+import struct
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from manager.utils.logger import get_logger
+
+LOG = get_logger(__name__)
+
+MAGIC = b"OVTS0001"
+
+# Per-bucket columns, each a contiguous array of doubles.
+#   n                   samples in the bucket (0 for gaps)
+#   cpu, mem, mem_pct   sums over the bucket (avg = sum / n)
+#   *_min, *_max        extremes over the bucket
+#   uptime, restarts    last value seen
+#   cum_*               running totals up to and including the bucket, so a
+#                       window sum is one subtraction
+COLUMNS: Tuple[str, ...] = (
+    "ts", "n",
+    "cpu", "cpu_min", "cpu_max",
+    "mem", "mem_min", "mem_max",
+    "mem_pct", "uptime", "restarts",
+    "cum_n", "cum_cpu", "cum_mem",
+)
+_COL = {name: index for index, name in enumerate(COLUMNS)}
+
+# Header: magic, then per tier (step, capacity, last bucket) as int64
+_HEADER = struct.Struct("<8sq")
+_TIER = struct.Struct("<qqq")
+_MAX_TIERS = 8
+_HEADER_SIZE = _HEADER.size + _MAX_TIERS * _TIER.size
+
+
+@dataclass(frozen=True)
+class Tier:
+    """Buckets of `step` seconds, `capacity` of them kept"""
+    step: int
+    capacity: int
+
+    @property
+    def span(self) -> int:
+        return self.step * self.capacity
+
+
+def default_tiers(interval: int, retention_hours: int) -> List[Tier]:
+    """Raw samples for 6 hours, 1-minute buckets for 2 days, 15-minute buckets for the retention"""
+    interval = max(1, interval)
+    return [
+        Tier(interval, math.ceil(6 * 3600 / interval)),
+        Tier(60, 2 * 24 * 60),
+        Tier(900, max(1, math.ceil(retention_hours * 3600 / 900))),
+    ]
+
+
+class _TierView:
+    """Columns of one tier inside the mapped file"""
+
+    def __init__(self, buffer: memoryview, index: int, tier: Tier, offset: int):
+        self.index = index
+        self.tier = tier
+        size = tier.capacity * 8
+        self.cols = [
+            buffer[offset + i * size: offset + (i + 1) * size].cast("d")
+            for i in range(len(COLUMNS))
+        ]
+
+    @property
+    def nbytes(self) -> int:
+        return self.tier.capacity * 8 * len(COLUMNS)
+
+    def release(self):
+        for col in self.cols:
+            col.release()
+
+
+class SeriesFile:
+    """
+    Metrics of one service: one ring per tier, one array per column.
+
+    Every sample is added to the current bucket of every tier, so
+    downsampling needs no separate pass. Buckets are addressed by time
+    (bucket number modulo capacity) and skipped buckets are written as empty
+    ones carrying the running totals, so the sum and count of any window are
+    read from its two end buckets.
+
+    Only the writer (`writable`, the daemon) creates files. A file with
+    another layout is moved aside to `<path>.<unix time>.old` by the writer
+    and started over; a reader refuses it with ValueError.
+    """
+
+    def __init__(self, path: str, tiers: Sequence[Tier], writable: bool = True):
+        if len(tiers) > _MAX_TIERS:
+            raise ValueError(f"At most {_MAX_TIERS} tiers are supported")
+        self.path = path
+        self.tiers = list(tiers)
+        self.writable = writable
+        size = _HEADER_SIZE + sum(t.capacity * 8 * len(COLUMNS) for t in self.tiers)
+
+        fresh = not self._matches(path, size)
+        if not writable:
+            if fresh:
+                raise ValueError(f"Metrics file {path} is missing or has another layout")
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                self._mm = mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+            finally:
+                os.close(fd)
+        else:
+            if fresh and os.path.exists(path):
+                aside = f"{path}.{int(time.time())}.old"
+                os.replace(path, aside)
+                LOG.warning(f"Metrics file {path} has another layout, moved to {aside} and starting over")
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if fresh:
+                    os.ftruncate(fd, size)
+                self._mm = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+
+        self._buffer = memoryview(self._mm)
+        self._views: List[_TierView] = []
+        offset = _HEADER_SIZE
+        for index, tier in enumerate(self.tiers):
+            view = _TierView(self._buffer, index, tier, offset)
+            self._views.append(view)
+            offset += view.nbytes
+
+        if fresh:
+            _HEADER.pack_into(self._mm, 0, MAGIC, len(self.tiers))
+            for index, tier in enumerate(self.tiers):
+                _TIER.pack_into(self._mm, _HEADER.size + index * _TIER.size, tier.step, tier.capacity, -1)
+
+    def _matches(self, path: str, size: int) -> bool:
+        """Whether an existing file has this layout"""
+        if not os.path.exists(path) or os.path.getsize(path) != size:
+            return False
+        with open(path, "rb") as f:
+            header = f.read(_HEADER_SIZE)
+        magic, count = _HEADER.unpack_from(header, 0)
+        if magic != MAGIC or count != len(self.tiers):
+            return False
+        for index, tier in enumerate(self.tiers):
+            step, capacity, _ = _TIER.unpack_from(header, _HEADER.size + index * _TIER.size)
+            if (step, capacity) != (tier.step, tier.capacity):
+                return False
+        return True
+
+    def _last(self, index: int) -> int:
+        return _TIER.unpack_from(self._mm, _HEADER.size + index * _TIER.size)[2]
+
+    def _set_last(self, index: int, bucket: int):
+        struct.pack_into("<q", self._mm, _HEADER.size + index * _TIER.size + 16, bucket)
+
+    # ----------------------------
+    # Writing
+    # ----------------------------
+
+    def _advance(self, view: _TierView, bucket: int) -> bool:
+        """Make `bucket` the current bucket, writing empty buckets over any gap"""
+        last = self._last(view.index)
+        if bucket <= last:
+            return bucket == last  # Older than the current bucket: dropped
+        cap = view.tier.capacity
+        cols = view.cols
+        if last < 0:
+            carried = (0.0, 0.0, 0.0)
+        else:
+            slot = last % cap
+            carried = (cols[_COL["cum_n"]][slot], cols[_COL["cum_cpu"]][slot], cols[_COL["cum_mem"]][slot])
+
+        for b in range(max(last + 1, bucket - cap + 1), bucket + 1):
+            slot = b % cap
+            for col in cols:
+                col[slot] = 0.0
+            cols[_COL["ts"]][slot] = float(b * view.tier.step)
+            cols[_COL["cum_n"]][slot], cols[_COL["cum_cpu"]][slot], cols[_COL["cum_mem"]][slot] = carried
+        self._set_last(view.index, bucket)
+        return True
+
+    def append(self, ts: float, cpu: float, mem: float, mem_pct: float, uptime: float, restarts: float):
+        for view in self._views:
+            bucket = int(ts // view.tier.step)
+            if not self._advance(view, bucket):
+                continue
+            slot = bucket % view.tier.capacity
+            c = view.cols
+            first = c[_COL["n"]][slot] == 0
+            c[_COL["n"]][slot] += 1
+            c[_COL["cpu"]][slot] += cpu
+            c[_COL["mem"]][slot] += mem
+            c[_COL["mem_pct"]][slot] += mem_pct
+            c[_COL["cpu_min"]][slot] = cpu if first else min(c[_COL["cpu_min"]][slot], cpu)
+            c[_COL["cpu_max"]][slot] = cpu if first else max(c[_COL["cpu_max"]][slot], cpu)
+            c[_COL["mem_min"]][slot] = mem if first else min(c[_COL["mem_min"]][slot], mem)
+            c[_COL["mem_max"]][slot] = mem if first else max(c[_COL["mem_max"]][slot], mem)
+            c[_COL["uptime"]][slot] = uptime
+            c[_COL["restarts"]][slot] = restarts
+            c[_COL["cum_n"]][slot] += 1
+            c[_COL["cum_cpu"]][slot] += cpu
+            c[_COL["cum_mem"]][slot] += mem
+
+    # ----------------------------
+    # Reading
+    # ----------------------------
+
+    def _view_for(self, seconds: float) -> _TierView:
+        """Finest tier that still covers the window"""
+        for view in self._views:
+            if view.tier.span >= seconds:
+                return view
+        return self._views[-1]
+
+    def _bucket_range(self, view: _TierView, start: float, end: float) -> Tuple[int, int]:
+        """First and last stored buckets inside [start, end]"""
+        last = self._last(view.index)
+        first_kept = last - view.tier.capacity + 1
+        return max(int(start // view.tier.step), first_kept, 0), min(int(end // view.tier.step), last)
+
+    def buckets(self, start: float, end: float) -> Iterator[Dict[str, float]]:
+        """Non-empty buckets of the finest tier covering [start, end], oldest first"""
+        view = self._view_for(end - start)
+        first, last = self._bucket_range(view, start, end)
+        cap = view.tier.capacity
+        for b in range(first, last + 1):
+            slot = b % cap
+            n = view.cols[_COL["n"]][slot]
+            if n:
+                yield {name: view.cols[i][slot] for i, name in enumerate(COLUMNS)}
+
+    def latest(self) -> Optional[Dict[str, float]]:
+        view = self._views[0]
+        last = self._last(0)
+        if last < 0:
+            return None
+        slot = last % view.tier.capacity
+        if not view.cols[_COL["n"]][slot]:
+            return None
+        return {name: view.cols[i][slot] for i, name in enumerate(COLUMNS)}
+
+    def aggregate(self, start: float, end: float) -> Dict[str, float]:
+        """
+        Count, averages and extremes over [start, end].
+
+        Count and averages come from the running totals at the two end
+        buckets, in constant time. Extremes scan every bucket of the finest
+        covering tier, so they are linear in the window (a 24h window reads
+        the 1440 buckets of the 1-minute tier).
+        """
+        view = self._view_for(end - start)
+        first, last = self._bucket_range(view, start, end)
+        if first > last:
+            return {}
+        cap = view.tier.capacity
+        c = view.cols
+        head, tail = first % cap, last % cap
+
+        def window_sum(own: str, running: str) -> float:
+            # Running total at the last bucket minus the one just before the first
+            return c[_COL[running]][tail] - (c[_COL[running]][head] - c[_COL[own]][head])
+
+        n = window_sum("n", "cum_n")
+        if n <= 0:
+            return {}
+        cpu_sum = window_sum("cpu", "cum_cpu")
+        mem_sum = window_sum("mem", "cum_mem")
+
+        cpu_min = mem_min = math.inf
+        cpu_max = mem_max = -math.inf
+        for b in range(first, last + 1):
+            slot = b % cap
+            if c[_COL["n"]][slot]:
+                cpu_min = min(cpu_min, c[_COL["cpu_min"]][slot])
+                cpu_max = max(cpu_max, c[_COL["cpu_max"]][slot])
+                mem_min = min(mem_min, c[_COL["mem_min"]][slot])
+                mem_max = max(mem_max, c[_COL["mem_max"]][slot])
+
+        return {
+            "cpu_avg": cpu_sum / n,
+            "cpu_max": cpu_max,
+            "cpu_min": cpu_min,
+            "memory_avg": mem_sum / n,
+            "memory_max": mem_max,
+            "memory_min": mem_min,
+            "samples_count": int(n),
+        }
+
+    def clear(self):
+        for index, view in enumerate(self._views):
+            for col in view.cols:
+                for i in range(len(col)):
+                    col[i] = 0.0
+            self._set_last(index, -1)
+
+    def flush(self):
+        if self.writable:
+            self._mm.flush()
+
+    def close(self):
+        for view in self._views:
+            view.release()
+        self._buffer.release()
+        self.flush()
+        self._mm.close()
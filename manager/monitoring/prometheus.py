@@ -0,0 +1,183 @@
+"""Prometheus/OpenMetrics exporter"""
+import math
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+from manager.core.models import HealthStatus
+from manager.utils.logger import get_logger
+
+LOG = get_logger(__name__)
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+PREFIX = "orbitvpn"
+
+_NAME_INVALID = re.compile(r"[^a-zA-Z0-9_]")
+
+
+def _name(*parts: str) -> str:
+    return _NAME_INVALID.sub("_", "_".join(parts)).lower()
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: Any) -> Optional[float]:
+    if isinstance(value, bool):
+        return float(value)
+    if isinstance(value, (int, float)) and math.isfinite(value):
+        return float(value)
+    return None
+
+
+class _Family:
+    """One metric family: TYPE/HELP lines and its samples"""
+
+    def __init__(self, name: str, kind: str, help_text: str):
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self.samples: List[Tuple[str, Dict[str, Any], float]] = []
+
+    def add(self, value: float, suffix: str = "", **labels: Any):
+        self.samples.append((suffix, labels, value))
+
+    def render(self, lines: List[str]):
+        if not self.samples:
+            return
+        lines.append(f"# TYPE {self.name} {self.kind}")
+        lines.append(f"# HELP {self.name} {self.help}")
+        for suffix, labels, value in self.samples:
+            label_text = ",".join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+            sample = f"{self.name}{suffix}{{{label_text}}}" if label_text else f"{self.name}{suffix}"
+            lines.append(f"{sample} {float(value)!r}")
+
+
+class PrometheusExporter:
+    """
+    Serves /metrics in OpenMetrics text format on its own port.
+
+    The page is rendered by refresh() from what the supervisor already has:
+    the last health check results, the latest ServiceMetrics, and the bot's
+    counters and handler latencies read from Redis. A scrape only returns the
+    last rendered page, so it never runs checks or queries.
+    """
+
+    def __init__(self, supervisor, host: str = "127.0.0.1", port: int = 9090):
+        self.supervisor = supervisor
+        self.host = host
+        self.port = port
+        self._payload = b"# EOF\n"
+        self._runner: Optional[web.AppRunner] = None
+
+    # ----------------------------
+    # Rendering
+    # ----------------------------
+
+    def _service_families(self) -> List[_Family]:
+        up = _Family(_name(PREFIX, "service_up"), "gauge", "1 if the last health check was healthy")
+        status = _Family(_name(PREFIX, "service_health_status"), "gauge", "Last health status (1 for the current one)")
+        response = _Family(_name(PREFIX, "service_health_response_seconds"), "gauge", "Duration of the last health check")
+        checked = _Family(_name(PREFIX, "service_health_checked_timestamp_seconds"), "gauge", "Time of the last health check")
+
+        for service, result in sorted(self.supervisor.get_health_checker().get_all_results().items()):
+            up.add(1 if result.status == HealthStatus.HEALTHY else 0, service=service)
+            for state in HealthStatus:
+                status.add(1 if result.status == state else 0, service=service, status=state.value)
+            response.add(result.response_time_ms / 1000, service=service)
+            checked.add(result.checked_at.timestamp(), service=service)
+
+        cpu = _Family(_name(PREFIX, "service_cpu_percent"), "gauge", "CPU usage")
+        memory = _Family(_name(PREFIX, "service_memory_bytes"), "gauge", "Resident memory")
+        memory_percent = _Family(_name(PREFIX, "service_memory_percent"), "gauge", "Memory usage")
+        uptime = _Family(_name(PREFIX, "service_uptime_seconds"), "gauge", "Uptime")
+        restarts = _Family(_name(PREFIX, "service_restarts"), "gauge", "Restarts by the supervisor")
+        families = [up, status, response, checked, cpu, memory, memory_percent, uptime, restarts]
+
+        custom: Dict[str, _Family] = {}
+        for service, metrics in sorted(self.supervisor.get_metrics_collector().get_all_latest_metrics().items()):
+            cpu.add(metrics.cpu_percent, service=service)
+            memory.add(metrics.memory_mb * 1024 * 1024, service=service)
+            memory_percent.add(metrics.memory_percent, service=service)
+            uptime.add(metrics.uptime_seconds, service=service)
+            restarts.add(metrics.restart_count, service=service)
+
+            # Service-specific numbers (redis keyspace, postgres connections, marzban users, ...)
+            for key, value in sorted(metrics.custom_metrics.items()):
+                number = _number(value)
+                if number is None:
+                    continue
+                name = _name(PREFIX, service, key)
+                family = custom.get(name)
+                if family is None:
+                    family = custom[name] = _Family(name, "gauge", f"{service} {key.replace('_', ' ')}")
+                family.add(number)
+
+        return families + list(custom.values())
+
+    @staticmethod
+    async def _bot_families() -> List[_Family]:
+        """Counters and handler latencies the bot processes push to Redis"""
+        from app.utils.redis import init_cache, get_redis
+        from app.utils.instrumentation import get_counters, get_handler_metrics, parse_counter_field
+
+        await init_cache()
+        redis = await get_redis()
+
+        counters: Dict[str, _Family] = {}
+        for field, value in sorted((await get_counters(redis)).items()):
+            name, labels = parse_counter_field(field)
+            metric = _name(PREFIX, "bot", name)
+            family = counters.get(metric)
+            if family is None:
+                family = counters[metric] = _Family(metric, "counter", name.replace("_", " ").capitalize())
+            family.add(value, "_total", **labels)
+
+        latency = _Family(_name(PREFIX, "bot_handler_duration_seconds"), "summary", "Update handling time")
+        errors = _Family(_name(PREFIX, "bot_handler_errors"), "counter", "Updates that raised")
+        db = _Family(_name(PREFIX, "bot_handler_db_queries_avg"), "gauge", "SQL statements per update")
+        for item in (await get_handler_metrics(redis))["handlers"]:
+            key = item["key"]
+            for quantile in ("p50", "p95", "p99"):
+                latency.add(item[quantile], handler=key, quantile=f"0.{quantile[1:]}")
+            latency.add(item["count"], "_count", handler=key)
+            errors.add(item["errors"], "_total", handler=key)
+            db.add(item["db"], handler=key)
+
+        return list(counters.values()) + [latency, errors, db]
+
+    async def refresh(self):
+        """Render the page from current snapshots (called after each monitoring pass)"""
+        families = self._service_families()
+        try:
+            families += await self._bot_families()
+        except Exception as e:
+            LOG.warning(f"Could not read bot metrics for export: {e}")
+
+        lines: List[str] = []
+        for family in families:
+            family.render(lines)
+        lines.append("# EOF")
+        self._payload = ("\n".join(lines) + "\n").encode()
+
+    # ----------------------------
+    # Serving
+    # ----------------------------
+
+    async def _metrics(self, request: web.Request) -> web.Response:
+        return web.Response(body=self._payload, headers={"Content-Type": CONTENT_TYPE})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self._metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        LOG.info(f"Prometheus exporter listening on {self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
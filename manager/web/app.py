@@ -336,6 +336,34 @@ def create_app() -> FastAPI:
                 "total_configs": total_configs or 0
             }
 
+    @app.get("/api/jobs")
+    async def get_jobs(username: str = Depends(get_current_user)):
+        """Get bot scheduler jobs with their recent runs."""
+        from app.utils.redis import init_cache, get_redis
+        from app.utils.scheduler import get_job_states
+
+        try:
+            await init_cache()
+            redis = await get_redis()
+            return {"jobs": await get_job_states(redis)}
+        except Exception as e:
+            LOG.error(f"Failed to load scheduler jobs: {e}")
+            raise HTTPException(status_code=503, detail="Scheduler state unavailable")
+
+    @app.get("/api/handlers")
+    async def get_handlers(username: str = Depends(get_current_user)):
+        """Get bot handler latency percentiles and per-update resource usage."""
+        from app.utils.redis import init_cache, get_redis
+        from app.utils.instrumentation import get_handler_metrics
+
+        try:
+            await init_cache()
+            redis = await get_redis()
+            return await get_handler_metrics(redis)
+        except Exception as e:
+            LOG.error(f"Failed to load handler metrics: {e}")
+            raise HTTPException(status_code=503, detail="Handler metrics unavailable")
+
     @app.websocket("/ws/logs/{service_name}")
     async def websocket_logs(websocket: WebSocket, service_name: str):
         """WebSocket endpoint for real-time logs."""
@@ -6,24 +6,58 @@ from app.utils.redis import init_cache, close_cache
 from app.utils.rate_limit import RateLimitMiddleware, cleanup_rate_limit
 from app.utils.logging import get_logger, setup_aiogram_logger
 from app.utils.payment_cleanup import PaymentCleanupTask
+from app.utils.payment_polling import PaymentPollingTask
 from app.utils.notifications import SubscriptionNotificationTask
 from app.utils.config_cleanup import ConfigCleanupTask
 from app.utils.auto_renewal import AutoRenewalTask
+from app.utils.rates import rate_oracle
+from app.utils.ledger_rollup import LedgerRollupTask
+from app.utils.scheduler import Scheduler, IntervalTrigger, CronTrigger
+from app.utils.lifecycle_dispatcher import LifecycleDispatcher
+from app.utils.usage_sync import UsageSyncTask
+from app.payments.registry import gateway_registry
+from app.utils.send_queue import send_queue
+from app.utils.broadcast import broadcast_engine
+from app.utils.delivery import DeliveryStateMiddleware, delivery_tracker
+from app.utils.qr_cache import qr_cache
+from app.utils.webhook import WebhookServer, run_workers, wait_for_shutdown
+from app.utils.fsm_storage import RedisFSMStorage
+from app.utils.update_executor import UpdateExecutorMiddleware, update_executor
+from app.utils.instrumentation import (
+    InstrumentationMiddleware,
+    TelegramRequestCounter,
+    instrument_engine,
+    instrument_redis,
+    run_metrics_publisher,
+)
+from app.utils.redis import get_redis
+from app.repo.db import engine
 from app.repo.db import close_db
 from app.repo.init_db import init_database
-from config import bot
+from config import (
+    bot, CONFIG_RETENTION_DAYS, BOT_MODE,
+    WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_WORKERS
+)
 
 LOG = get_logger(__name__)
 
-async def main():
-    setup_aiogram_logger()
 
-    await init_database()
-    await init_cache()
-
-    dp = Dispatcher()
+def build_dispatcher():
+    # FSM state lives in Redis: flows survive restarts and span webhook workers
+    dp = Dispatcher(storage=RedisFSMStorage())
     dp.include_router(router)
 
+    # Serial per user, bounded parallelism across users
+    dp.update.outer_middleware(UpdateExecutorMiddleware(update_executor))
+
+    # Any interaction makes a user who was unreachable reachable again
+    dp.update.outer_middleware(DeliveryStateMiddleware())
+
+    # Outermost inner middleware, so the measured time includes locale and rate limiting
+    instrumentation = InstrumentationMiddleware()
+    dp.message.middleware(instrumentation)
+    dp.callback_query.middleware(instrumentation)
+
     dp.message.middleware(LocaleMiddleware())
     dp.callback_query.middleware(LocaleMiddleware())
 
@@ -43,46 +77,174 @@ async def main():
     )
     dp.message.middleware(limiter)
     dp.callback_query.middleware(limiter)
+    return dp, limiter
+
+
+async def main(worker: int = 0):
+    """
+    Run the bot. In polling mode this is the only process; in webhook mode it is
+    one of WEBHOOK_WORKERS processes, and worker 0 also runs the background jobs.
+    """
+    setup_aiogram_logger()
+    primary = worker == 0
+
+    if BOT_MODE == "polling":
+        await init_database()
+    await init_cache()
+
+    # Per-update DB / Redis / Bot API counters for the instrumentation middleware
+    instrument_engine(engine)
+    instrument_redis(await get_redis())
+    bot.session.middleware(TelegramRequestCounter())
+
+    # One user's updates are spread across webhook workers: order them through Redis too
+    update_executor.distributed = BOT_MODE == "webhook" and WEBHOOK_WORKERS > 1
+    dp, limiter = build_dispatcher()
+
+    # Handler latency histograms, executor and send queue stats for the manager dashboard
+    metrics_task = asyncio.create_task(run_metrics_publisher(
+        interval=30,
+        extra=lambda: {"executor": update_executor.get_stats(), "send_queue": send_queue.get_stats()},
+    ))
 
     rate_limit_cleanup_task = asyncio.create_task(
-        cleanup_rate_limit(limiter, interval=3600, max_age=3600)
+        cleanup_rate_limit(limiter, interval=3600)
+    )
+
+    # All background sends (notifications, receipts, broadcasts) go through one prioritized queue
+    send_queue.start(bot)
+
+    # Send outcomes are written to users' delivery state in batches
+    await delivery_tracker.start(sync=primary)
+
+    # Broadcasts interrupted by the last shutdown continue from their saved cursor
+    await broadcast_engine.start(bot, resume=primary)
+
+    # Keep exchange rates warm so payment creation never waits on the rate APIs;
+    # one worker polls them, the others read the rates it stores in Redis
+    if primary:
+        rate_oracle.start()
+
+    # Fold pending ledger credits into balances every minute, audit hourly
+    ledger_rollup = LedgerRollupTask(check_interval_seconds=60, audit_interval_seconds=3600)
+    if primary:
+        ledger_rollup.start()
+
+    # Periodic jobs: schedule persisted in Redis, one run per slot across all bot instances
+    scheduler = Scheduler()
+
+    payment_cleanup = PaymentCleanupTask(cleanup_days=7)
+    scheduler.add_job(
+        "payment_cleanup", payment_cleanup.run_once, IntervalTrigger(300),
+        jitter_seconds=30, max_runtime_seconds=240,
     )
 
-    payment_cleanup = PaymentCleanupTask(check_interval_seconds=300, cleanup_days=7)
-    payment_cleanup.start()
+    # Gateway checks of open TON / CryptoBot / YooKassa payments, one poller for all workers
+    payment_polling = PaymentPollingTask()
+    scheduler.add_job(
+        "payment_polling", payment_polling.run_once, IntervalTrigger(60),
+        max_runtime_seconds=300,
+    )
+
+    # Subscription lifecycle (expiry notifications, renewal, config cleanup) is driven by
+    # events indexed at their due time; the window scans below only run as daily sweeps
+    # that catch anything the index missed
+    subscription_notifications = SubscriptionNotificationTask(bot)
+    auto_renewal = AutoRenewalTask(bot)
+    lifecycle = LifecycleDispatcher(subscription_notifications, auto_renewal)
+    scheduler.add_job(
+        "lifecycle_dispatch", lifecycle.run_once, IntervalTrigger(30),
+        max_runtime_seconds=600,
+    )
 
-    subscription_notifications = SubscriptionNotificationTask(bot, check_interval_seconds=3600 * 3)
-    subscription_notifications.start()
+    scheduler.add_job(
+        "subscription_notifications", subscription_notifications.run_once, IntervalTrigger(86400),
+        jitter_seconds=1800, max_runtime_seconds=3600 * 2, run_on_start=False,
+    )
+    scheduler.add_job(
+        "auto_renewal", auto_renewal.run_once, IntervalTrigger(86400),
+        jitter_seconds=1800, max_runtime_seconds=3600, run_on_start=False,
+    )
 
-    # Start auto-renewal task (runs every 6 hours, renews subscriptions with sufficient balance)
-    auto_renewal = AutoRenewalTask(bot, check_interval_seconds=3600 * 6)
-    auto_renewal.start()
+    # Pulls traffic counters from the panel into the usage tables
+    usage_sync = UsageSyncTask(bot)
+    scheduler.add_job(
+        "usage_sync", usage_sync.run_once, IntervalTrigger(600),
+        jitter_seconds=60, max_runtime_seconds=540,
+    )
 
-    # Start config cleanup task (runs once per week, removes configs expired >14 days)
-    config_cleanup = ConfigCleanupTask(check_interval_seconds=86400 * 7, days_threshold=14)
-    config_cleanup.start()
+    # Removes configs expired >CONFIG_RETENTION_DAYS, weekly on Monday night (UTC)
+    config_cleanup = ConfigCleanupTask(days_threshold=CONFIG_RETENTION_DAYS)
+    scheduler.add_job(
+        "config_cleanup", config_cleanup.run_once, CronTrigger("0 3 * * 1"),
+        jitter_seconds=1800, max_runtime_seconds=3600 * 3, run_on_start=False,
+    )
 
-    LOG.info("Bot started...")
+    if primary:
+        scheduler.start()
 
+    server = None
     try:
-        await dp.start_polling(bot)
+        if BOT_MODE == "webhook":
+            server = WebhookServer(
+                dp, bot, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET, host=WEBHOOK_HOST, port=WEBHOOK_PORT,
+                executor=update_executor,
+            )
+            await server.start()
+            LOG.info(f"Bot worker {worker} started (webhook)")
+            await wait_for_shutdown()
+        else:
+            # Switching back from webhook mode: getUpdates is refused while a webhook is set
+            await bot.delete_webhook()
+            LOG.info("Bot started (polling)...")
+            await dp.start_polling(bot)
     finally:
+        if server:
+            await server.stop()
         rate_limit_cleanup_task.cancel()
-        payment_cleanup.stop()
-        subscription_notifications.stop()
-        auto_renewal.stop()
-        config_cleanup.stop()
+        metrics_task.cancel()
+        ledger_rollup.stop()
+        scheduler.stop()
+        await rate_oracle.stop()
+        await gateway_registry.close()
 
         try:
             await rate_limit_cleanup_task
         except asyncio.CancelledError:
             pass
+        await asyncio.gather(metrics_task, return_exceptions=True)
 
+        await broadcast_engine.stop()
+        await send_queue.stop()
+        await delivery_tracker.stop()
+        qr_cache.shutdown()
         await bot.session.close()
         await close_db()
         await close_cache()
         LOG.info("Bot stopped cleanly")
 
 
+async def prepare_webhook():
+    """Once per deployment, before the workers start: schema and webhook registration"""
+    await init_database()
+    dp, _ = build_dispatcher()
+    await bot.set_webhook(
+        url=WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET or None,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    LOG.info(f"Webhook set to {WEBHOOK_BASE_URL.rstrip('/')}{WEBHOOK_PATH}")
+    await bot.session.close()
+    await close_db()
+
+
+def run_worker(worker: int):
+    asyncio.run(main(worker))
+
+
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if BOT_MODE == "webhook":
+        asyncio.run(prepare_webhook())
+        run_workers(run_worker, WEBHOOK_WORKERS)
+    else:
+        asyncio.run(main())
\ No newline at end of file